@@ -6,19 +6,23 @@ import logging
 logger = logging.getLogger('Integration')
 
 #
-# Note that these functions have all be written for xx=yy=zz, so the grids are
-# identical in each direction. That's not essential here, though. The reason we
-# do it is because later we'll want to extrapolate, and it's not obvious how to
-# do so if the grids differ.
+# By default the same grid xx is used in each direction. two_pops and
+# three_pops also accept a separate grid for each population (see
+# _axis_grids), so that populations with small samples need not be integrated
+# on grids sized for the largest. For extrapolation, the grid sizes should then
+# be scaled together (see Numerics.make_extrap_func).
 #
 
 #: Controls use of Chang and Cooper's delj trick, which seems to lower accuracy.
 use_delj_trick = False
 
+import threading
+
 import numpy
 from numpy import newaxis as nuax
+import scipy.linalg, scipy.sparse, scipy.sparse.linalg
 
-import Misc, Numerics, tridiag
+import Misc, Numerics, Schedules, tridiag
 import integration_c as int_c
 
 #: Controls timestep for integrations. This is a reasonable default for
@@ -30,6 +34,115 @@ use_old_timestep = False
 #: Factor for told timestep method.
 old_timescale_factor = 0.1
 
+#: Number of threads used for 2D and 3D integration. See set_num_threads.
+num_threads = 1
+#: Number of tridiagonal systems solved together in the y sweeps of 2D and
+#: the z sweeps of 3D constant-parameter integration. See set_tridiag_width.
+tridiag_width = 4
+
+#: If True, 3D integrations with constant parameters assemble their
+#: coefficients on the fly from one-dimensional arrays, rather than storing
+#: nine full pts^3 arrays. Peak memory is then close to twice the size of phi,
+#: at the cost of a modestly slower integration.
+low_memory_3D = False
+
+#: If True, constant-parameter 2D and 3D integrations store phi and their
+#: coefficients in single precision, while still doing the arithmetic of each
+#: tridiagonal solve in double precision. This halves the memory used by 3D
+#: integrations and the memory traffic of the sweeps, at the cost of
+#: relative errors in the resulting spectra of order 1e-5 (see
+#: examples/benchmarks/float32_accuracy.py). phi is converted back to double
+#: precision at the end of each epoch.
+use_float32 = False
+
+#: Largest number of fixed point iterations used to find the timesteps of
+#: an integration with time-dependent parameters up front. See _time_grid.
+_time_grid_max_iterations = 50
+
+#: If True, one_pop, two_pops and three_pops choose their timesteps
+#: adaptively. Each step is taken once at full length and again as two half
+#: steps. The difference estimates the local error, and the step is accepted
+#: if that is below adaptive_tolerance, while the next step grows or shrinks
+#: to match it. Accepted steps are extrapolated to second order in time.
+#: Note that the timesteps then differ between grid sizes, which can make
+#: extrapolation less reliable.
+adaptive_timestep = False
+#: Target local error per step for adaptive timestepping, relative to the
+#: total of a small spectrum computed from phi.
+adaptive_tolerance = 1e-4
+#: Numbers of adaptive steps accepted and rejected since the last call to
+#: reset_step_counts. Integrations served from epoch_cache take no steps.
+#: Counts from concurrent integrations (e.g. under thread_map) are summed.
+step_counts = {'accepted': 0, 'rejected': 0}
+_step_counts_lock = threading.Lock()
+
+#: If True, one_pop, two_pops and three_pops raise the order of their time
+#: integration from one to two by Richardson extrapolation in dt. Each
+#: integration is run with its usual timesteps and again with half those
+#: timesteps, and the results combined as 2*fine - coarse, cancelling the
+#: leading error term. This costs three times as many steps as a single
+#: integration, but allows a much larger timescale_factor for the same
+#: accuracy. It has no effect with adaptive_timestep, which already
+#: extrapolates each step.
+use_richardson_in_time = False
+
+# Per-thread state for use_richardson_in_time. While an extrapolated
+# integration is running, dt_scale holds the factor applied to its timesteps.
+_time_state = threading.local()
+
+#: If True, constant-parameter one_pop and two_pops integrations are not
+#: stepped through time. Instead the sparse operator of the epoch is
+#: assembled once and phi is propagated to the end of the epoch with a Krylov
+#: approximation of the matrix exponential, so the cost barely depends on the
+#: length of the epoch. The result is exact in time, up to _krylov_tol, so it
+#: differs from the stepped integration by that integration's time
+#: discretization error.
+use_krylov_propagator = False
+#: If not None, constant-parameter two_pops integrations lasting longer than
+#: this many relaxation times skip straight to the equilibrium phi (see
+#: PhiManip.phi_2D_equilibrium). The relaxation time is that of the slowest
+#: decaying mode of the epoch's operator, so after 20 relaxation times the
+#: initial phi contributes a fraction of about exp(-20) = 2e-9. Integrations
+#: with frozen populations never skip.
+equilibrium_relaxation_times = None
+# Relative tolerance and maximum subspace dimension for the Krylov
+# propagator.
+_krylov_tol = 1e-10
+_krylov_max_dim = 100
+
+#: Cache of integration results, keyed by the content of their inputs, so
+#: identical epochs are only integrated once. Set epoch_cache.enabled = False
+#: to turn it off, and epoch_cache.max_bytes to limit its memory use.
+#: epoch_cache.stats() reports hits and misses. Integrations with parameters
+#: given as arbitrary Python functions of time are never cached.
+epoch_cache = Numerics.epoch_cache
+
+def _integration_settings():
+    """
+    Module settings that affect integration results, for keying the cache.
+    """
+    return (timescale_factor, use_delj_trick, use_old_timestep,
+            old_timescale_factor, low_memory_3D, adaptive_timestep,
+            adaptive_tolerance, use_richardson_in_time,
+            getattr(_time_state, 'dt_scale', None), use_krylov_propagator,
+            _krylov_tol, _krylov_max_dim, equilibrium_relaxation_times,
+            use_float32)
+
+def _timescale():
+    """
+    Factor by which timesteps are currently scaled. This is 1/2 within the
+    finer of the two integrations making up a use_richardson_in_time
+    extrapolation, and otherwise 1.
+    """
+    return getattr(_time_state, 'dt_scale', 1)
+
+def reset_step_counts():
+    """
+    Zero the counts of adaptive steps in step_counts.
+    """
+    with _step_counts_lock:
+        step_counts['accepted'] = step_counts['rejected'] = 0
+
 def set_timescale_factor(pts, factor=10):
     """
     Controls the fineness of timesteps during integration.
@@ -54,6 +167,149 @@ def set_timescale_factor(pts, factor=10):
                 '(Current value is %g.)' % timescale_factor)
     timescale_factor = Numerics.default_grid(pts)[1]/factor
 
+def set_num_threads(n=None):
+    """
+    Controls the number of threads used by the 2D and 3D integrations.
+
+    The sweeps over independent rows and columns of phi are split among n
+    threads. If n is None, all available cores are used. The default is a
+    single thread.
+
+    This requires dadi to have been built with OpenMP support. If it was not,
+    a warning is logged and integration remains single-threaded.
+    """
+    global num_threads
+    max_threads = int_c.get_max_threads()
+    if max_threads == 0:
+        logger.warn('dadi was built without OpenMP support, so integration '
+                    'will use a single thread.')
+        n = 1
+    elif n is None:
+        n = max_threads
+    num_threads = int(n)
+    int_c.set_num_threads(num_threads)
+
+def set_tridiag_width(k):
+    """
+    Controls how the tridiagonal systems along the last axis of phi are solved
+    in constant-parameter 2D and 3D integrations.
+
+    Along that axis each system is contiguous in memory. With k = 1 they are
+    solved one at a time. With k > 1, groups of k systems are interleaved and
+    solved together, so the arithmetic can be vectorized across systems.
+    Widths of 4 (the default) and 8 are specialized for this. Results are
+    the same for any k. examples/benchmarks/tridiag_interleaved.c compares
+    the speed of the widths.
+    """
+    global tridiag_width
+    k = int(k)
+    if k < 1:
+        raise ValueError('Tridiagonal width must be at least 1.')
+    tridiag_width = k
+    int_c.set_tridiag_width(tridiag_width)
+
+def thread_map(func, args, num_workers=None):
+    """
+    Apply func to each of args, running the calls concurrently in threads.
+
+    The C integration routines release Python's global interpreter lock, so
+    independent integrations (e.g. the components of a mixture model, or the
+    grid sizes of an extrapolation) can run at the same time in one process.
+    Unlike a process pool, this requires no pickling and no copies of the
+    data.
+
+    func: Function of one argument
+    args: Sequence of arguments to call func with
+    num_workers: Number of threads to use. If None, one per argument.
+
+    Returns the list of results, in the order of args.
+
+    Note that each integration will itself use num_threads OpenMP threads (see
+    set_num_threads), so with both it is easy to run more threads than cores.
+    """
+    from multiprocessing.pool import ThreadPool
+    args = list(args)
+    if num_workers is None:
+        num_workers = len(args)
+    if num_workers <= 1 or len(args) <= 1:
+        return [func(arg) for arg in args]
+
+    pool = ThreadPool(min(num_workers, len(args)))
+    try:
+        return pool.map(func, args)
+    finally:
+        pool.close()
+        pool.join()
+
+def _integrate_snapshots(integrate, phi, xx, times, initial_t, **kwargs):
+    """
+    Integrate through an increasing sequence of times, returning the phi at
+    each.
+
+    integrate: one_pop, two_pops, or three_pops
+    kwargs: Remaining arguments to integrate.
+
+    Each segment starts from where the last one stopped, so the final phi
+    matches a single integration up to differences in where the timesteps
+    fall.
+    """
+    times = list(times)
+    if numpy.any(numpy.diff([initial_t] + times) < 0):
+        raise ValueError('Snapshot times must be increasing and no earlier '
+                         'than initial_t (%f).' % initial_t)
+    phis = []
+    for T in times:
+        phi = integrate(phi, xx, T, initial_t=initial_t, **kwargs)
+        phis.append(phi)
+        initial_t = T
+    return phis
+
+def _extrapolate_in_time():
+    """
+    Whether an integration should be extrapolated with use_richardson_in_time.
+    The two integrations making up an extrapolation are not themselves
+    extrapolated.
+    """
+    return use_richardson_in_time and not adaptive_timestep\
+            and not hasattr(_time_state, 'dt_scale')
+
+def _richardson_in_time(integrate, phi, xx, T, **kwargs):
+    """
+    Integrate with second order accuracy in time, by Richardson extrapolation
+    of integrations with timesteps dt and dt/2.
+
+    integrate: one_pop, two_pops, or three_pops
+    kwargs: Remaining arguments to integrate.
+
+    The implicit scheme is first order in time, so the error of each
+    integration is C*dt + O(dt**2), and 2*fine - coarse is accurate to
+    O(dt**2).
+    """
+    _time_state.dt_scale = 1
+    try:
+        coarse = integrate(phi, xx, T, **kwargs)
+        _time_state.dt_scale = 0.5
+        fine = integrate(phi, xx, T, **kwargs)
+    finally:
+        del _time_state.dt_scale
+    return 2*fine - coarse
+
+def _axis_grids(xx, shape):
+    """
+    The grids along each axis of a phi of the given shape.
+
+    xx: A single grid, used for every axis, or a sequence of one grid per axis.
+    """
+    if isinstance(xx, (list, tuple)):
+        grids = tuple(numpy.asarray(grid, dtype=float) for grid in xx)
+    else:
+        grids = (xx,) * len(shape)
+    if len(grids) != len(shape)\
+       or any(len(grid) != pts for grid, pts in zip(grids, shape)):
+        raise ValueError('Grids of lengths %s do not match phi of shape %s.'
+                         % (str([len(grid) for grid in grids]), str(shape)))
+    return grids
+
 def _inject_mutations_1D(phi, dt, xx, theta0):
     """
     Inject novel mutations for a timestep.
@@ -88,6 +344,21 @@ def _inject_mutations_3D(phi, dt, xx, yy, zz, theta0, frozen1, frozen2, frozen3)
         phi[0,0,1] += dt/zz[1] * theta0/2 * 8/((zz[2] - zz[0]) * xx[1] * yy[1])
     return phi
 
+def _check_schedule_status(status):
+    """
+    Raise the appropriate error for a status code returned by the C
+    integrations of Schedules.
+    """
+    if status == 1:
+        raise ValueError('A time, population size, migration rate, or '
+                         'theta0 is < 0. Has the model been mis-specified?')
+    elif status == 2:
+        raise ValueError('A population size is 0. Has the model been '
+                         'mis-specified?')
+    elif status == 3:
+        raise ValueError('Timestep is zero. Has the model been '
+                         'mis-specified?')
+
 def _compute_dt(dx, nu, ms, gamma, h):
     """
     Compute the appropriate timestep given the current demographic params.
@@ -98,7 +369,7 @@ def _compute_dt(dx, nu, ms, gamma, h):
     multiplying the eqn through by some other 2N...)
     """
     if use_old_timestep:
-        return old_timescale_factor * dx[0]
+        return old_timescale_factor * _timescale() * dx[0]
 
     # These are the maxima for V_func and M_func over the domain
     # For h != 0.5, the maximum of M_func is not easy analytically. It is close
@@ -111,7 +382,7 @@ def _compute_dt(dx, nu, ms, gamma, h):
                 abs(gamma) * 2*max(numpy.abs(h + (1-2*h)*0.5) * 0.5*(1-0.5),
                                    numpy.abs(h + (1-2*h)*0.25) * 0.25*(1-0.25)))
     if maxVM > 0:
-        dt = timescale_factor / maxVM
+        dt = timescale_factor * _timescale() / maxVM
     else:
         dt = numpy.inf
     if dt == 0:
@@ -119,6 +390,289 @@ def _compute_dt(dx, nu, ms, gamma, h):
                          'gamma=%f, h=%f.' % (nu, str(ms), gamma, h))
     return dt
 
+def _compute_dt_array(dx, nu, ms, gamma, h):
+    """
+    _compute_dt for arrays of parameter values, one for each timestep.
+    """
+    if use_old_timestep:
+        return numpy.ones(len(nu)) * old_timescale_factor * _timescale()*dx[0]
+
+    hmax = numpy.maximum(numpy.abs(h + (1-2*h)*0.5) * 0.5*(1-0.5),
+                         numpy.abs(h + (1-2*h)*0.25) * 0.25*(1-0.25))
+    maxVM = numpy.maximum(numpy.maximum(0.25/nu, sum(ms)),
+                          abs(gamma) * 2*hmax)
+    with numpy.errstate(divide='ignore'):
+        dt = numpy.where(maxVM > 0, timescale_factor * _timescale() / maxVM,
+                         numpy.inf)
+    if numpy.any(dt == 0):
+        raise ValueError('Timestep is zero. Has the model been '
+                         'mis-specified?')
+    return dt
+
+def _vectorize_param(var, probe):
+    """
+    Version of the parameter var that takes an array of times.
+
+    var: A constant or a function of time.
+    probe: Array of times at which to check that var gives the same values
+           for an array of times as for one time at a time.
+
+    Returns None if var cannot be evaluated on an array of times.
+    """
+    if numpy.isscalar(var):
+        return lambda times: var * numpy.ones(len(times))
+    func = Misc.ensure_1arg_func(var)
+    try:
+        values = numpy.asarray(func(probe), dtype=float)
+        single = numpy.array([func(t) for t in probe], dtype=float)
+    except Exception:
+        # The function is written for one time at a time, for example using
+        # an if statement on t.
+        return None
+    if values.shape not in [(), probe.shape]\
+       or not numpy.allclose(values, single, rtol=1e-12, atol=0):
+        return None
+    return lambda times: numpy.asarray(func(times), dtype=float)\
+            * numpy.ones(len(times))
+
+def _time_grid(dt_of, T, initial_t):
+    """
+    Lengths of the timesteps of an integration from initial_t to T, where
+    the length of each step depends on the parameters at its start.
+
+    dt_of: Function returning the lengths of steps starting at each of an
+           array of times.
+
+    As in the loops of two_pops and three_pops, each step is as long as dt_of
+    gives for its start, but truncated at T. The start of each step depends
+    on the lengths of all those before it, so the steps are found by fixed
+    point iteration, starting from steps all as long as the first. Each
+    iteration evaluates dt_of once on all the steps. Once an iteration leaves
+    the steps unchanged, they are exactly those of stepping one at a time.
+
+    Returns None if the steps have not settled after
+    _time_grid_max_iterations iterations.
+    """
+    dts = dt_of(numpy.array([initial_t]))
+    for iteration in range(_time_grid_max_iterations):
+        # Steps beyond those computed so far are as long as the last.
+        acc = numpy.add.accumulate(numpy.concatenate(([initial_t], dts)))
+        if acc[-1] < T:
+            extra = int(numpy.ceil((T - acc[-1])/dts[-1])) + 1
+            dts = numpy.concatenate((dts, dts[-1]*numpy.ones(extra)))
+            acc = numpy.add.accumulate(numpy.concatenate(([initial_t], dts)))
+        nsteps = numpy.searchsorted(acc, T, side='left')
+        starts = acc[:nsteps]
+        new_dts = dt_of(starts)
+        if numpy.array_equal(new_dts, dts[:nsteps]):
+            steps = numpy.minimum(new_dts, T - starts)
+            # Truncation at T must only have shortened the last step.
+            ends = numpy.add.accumulate(numpy.concatenate(([initial_t],
+                                                           steps)))
+            if numpy.array_equal(ends[:-1], starts) and ends[-1] >= T:
+                return steps
+            return None
+        dts = new_dts
+    return None
+
+def _param_table(params, T, initial_t, compute_dt):
+    """
+    Timesteps and parameter values of an integration with time-dependent
+    parameters, all computed up front.
+
+    params: Parameters, as constants or functions of time
+    compute_dt: Function of an array holding the values of params at the
+                start of each step, one row per param, returning the lengths
+                of the steps.
+
+    Returns steps, the lengths of the timesteps, and values, an array whose
+    rows hold the values of each param at the end of each step, where the
+    implicit scheme uses them. Returns None if a param cannot be evaluated on
+    an array of times or the timesteps cannot be found, in which case the
+    integration must evaluate the params one step at a time.
+    """
+    probe = numpy.array([initial_t, T], dtype=float)
+    funcs = [_vectorize_param(var, probe) for var in params]
+    if any(func is None for func in funcs):
+        return None
+    def evaluate(times):
+        return numpy.array([func(times) for func in funcs])
+
+    steps = _time_grid(lambda times: compute_dt(evaluate(times)), T,
+                       initial_t)
+    if steps is None:
+        return None
+    ends = numpy.add.accumulate(numpy.concatenate(([initial_t], steps)))[1:]
+    return steps, evaluate(ends)
+
+def _adaptive_probe(xx):
+    """
+    Matrix projecting phi along one axis onto a small spectrum.
+
+    The error of adaptive steps is measured on this spectrum of sample size
+    10, rather than on phi itself. Near the boundaries of the grid the
+    implicit scheme is stiff, and the step doubling error there is large but
+    barely affects the spectra computed from phi.
+    """
+    n = 10
+    ii = numpy.arange(1, n)[:,nuax]
+    weights = numpy.zeros(len(xx))
+    weights[1:] += numpy.diff(xx)/2
+    weights[:-1] += numpy.diff(xx)/2
+    return numpy.exp(Numerics._lncomb(n, ii)) * xx**ii * (1-xx)**(n-ii)\
+            * weights
+
+def _adaptive_integrate(phi, xx, T, initial_t, dt, step):
+    """
+    Integrate from initial_t to T with error-controlled timesteps.
+
+    dt: Initial timestep
+    step: Function step(phi, t, dt) returning phi advanced one implicit step
+          from t to t+dt. It must not modify phi.
+
+    The implicit scheme is first order in time, so its local error is
+    O(dt**2) and the difference between one full step and two half steps
+    estimates it. The step is then completed by Richardson extrapolation,
+    2*half - full, which cancels that leading error term. (Extrapolated
+    implicit Euler remains L-stable, so this is safe for the stiff parts of
+    the problem.)
+    """
+    probes = [_adaptive_probe(grid) for grid in _axis_grids(xx, phi.shape)]
+    def project(phi):
+        for probe in probes:
+            phi = numpy.tensordot(phi, probe, axes=([0],[1]))
+        return phi
+
+    # Steps never shrink below this fraction of the initial step, so an
+    # integration cannot stall. Steps that small are accepted regardless.
+    min_dt = 1e-4 * dt
+    current_t = initial_t
+    while current_t < T:
+        this_dt = min(dt, T - current_t)
+        full = step(phi, current_t, this_dt)
+        half = step(phi, current_t, this_dt/2)
+        half = step(half, current_t + this_dt/2, this_dt/2)
+        fs_full, fs_half = project(full), project(half)
+        err = numpy.abs(fs_half - fs_full).sum() / numpy.abs(fs_half).sum()
+
+        if err <= adaptive_tolerance or this_dt <= min_dt:
+            phi = 2*half - full
+            current_t += this_dt
+            outcome = 'accepted'
+        else:
+            outcome = 'rejected'
+        with _step_counts_lock:
+            step_counts[outcome] += 1
+
+        if err > 0:
+            factor = min(max(0.9*numpy.sqrt(adaptive_tolerance/err), 0.2), 5)
+        else:
+            factor = 5
+        dt = max(this_dt*factor, min_dt)
+    return phi
+
+def _one_pop_adaptive(phi, xx, T, nu, gamma, h, theta0, initial_t):
+    """
+    Integrate one population with adaptive timesteps.
+    """
+    nu_f, gamma_f, h_f, theta0_f = [Misc.ensure_1arg_func(var) for var
+                                    in (nu, gamma, h, theta0)]
+    def step(phi, t, dt):
+        next_t = t + dt
+        nu, gamma, h = nu_f(next_t), gamma_f(next_t), h_f(next_t)
+        theta0 = theta0_f(next_t)
+        if numpy.any(numpy.less([nu,theta0], 0)):
+            raise ValueError('A time, population size, migration rate, or '
+                             'theta0 is < 0. Has the model been mis-specified?')
+        if numpy.any(numpy.equal([nu], 0)):
+            raise ValueError('A population size is 0. Has the model been '
+                             'mis-specified?')
+        phi = phi.copy()
+        _inject_mutations_1D(phi, dt, xx, theta0)
+        return int_c.implicit_1Dx(phi, xx, nu, gamma, h, dt,
+                                  use_delj_trick=use_delj_trick)
+
+    dt = _compute_dt(numpy.diff(xx), nu_f(initial_t), [0],
+                     gamma_f(initial_t), h_f(initial_t))
+    return _adaptive_integrate(phi, xx, T, initial_t, dt, step)
+
+def _two_pops_adaptive(phi, xx, T, params, initial_t, frozen1, frozen2):
+    """
+    Integrate two populations with adaptive timesteps.
+
+    params: The parameters nu1, nu2, m12, m21, gamma1, gamma2, h1, h2, and
+            theta0, as constants or functions of time.
+    """
+    xx, yy = _axis_grids(xx, phi.shape)
+    funcs = [Misc.ensure_1arg_func(var) for var in params]
+    def step(phi, t, dt):
+        nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0 = [f(t+dt) for f in funcs]
+        if numpy.any(numpy.less([nu1,nu2,m12,m21,theta0], 0)):
+            raise ValueError('A time, population size, migration rate, or '
+                             'theta0 is < 0. Has the model been mis-specified?')
+        if numpy.any(numpy.equal([nu1,nu2], 0)):
+            raise ValueError('A population size is 0. Has the model been '
+                             'mis-specified?')
+        phi = phi.copy()
+        _inject_mutations_2D(phi, dt, xx, yy, theta0, frozen1, frozen2)
+        if not frozen1:
+            phi = int_c.implicit_2Dx(phi, xx, yy, nu1, m12, gamma1, h1,
+                                     dt, use_delj_trick)
+        if not frozen2:
+            phi = int_c.implicit_2Dy(phi, xx, yy, nu2, m21, gamma2, h2,
+                                     dt, use_delj_trick)
+        return phi
+
+    nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0 = [f(initial_t) for f in funcs]
+    dx,dy = numpy.diff(xx),numpy.diff(yy)
+    dt = min(_compute_dt(dx,nu1,[m12],gamma1,h1),
+             _compute_dt(dy,nu2,[m21],gamma2,h2))
+    return _adaptive_integrate(phi, (xx, yy), T, initial_t, dt, step)
+
+def _three_pops_adaptive(phi, xx, T, params, initial_t, frozen1, frozen2,
+                         frozen3):
+    """
+    Integrate three populations with adaptive timesteps.
+
+    params: The parameters nu1, nu2, nu3, m12, m13, m21, m23, m31, m32,
+            gamma1, gamma2, gamma3, h1, h2, h3, and theta0, as constants or
+            functions of time.
+    """
+    xx, yy, zz = _axis_grids(xx, phi.shape)
+    funcs = [Misc.ensure_1arg_func(var) for var in params]
+    def step(phi, t, dt):
+        nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,gamma1,gamma2,gamma3,h1,h2,h3,\
+                theta0 = [f(t+dt) for f in funcs]
+        if numpy.any(numpy.less([nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,theta0],
+                                0)):
+            raise ValueError('A time, population size, migration rate, or '
+                             'theta0 is < 0. Has the model been mis-specified?')
+        if numpy.any(numpy.equal([nu1,nu2,nu3], 0)):
+            raise ValueError('A population size is 0. Has the model been '
+                             'mis-specified?')
+        phi = phi.copy()
+        _inject_mutations_3D(phi, dt, xx, yy, zz, theta0,
+                             frozen1, frozen2, frozen3)
+        if not frozen1:
+            phi = int_c.implicit_3Dx(phi, xx, yy, zz, nu1, m12, m13,
+                                     gamma1, h1, dt, use_delj_trick)
+        if not frozen2:
+            phi = int_c.implicit_3Dy(phi, xx, yy, zz, nu2, m21, m23,
+                                     gamma2, h2, dt, use_delj_trick)
+        if not frozen3:
+            phi = int_c.implicit_3Dz(phi, xx, yy, zz, nu3, m31, m32,
+                                     gamma3, h3, dt, use_delj_trick)
+        return phi
+
+    nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,gamma1,gamma2,gamma3,h1,h2,h3,\
+            theta0 = [f(initial_t) for f in funcs]
+    dx,dy,dz = numpy.diff(xx),numpy.diff(yy),numpy.diff(zz)
+    dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
+             _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
+             _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
+    return _adaptive_integrate(phi, (xx, yy, zz), T, initial_t, dt, step)
+
+@epoch_cache.cached(settings=_integration_settings)
 def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0, 
             frozen=False):
     """
@@ -133,7 +687,10 @@ def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0,
     h: Dominance coefficient. h = 0.5 corresponds to genic selection.
     theta0: Propotional to ancestral size. Typically constant.
 
-    T: Time at which to halt integration
+    T: Time at which to halt integration. This may also be an increasing
+       sequence of times, in which case a list of the phi's at each of those
+       times is returned, all computed in a single forward integration. (Each
+       phi can then be passed to Spectrum.from_phi.)
     initial_t: Time at which to start integration. (Note that this only matters
                if one of the demographic parameters is a function of time.)
 
@@ -141,6 +698,14 @@ def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0,
             In the one_pop case, this is equivalent to not running the
             integration at all.
     """
+    if not numpy.isscalar(T):
+        return _integrate_snapshots(one_pop, phi, xx, T, initial_t, nu=nu,
+                                    gamma=gamma, h=h, theta0=theta0,
+                                    frozen=frozen)
+    if _extrapolate_in_time():
+        return _richardson_in_time(one_pop, phi, xx, T, initial_t=initial_t,
+                                   nu=nu, gamma=gamma, h=h, theta0=theta0,
+                                   frozen=frozen)
     phi = phi.copy()
 
     # For a one population integration, freezing means just not integrating.
@@ -154,6 +719,9 @@ def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0,
                          'intial_time (%f). Integration cannot be run '
                          'backwards.' % (T, initial_t))
 
+    if adaptive_timestep:
+        return _one_pop_adaptive(phi, xx, T, nu, gamma, h, theta0, initial_t)
+
     vars_to_check = (nu, gamma, h, theta0)
     if numpy.all([numpy.isscalar(var) for var in vars_to_check]):
         return _one_pop_const_params(phi, xx, T, nu, gamma, h, theta0, 
@@ -193,6 +761,7 @@ def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0,
         current_t = next_t
     return phi
 
+@epoch_cache.cached(settings=_integration_settings)
 def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
              h1=0.5, h2=0.5, theta0=1, initial_t=0, frozen1=False, 
              frozen2=False):
@@ -200,24 +769,41 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
     Integrate a 2-dimensional phi foward.
 
     phi: Initial 2-dimensional phi
-    xx: 1-dimensional grid upon (0,1) overwhich phi is defined. It is assumed
-        that this grid is used in all dimensions.
-
-    nu's, gamma's, m's, and theta0 may be functions of time.
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions. Alternatively, a sequence (xx, yy) of one grid for each
+        population, for which phi has shape (len(xx), len(yy)). A population
+        with a small sample can then use a smaller grid.
+
+    nu's, gamma's, m's, and theta0 may be functions of time. If each is a
+    constant or a dadi.Schedules object, the integration runs entirely in C,
+    which is much faster than with arbitrary Python functions.
     nu1,nu2: Population sizes
     gamma1,gamma2: Selection coefficients on *all* segregating alleles
     h1,h2: Dominance coefficients. h = 0.5 corresponds to genic selection.
     m12,m21: Migration rates. Note that m12 is the rate *into 1 from 2*.
     theta0: Propotional to ancestral size. Typically constant.
 
-    T: Time at which to halt integration
+    T: Time at which to halt integration. This may also be an increasing
+       sequence of times, in which case a list of the phi's at each of those
+       times is returned, all computed in a single forward integration. (Each
+       phi can then be passed to Spectrum.from_phi.)
     initial_t: Time at which to start integration. (Note that this only matters
                if one of the demographic parameters is a function of time.)
 
-    Note: Generalizing to different grids in different phi directions is
-          straightforward. The tricky part will be later doing the extrapolation
-          correctly.
+    With different grids for different populations, extrapolation requires
+    that their sizes be scaled together. See Numerics.make_extrap_func.
     """
+    if not numpy.isscalar(T):
+        return _integrate_snapshots(two_pops, phi, xx, T, initial_t, nu1=nu1,
+                                    nu2=nu2, m12=m12, m21=m21, gamma1=gamma1,
+                                    gamma2=gamma2, h1=h1, h2=h2, theta0=theta0,
+                                    frozen1=frozen1, frozen2=frozen2)
+    if _extrapolate_in_time():
+        return _richardson_in_time(two_pops, phi, xx, T, initial_t=initial_t,
+                                   nu1=nu1, nu2=nu2, m12=m12, m21=m21,
+                                   gamma1=gamma1, gamma2=gamma2, h1=h1, h2=h2,
+                                   theta0=theta0, frozen1=frozen1,
+                                   frozen2=frozen2)
     phi = phi.copy()
 
     if T - initial_t == 0:
@@ -232,11 +818,50 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
                          'migration to or from it.')
 
     vars_to_check = [nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0]
+    if adaptive_timestep:
+        return _two_pops_adaptive(phi, xx, T, vars_to_check, initial_t,
+                                  frozen1, frozen2)
     if numpy.all([numpy.isscalar(var) for var in vars_to_check]):
         return _two_pops_const_params(phi, xx, T, nu1, nu2, m12, m21, 
                                       gamma1, gamma2, h1, h2, theta0, initial_t,
                                       frozen1, frozen2)
-    yy = xx
+    xx, yy = _axis_grids(xx, phi.shape)
+
+    # If the time-dependent parameters are all Schedules, the whole
+    # integration can be done in C.
+    params = Schedules._encode_params(vars_to_check)
+    if params is not None and not use_old_timestep:
+        return _two_pops_schedule(phi, (xx, yy), T, params, initial_t,
+                                  frozen1, frozen2)
+
+    # If the parameter functions accept arrays of times, the timesteps and
+    # all the parameter values are computed before stepping.
+    dx,dy = numpy.diff(xx),numpy.diff(yy)
+    def compute_dt(values):
+        nu1,nu2,m12,m21,gamma1,gamma2,h1,h2 = values[:8]
+        return numpy.minimum(_compute_dt_array(dx,nu1,[m12],gamma1,h1),
+                             _compute_dt_array(dy,nu2,[m21],gamma2,h2))
+    table = _param_table(vars_to_check, T, initial_t, compute_dt)
+    if table is not None:
+        steps, values = table
+        nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0 = values
+        if T < 0 or numpy.any(numpy.less([nu1,nu2,m12,m21,theta0], 0)):
+            raise ValueError('A time, population size, migration rate, or '
+                             'theta0 is < 0. Has the model been mis-specified?')
+        if numpy.any(numpy.equal([nu1,nu2], 0)):
+            raise ValueError('A population size is 0. Has the model been '
+                             'mis-specified?')
+        for this_dt, (nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0) \
+                in zip(steps, values.T):
+            _inject_mutations_2D(phi, this_dt, xx, yy, theta0, frozen1,
+                                 frozen2)
+            if not frozen1:
+                phi = int_c.implicit_2Dx(phi, xx, yy, nu1, m12, gamma1, h1,
+                                         this_dt, use_delj_trick)
+            if not frozen2:
+                phi = int_c.implicit_2Dy(phi, xx, yy, nu2, m21, gamma2, h2,
+                                         this_dt, use_delj_trick)
+        return phi
 
     nu1_f = Misc.ensure_1arg_func(nu1)
     nu2_f = Misc.ensure_1arg_func(nu2)
@@ -253,7 +878,6 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
     m12,m21 = m12_f(current_t), m21_f(current_t)
     gamma1,gamma2 = gamma1_f(current_t), gamma2_f(current_t)
     h1,h2 = h1_f(current_t), h2_f(current_t)
-    dx,dy = numpy.diff(xx),numpy.diff(yy)
     while current_t < T:
         dt = min(_compute_dt(dx,nu1,[m12],gamma1,h1),
                  _compute_dt(dy,nu2,[m21],gamma2,h2))
@@ -285,6 +909,7 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
         current_t = next_t
     return phi
 
+@epoch_cache.cached(settings=_integration_settings)
 def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
                m12=0, m13=0, m21=0, m23=0, m31=0, m32=0,
                gamma1=0, gamma2=0, gamma3=0, h1=0.5, h2=0.5, h3=0.5,
@@ -294,10 +919,14 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
     Integrate a 3-dimensional phi foward.
 
     phi: Initial 3-dimensional phi
-    xx: 1-dimensional grid upon (0,1) overwhich phi is defined. It is assumed
-        that this grid is used in all dimensions.
-
-    nu's, gamma's, m's, and theta0 may be functions of time.
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions. Alternatively, a sequence (xx, yy, zz) of one grid for
+        each population, for which phi has shape (len(xx), len(yy), len(zz)).
+        A population with a small sample can then use a smaller grid.
+
+    nu's, gamma's, m's, and theta0 may be functions of time. If each is a
+    constant or a dadi.Schedules object, the integration runs entirely in C,
+    which is much faster than with arbitrary Python functions.
     nu1,nu2,nu3: Population sizes
     gamma1,gamma2,gamma3: Selection coefficients on *all* segregating alleles
     h1,h2,h3: Dominance coefficients. h = 0.5 corresponds to genic selection.
@@ -305,14 +934,32 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
                              *into 1 from 2*.
     theta0: Propotional to ancestral size. Typically constant.
 
-    T: Time at which to halt integration
+    T: Time at which to halt integration. This may also be an increasing
+       sequence of times, in which case a list of the phi's at each of those
+       times is returned, all computed in a single forward integration. (Each
+       phi can then be passed to Spectrum.from_phi.)
     initial_t: Time at which to start integration. (Note that this only matters
                if one of the demographic parameters is a function of time.)
 
-    Note: Generalizing to different grids in different phi directions is
-          straightforward. The tricky part will be later doing the extrapolation
-          correctly.
+    With different grids for different populations, extrapolation requires
+    that their sizes be scaled together. See Numerics.make_extrap_func.
     """
+    if not numpy.isscalar(T):
+        return _integrate_snapshots(three_pops, phi, xx, T, initial_t,
+                                    nu1=nu1, nu2=nu2, nu3=nu3, m12=m12,
+                                    m13=m13, m21=m21, m23=m23, m31=m31,
+                                    m32=m32, gamma1=gamma1, gamma2=gamma2,
+                                    gamma3=gamma3, h1=h1, h2=h2, h3=h3,
+                                    theta0=theta0, frozen1=frozen1,
+                                    frozen2=frozen2, frozen3=frozen3)
+    if _extrapolate_in_time():
+        return _richardson_in_time(three_pops, phi, xx, T, initial_t=initial_t,
+                                   nu1=nu1, nu2=nu2, nu3=nu3, m12=m12,
+                                   m13=m13, m21=m21, m23=m23, m31=m31,
+                                   m32=m32, gamma1=gamma1, gamma2=gamma2,
+                                   gamma3=gamma3, h1=h1, h2=h2, h3=h3,
+                                   theta0=theta0, frozen1=frozen1,
+                                   frozen2=frozen2, frozen3=frozen3)
     phi = phi.copy()
 
     if T - initial_t == 0:
@@ -331,12 +978,60 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
 
     vars_to_check = [nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,gamma1,gamma2,
                      gamma3,h1,h2,h3,theta0]
+    if adaptive_timestep:
+        return _three_pops_adaptive(phi, xx, T, vars_to_check, initial_t,
+                                    frozen1, frozen2, frozen3)
     if numpy.all([numpy.isscalar(var) for var in vars_to_check]):
         return _three_pops_const_params(phi, xx, T, nu1, nu2, nu3, 
                                         m12, m13, m21, m23, m31, m32, 
                                         gamma1, gamma2, gamma3, h1, h2, h3,
                                         theta0, initial_t)
-    zz = yy = xx
+    xx, yy, zz = _axis_grids(xx, phi.shape)
+
+    params = Schedules._encode_params(vars_to_check)
+    if params is not None and not use_old_timestep:
+        phi, status = int_c.integrate_schedule_3D(phi, xx, yy, zz, params, T,
+                                                  initial_t,
+                                                  timescale_factor
+                                                  * _timescale(),
+                                                  frozen1, frozen2, frozen3,
+                                                  use_delj_trick)
+        _check_schedule_status(status[0])
+        return phi
+
+    # As in two_pops, parameter functions that accept arrays of times are
+    # evaluated for all the timesteps at once.
+    dx,dy,dz = numpy.diff(xx),numpy.diff(yy),numpy.diff(zz)
+    def compute_dt(values):
+        nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,gamma1,gamma2,gamma3,h1,h2,h3\
+                = values[:15]
+        return numpy.minimum(numpy.minimum(
+                _compute_dt_array(dx,nu1,[m12,m13],gamma1,h1),
+                _compute_dt_array(dy,nu2,[m21,m23],gamma2,h2)),
+                _compute_dt_array(dz,nu3,[m31,m32],gamma3,h3))
+    table = _param_table(vars_to_check, T, initial_t, compute_dt)
+    if table is not None:
+        steps, values = table
+        if T < 0 or numpy.any(numpy.less(values[[0,1,2,3,4,5,6,7,8,15]], 0)):
+            raise ValueError('A time, population size, migration rate, or '
+                             'theta0 is < 0. Has the model been mis-specified?')
+        if numpy.any(numpy.equal(values[:3], 0)):
+            raise ValueError('A population size is 0. Has the model been '
+                             'mis-specified?')
+        for this_dt, (nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,gamma1,gamma2,
+                      gamma3,h1,h2,h3,theta0) in zip(steps, values.T):
+            _inject_mutations_3D(phi, this_dt, xx, yy, zz, theta0,
+                                 frozen1, frozen2, frozen3)
+            if not frozen1:
+                phi = int_c.implicit_3Dx(phi, xx, yy, zz, nu1, m12, m13,
+                                         gamma1, h1, this_dt, use_delj_trick)
+            if not frozen2:
+                phi = int_c.implicit_3Dy(phi, xx, yy, zz, nu2, m21, m23,
+                                         gamma2, h2, this_dt, use_delj_trick)
+            if not frozen3:
+                phi = int_c.implicit_3Dz(phi, xx, yy, zz, nu3, m31, m32,
+                                         gamma3, h3, this_dt, use_delj_trick)
+        return phi
 
     nu1_f = Misc.ensure_1arg_func(nu1)
     nu2_f = Misc.ensure_1arg_func(nu2)
@@ -363,7 +1058,6 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
     gamma1,gamma2 = gamma1_f(current_t), gamma2_f(current_t)
     gamma3 = gamma3_f(current_t)
     h1,h2,h3 = h1_f(current_t), h2_f(current_t), h3_f(current_t)
-    dx,dy,dz = numpy.diff(xx),numpy.diff(yy),numpy.diff(zz)
     dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
              _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
              _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
@@ -409,6 +1103,111 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
         current_t = next_t
     return phi
 
+def two_pops_batched(phis, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0,
+                     gamma2=0, h1=0.5, h2=0.5, theta0=1, initial_t=0,
+                     frozen1=False, frozen2=False):
+    """
+    Integrate a stack of 2-dimensional phi's forward through one shared loop.
+
+    This is useful for models that mix several components (e.g. neutral,
+    genomic islands, and regions of reduced Ne), which otherwise each require a
+    separate call to two_pops over the same grid and time interval.
+
+    phis: Sequence of K initial 2-dimensional phi's, or a single array of
+          shape (K, len(xx), len(yy)).
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in both
+        dimensions, or a sequence (xx, yy) of one grid for each population.
+
+    nu's, gamma's, h's, m's, and theta0 may each be a constant or a sequence of
+    K constants, one per phi. Time-dependent parameters are not supported; use
+    two_pops for those.
+
+    T: Time at which to halt integration
+    initial_t: Time at which to start integration.
+    frozen1,frozen2: If True, that population is frozen for all phi's.
+
+    Returns an array of shape (K, len(xx), len(yy)) holding the integrated
+    phi's, in the same order as phis.
+
+    Each phi is stepped with the same timesteps two_pops would have used for
+    it, so with the default settings results are identical to separate
+    two_pops calls. Phi's that finish in fewer steps are simply skipped by the
+    remaining sweeps. If use_richardson_in_time, adaptive_timestep,
+    use_krylov_propagator, equilibrium_relaxation_times or use_float32 is
+    set, the phi's are instead integrated by separate two_pops calls, which
+    honour those settings.
+    """
+    phis = numpy.array(phis, dtype=float)
+    if phis.ndim != 3:
+        raise ValueError('phis must be a stack of 2-dimensional phi arrays.')
+    K = phis.shape[0]
+
+    if T - initial_t == 0:
+        return phis
+    elif T - initial_t < 0:
+        raise ValueError('Final integration time T (%f) is less than '
+                         'intial_time (%f). Integration cannot be run '
+                         'backwards.' % (T, initial_t))
+
+    params = [nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0]
+    if any(callable(var) for var in params):
+        raise ValueError('two_pops_batched only supports constant parameters. '
+                         'Use two_pops for time-dependent parameters.')
+    params = [numpy.asarray(var, dtype=float) * numpy.ones(K)
+              if numpy.isscalar(var) else numpy.asarray(var, dtype=float)
+              for var in params]
+    if any(var.shape != (K,) for var in params):
+        raise ValueError('Each parameter must be a constant or a sequence of '
+                         'length %i, matching the number of phis.' % K)
+    nu1,nu2,m12,m21,gamma1,gamma2,h1,h2,theta0 = params
+
+    if (frozen1 or frozen2) and (numpy.any(m12 != 0) or numpy.any(m21 != 0)):
+        raise ValueError('Population cannot be frozen and have non-zero '
+                         'migration to or from it.')
+    if numpy.any(numpy.less([nu1,nu2,m12,m21,theta0], 0)):
+        raise ValueError('A time, population size, migration rate, or theta0 '
+                         'is < 0. Has the model been mis-specified?')
+    if numpy.any(numpy.equal([nu1,nu2], 0)):
+        raise ValueError('A population size is 0. Has the model been '
+                         'mis-specified?')
+    if use_richardson_in_time or adaptive_timestep or use_krylov_propagator\
+       or equilibrium_relaxation_times is not None or use_float32:
+        # The batched loop only does plain timestepping in double precision.
+        return numpy.array([two_pops(phis[kk], xx, T, nu1[kk], nu2[kk],
+                                     m12[kk], m21[kk], gamma1[kk], gamma2[kk],
+                                     h1[kk], h2[kk], theta0[kk], initial_t,
+                                     frozen1, frozen2) for kk in range(K)])
+    xx, yy = _axis_grids(xx, phis.shape[1:])
+
+    ax, bx, cx, ay, by, cy = [numpy.empty(phis.shape) for ii in range(6)]
+    for kk in range(K):
+        ax[kk], bx[kk], cx[kk], ay[kk], by[kk], cy[kk] \
+                = _two_pops_const_abc(xx, yy, nu1[kk], nu2[kk],
+                                      m12[kk], m21[kk], gamma1[kk], gamma2[kk],
+                                      h1[kk], h2[kk])
+
+    dx,dy = numpy.diff(xx),numpy.diff(yy)
+    dt = numpy.array([min(_compute_dt(dx,nu1[kk],[m12[kk]],gamma1[kk],h1[kk]),
+                          _compute_dt(dy,nu2[kk],[m21[kk]],gamma2[kk],h2[kk]))
+                      for kk in range(K)])
+    current_t = initial_t * numpy.ones(K)
+    while numpy.any(current_t < T):
+        # Phi's that have already reached T get a zero timestep.
+        this_dt = numpy.maximum(numpy.minimum(dt, T - current_t), 0)
+        # Moving the stack axis last lets _inject_mutations_2D update the [1,0]
+        # and [0,1] entries of every phi at once.
+        _inject_mutations_2D(phis.transpose(1,2,0), this_dt, xx, yy, theta0,
+                             frozen1, frozen2)
+        if not frozen1:
+            phis = int_c.implicit_precalc_2Dx_batched(phis, ax, bx, cx,
+                                                      this_dt)
+        if not frozen2:
+            phis = int_c.implicit_precalc_2Dy_batched(phis, ay, by, cy,
+                                                      this_dt)
+        current_t += this_dt
+
+    return phis
+
 #
 # Here are the python versions of the population genetic functions.
 #
@@ -471,6 +1270,37 @@ def _one_pop_const_params(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1,
         raise ValueError('A population size is 0. Has the model been '
                          'mis-specified?')
 
+    a, b, c = _one_pop_const_abc(xx, nu, gamma, h)
+
+    if use_krylov_propagator:
+        A = scipy.sparse.diags([a[1:], b, c[:-1]], [-1, 0, 1])
+        source = _inject_mutations_1D(numpy.zeros(phi.shape), 1, xx, theta0)
+        return _krylov_propagate(A, source, phi, T - initial_t)
+
+    dx = numpy.diff(xx)
+    dt = _compute_dt(dx,nu,[0],gamma,h)
+    # All steps but the last have the same dt, so we factor the matrix once
+    # and only do the substitution steps each time.
+    gam, bet = tridiag.tridiag_factor(a, b+1/dt, c)
+    current_t = initial_t
+    while current_t < T:    
+        this_dt = min(dt, T - current_t)
+
+        _inject_mutations_1D(phi, this_dt, xx, theta0)
+        r = phi/this_dt
+        if this_dt == dt:
+            phi = tridiag.tridiag_solve_factored(a, gam, bet, r)
+        else:
+            phi = tridiag.tridiag(a, b+1/this_dt, c, r)
+        current_t += this_dt
+    return phi
+
+def _one_pop_const_abc(xx, nu, gamma, h):
+    """
+    a,b,c arrays for a constant-parameter 1D integration.
+
+    Note that the b array does *not* include the 1/dt contribution.
+    """
     M = _Mfunc1D(xx, gamma, h)
     MInt = _Mfunc1D((xx[:-1] + xx[1:])/2, gamma, h)
     V = _Vfunc(xx, nu)
@@ -480,13 +1310,13 @@ def _one_pop_const_params(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1,
     dfactor = _compute_dfactor(dx)
     delj = _compute_delj(dx, MInt, VInt)
 
-    a = numpy.zeros(phi.shape)
+    a = numpy.zeros(len(xx))
     a[1:] += dfactor[1:]*(-MInt * delj - V[:-1]/(2*dx))
 
-    c = numpy.zeros(phi.shape)
+    c = numpy.zeros(len(xx))
     c[:-1] += -dfactor[:-1]*(-MInt * (1-delj) + V[1:]/(2*dx))
 
-    b = numpy.zeros(phi.shape)
+    b = numpy.zeros(len(xx))
     b[:-1] += -dfactor[:-1]*(-MInt * delj - V[:-1]/(2*dx))
     b[1:] += dfactor[1:]*(-MInt * (1-delj) + V[1:]/(2*dx))
 
@@ -494,17 +1324,77 @@ def _one_pop_const_params(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1,
         b[0] += (0.5/nu - M[0])*2/dx[0]
     if(M[-1] >= 0):
         b[-1] += -(-0.5/nu - M[-1])*2/dx[-1]
+    return a, b, c
 
-    dt = _compute_dt(dx,nu,[0],gamma,h)
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
-
-        _inject_mutations_1D(phi, this_dt, xx, theta0)
-        r = phi/this_dt
-        phi = tridiag.tridiag(a, b+1/this_dt, c, r)
-        current_t += this_dt
-    return phi
+def _krylov_propagate(A, source, phi, T):
+    """
+    Exact solution after time T of d(phi)/dt = -A phi + source.
+
+    A: Sparse matrix acting on phi.ravel(), the operator whose implicit
+       steps solve (I + dt*A) phi_new = phi_old.
+    source: Array shaped like phi, the constant rate of mutation injection.
+
+    The source is handled by appending a constant 1 to phi, so the solution
+    is the exponential of the augmented matrix
+        B = [[-A, source], [0, 0]]
+    applied to (phi, 1). A is very stiff, so a polynomial Krylov method
+    would need a number of iterations growing with T times the norm of A.
+    Instead this is a shift-and-invert Krylov method, building its subspace
+    from (I - g*B)^-1, with one sparse LU factorization of I + g*A. The
+    number of iterations is then nearly independent of both the stiffness
+    and T. (See van den Eshof and Hochbruck, SIAM J Sci Comput 27:1438
+    (2006).)
+    """
+    if T == 0:
+        return phi.copy()
+    N = A.shape[0]
+    source = source.ravel()
+    g = T/10.
+    lu = scipy.sparse.linalg.splu(scipy.sparse.csc_matrix(
+        scipy.sparse.identity(N) + g*A))
+
+    x = numpy.append(phi.ravel(), 1)
+    beta = numpy.linalg.norm(x)
+    V = numpy.zeros((_krylov_max_dim+1, N+1))
+    H = numpy.zeros((_krylov_max_dim+1, _krylov_max_dim))
+    V[0] = x/beta
+    last = None
+    for m in range(1, _krylov_max_dim+1):
+        # w = (I - g*B)^-1 v
+        v = V[m-1]
+        w = numpy.empty(N+1)
+        w[-1] = v[-1]
+        w[:-1] = lu.solve(v[:-1] + g*source*v[-1])
+        # Modified Gram-Schmidt, repeated once to keep the basis orthogonal.
+        for reorth in range(2):
+            for ii in range(m):
+                proj = numpy.dot(V[ii], w)
+                H[ii,m-1] += proj
+                w -= proj*V[ii]
+        H[m,m-1] = numpy.linalg.norm(w)
+
+        # In the subspace, B is approximated by (I - H^-1)/g. Eigenvalues of
+        # H near zero correspond to the stiffest modes, which have decayed
+        # completely. Roundoff can push them to or below zero, where the
+        # exponential would blow up, so they are set to decay explicitly.
+        evals, evecs = numpy.linalg.eig(H[:m,:m])
+        decay = numpy.zeros(m, complex)
+        live = evals.real > 1e-12
+        decay[live] = numpy.exp(T/g * (1 - 1/evals[live]))
+        y = beta * numpy.dot(evecs * decay,
+                             numpy.linalg.solve(evecs, numpy.eye(m)[:,0])).real
+        result = numpy.dot(y, V[:m])
+        if H[m,m-1] <= 1e-12*beta:
+            break
+        if last is not None and numpy.linalg.norm(result - last)\
+           <= _krylov_tol*numpy.linalg.norm(result):
+            break
+        last = result
+        V[m] = w/H[m,m-1]
+    else:
+        logger.warn('Krylov propagator did not converge in %i iterations.'
+                    % _krylov_max_dim)
+    return result[:-1].reshape(phi.shape)
 
 def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
                            gamma1=0, gamma2=0, h1=0.5, h2=0.5, theta0=1, 
@@ -518,8 +1408,127 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
     if numpy.any(numpy.equal([nu1,nu2], 0)):
         raise ValueError('A population size is 0. Has the model been '
                          'mis-specified?')
-    yy = xx
+    xx, yy = _axis_grids(xx, phi.shape)
 
+    ax, bx, cx, ay, by, cy = _two_pops_const_abc(xx, yy, nu1, nu2, m12, m21,
+                                                 gamma1, gamma2, h1, h2)
+
+    if equilibrium_relaxation_times is not None\
+       and not (frozen1 or frozen2):
+        A = _two_pops_const_operator(ax, bx, cx, ay, by, cy)
+        if (T - initial_t) * _slowest_rate(A) > equilibrium_relaxation_times:
+            return _two_pops_equilibrium(A, xx, yy, theta0)
+
+    if use_krylov_propagator:
+        if frozen1 and frozen2:
+            return phi
+        A = _two_pops_const_operator(ax, bx, cx, ay, by, cy, frozen1, frozen2)
+        source = _inject_mutations_2D(numpy.zeros(phi.shape), 1, xx, yy,
+                                      theta0, frozen1, frozen2)
+        return _krylov_propagate(A, source, phi, T - initial_t)
+
+    dx,dy = numpy.diff(xx),numpy.diff(yy)
+    dt = min(_compute_dt(dx,nu1,[m12],gamma1,h1),
+             _compute_dt(dy,nu2,[m21],gamma2,h2))
+    # The whole timestep loop, including mutation injection, runs in C.
+    if use_float32:
+        coefs = [coef.astype(numpy.float32) for coef in (ax,bx,cx,ay,by,cy)]
+        phi = int_c.integrate_precalc_2D_fl(phi.astype(numpy.float32), xx, yy,
+                                            *(coefs + [dt, T, initial_t,
+                                                       theta0, frozen1,
+                                                       frozen2]))
+        return phi.astype(numpy.float64)
+    phi = int_c.integrate_precalc_2D(phi, xx, yy, ax, bx, cx, ay, by, cy,
+                                     dt, T, initial_t, theta0,
+                                     frozen1, frozen2)
+    return phi
+
+def _two_pops_const_operator(ax, bx, cx, ay, by, cy, frozen1=False,
+                             frozen2=False):
+    """
+    Sparse operator A of a constant-parameter 2D integration, such that
+    d(phi)/dt = -A phi + (injected mutations).
+
+    The a,b,c arrays are those from _two_pops_const_abc. A acts on
+    phi.ravel(), for which the x direction has stride len(yy) and the y
+    direction stride 1. Frozen populations do not contribute.
+    """
+    ny = ax.shape[1]
+    diagonals, offsets = [], []
+    if not frozen1:
+        diagonals += [ax.ravel()[ny:], bx.ravel(), cx.ravel()[:-ny]]
+        offsets += [-ny, 0, ny]
+    if not frozen2:
+        diagonals += [ay.ravel()[1:], by.ravel(), cy.ravel()[:-1]]
+        offsets += [-1, 0, 1]
+    return scipy.sparse.csc_matrix(sum(scipy.sparse.diags(d, o) for d, o
+                                       in zip(diagonals, offsets)))
+
+def _slowest_rate(A):
+    """
+    Rate at which the slowest mode of d(phi)/dt = -A phi decays.
+
+    phi relaxes to equilibrium on a timescale of 1/rate.
+    """
+    evals = scipy.sparse.linalg.eigs(A, k=1, sigma=0,
+                                     return_eigenvectors=False)
+    return abs(evals[0].real)
+
+def _two_pops_equilibrium(A, xx, yy, theta0):
+    """
+    Stationary phi for the operator A from _two_pops_const_operator.
+
+    This solves A phi = (injected mutations) directly.
+    """
+    source = _inject_mutations_2D(numpy.zeros((len(xx), len(yy))), 1, xx, yy,
+                                  theta0, False, False)
+    phi = scipy.sparse.linalg.spsolve(A, source.ravel())
+    return phi.reshape(source.shape)
+
+def _two_pops_schedule(phi, xx, T, params, initial_t=0, frozen1=False,
+                       frozen2=False):
+    """
+    Integrate two populations with parameters given by Schedules.
+
+    params: Table of the parameters nu1, nu2, m12, m21, gamma1, gamma2, h1,
+            h2, and theta0, from Schedules._encode_params.
+    """
+    xx, yy = _axis_grids(xx, phi.shape)
+    fixed = params[2:8,0] == Schedules._CONSTANT
+    if numpy.all(fixed) and not use_delj_trick:
+        # Only the population sizes and theta0 change over time. The a,b,c
+        # coefficients are then the sum of fixed migration and selection
+        # terms plus drift terms that scale as 1/nu. An infinite nu gives us
+        # the former, and the difference from nu = 1 the latter.
+        m12, m21, gamma1, gamma2, h1, h2 = params[2:8,1]
+        abc_M = list(_two_pops_const_abc(xx, yy, numpy.inf, numpy.inf,
+                                         m12, m21, gamma1, gamma2, h1, h2))
+        abc_1 = _two_pops_const_abc(xx, yy, 1, 1, m12, m21,
+                                    gamma1, gamma2, h1, h2)
+        abc_V = [c1 - cM for (c1, cM) in zip(abc_1, abc_M)]
+        phi, status = int_c.integrate_nu_schedule_2D(phi, xx, yy,
+                                                     *(abc_M[:3] + abc_V[:3]
+                                                       + abc_M[3:] + abc_V[3:]
+                                                       + [params, T, initial_t,
+                                                          timescale_factor
+                                                          * _timescale(),
+                                                          frozen1, frozen2]))
+    else:
+        phi, status = int_c.integrate_schedule_2D(phi, xx, yy, params, T,
+                                                  initial_t,
+                                                  timescale_factor
+                                                  * _timescale(),
+                                                  frozen1, frozen2,
+                                                  use_delj_trick)
+    _check_schedule_status(status[0])
+    return phi
+
+def _two_pops_const_abc(xx, yy, nu1, nu2, m12, m21, gamma1, gamma2, h1, h2):
+    """
+    a,b,c arrays for the x and y sweeps of a constant-parameter 2D integration.
+
+    Note that the b arrays do *not* include the 1/dt contribution.
+    """
     # The use of nuax (= numpy.newaxis) here is for memory conservation. We
     # could just create big X and Y arrays which only varied along one axis,
     # but that would be wasteful.
@@ -543,7 +1552,8 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
 
     # The nuax's here broadcast the our various arrays to have the proper shape
     # to fit into ax,bx,cx
-    ax, bx, cx = [numpy.zeros(phi.shape) for ii in range(3)]
+    shape = (len(xx), len(yy))
+    ax, bx, cx = [numpy.zeros(shape) for ii in range(3)]
     ax[ 1:] += dfact_x[ 1:,nuax]*(-MxInt*deljx    - Vx[:-1,nuax]/(2*dx[:,nuax]))
     cx[:-1] += dfact_x[:-1,nuax]*( MxInt*(1-deljx)- Vx[ 1:,nuax]/(2*dx[:,nuax]))
     bx[:-1] += dfact_x[:-1,nuax]*( MxInt*deljx    + Vx[:-1,nuax]/(2*dx[:,nuax]))
@@ -554,7 +1564,7 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
     if Mx[-1,-1] >= 0:
         bx[-1,-1] += -(-0.5/nu1 - Mx[-1,-1])*2/dx[-1]
 
-    ay, by, cy = [numpy.zeros(phi.shape) for ii in range(3)]
+    ay, by, cy = [numpy.zeros(shape) for ii in range(3)]
     ay[:, 1:] += dfact_y[ 1:]*(-MyInt*deljy     - Vy[nuax,:-1]/(2*dy))
     cy[:,:-1] += dfact_y[:-1]*( MyInt*(1-deljy) - Vy[nuax, 1:]/(2*dy))
     by[:,:-1] += dfact_y[:-1]*( MyInt*deljy     + Vy[nuax,:-1]/(2*dy))
@@ -565,19 +1575,7 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
     if My[-1,-1] >= 0:
         by[-1,-1] += -(-0.5/nu2 - My[-1,-1])*2/dy[-1]
 
-    dt = min(_compute_dt(dx,nu1,[m12],gamma1,h1),
-             _compute_dt(dy,nu2,[m21],gamma2,h2))
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
-        _inject_mutations_2D(phi, this_dt, xx, yy, theta0, frozen1, frozen2)
-        if not frozen1:
-            phi = int_c.implicit_precalc_2Dx(phi, ax, bx, cx, this_dt)
-        if not frozen2:
-            phi = int_c.implicit_precalc_2Dy(phi, ay, by, cy, this_dt)
-        current_t += this_dt
-
-    return phi
+    return ax, bx, cx, ay, by, cy
 
 def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1, 
                              m12=0, m13=0, m21=0, m23=0, m31=0, m32=0, 
@@ -593,7 +1591,17 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     if numpy.any(numpy.equal([nu1,nu2,nu3], 0)):
         raise ValueError('A population size is 0. Has the model been '
                          'mis-specified?')
-    zz = yy = xx
+    xx, yy, zz = _axis_grids(xx, phi.shape)
+
+    if low_memory_3D:
+        return _three_pops_lean(phi, (xx, yy, zz), T, nu1, nu2, nu3, m12, m13,
+                                m21, m23, m31, m32, gamma1, gamma2, gamma3,
+                                h1, h2, h3, theta0, initial_t, frozen1,
+                                frozen2, frozen3)
+
+    # In single precision mode the coefficients are stored as float32 from the
+    # start, so the full double precision arrays never exist.
+    coef_dtype = numpy.float32 if use_float32 else numpy.float64
 
     Vx = _Vfunc(xx, nu1)
     VxInt = _Vfunc((xx[:-1]+xx[1:])/2, nu1)
@@ -606,7 +1614,7 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     dfact_x = _compute_dfactor(dx)
     deljx = _compute_delj(dx, MxInt, VxInt)
 
-    ax, bx, cx = [numpy.zeros(phi.shape) for ii in range(3)]
+    ax, bx, cx = [numpy.zeros(phi.shape, coef_dtype) for ii in range(3)]
     ax[ 1:] += dfact_x[ 1:,nuax,nuax]*(-MxInt*deljx    
                                        - Vx[:-1,nuax,nuax]/(2*dx[:,nuax,nuax]))
     cx[:-1] += dfact_x[:-1,nuax,nuax]*( MxInt*(1-deljx)
@@ -636,7 +1644,7 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     dfact_y = _compute_dfactor(dy)
     deljy = _compute_delj(dy, MyInt, VyInt, axis=1)
 
-    ay, by, cy = [numpy.zeros(phi.shape) for ii in range(3)]
+    ay, by, cy = [numpy.zeros(phi.shape, coef_dtype) for ii in range(3)]
     ay[:, 1:] += dfact_y[nuax, 1:,nuax]*(-MyInt*deljy     
                                     - Vy[nuax,:-1,nuax]/(2*dy[nuax,:,nuax]))
     cy[:,:-1] += dfact_y[nuax,:-1,nuax]*( MyInt*(1-deljy) 
@@ -664,7 +1672,7 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     dfact_z = _compute_dfactor(dz)
     deljz = _compute_delj(dz, MzInt, VzInt, axis=2)
 
-    az, bz, cz = [numpy.zeros(phi.shape) for ii in range(3)]
+    az, bz, cz = [numpy.zeros(phi.shape, coef_dtype) for ii in range(3)]
     az[:,:, 1:] += dfact_z[ 1:]*(-MzInt*deljz     - Vz[nuax,nuax,:-1]/(2*dz))
     cz[:,:,:-1] += dfact_z[:-1]*( MzInt*(1-deljz) - Vz[nuax,nuax, 1:]/(2*dz))
     bz[:,:,:-1] += dfact_z[:-1]*( MzInt*deljz     + Vz[nuax,nuax,:-1]/(2*dz))
@@ -678,16 +1686,98 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
              _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
              _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
-        _inject_mutations_3D(phi, this_dt, xx, yy, zz, theta0,
-                             frozen1, frozen2, frozen3)
-        if not frozen1:
-            phi = int_c.implicit_precalc_3Dx(phi, ax, bx, cx, this_dt)
-        if not frozen2:
-            phi = int_c.implicit_precalc_3Dy(phi, ay, by, cy, this_dt)
-        if not frozen3:
-            phi = int_c.implicit_precalc_3Dz(phi, az, bz, cz, this_dt)
-        current_t += this_dt
+    # As in _two_pops_const_params, the whole epoch is integrated in C.
+    if use_float32:
+        phi = int_c.integrate_precalc_3D_fl(phi.astype(numpy.float32), xx, yy,
+                                            zz, ax, bx, cx, ay, by, cy,
+                                            az, bz, cz, dt, T, initial_t,
+                                            theta0, frozen1, frozen2, frozen3)
+        return phi.astype(numpy.float64)
+    phi = int_c.integrate_precalc_3D(phi, xx, yy, zz, ax, bx, cx, ay, by, cy,
+                                     az, bz, cz, dt, T, initial_t, theta0,
+                                     frozen1, frozen2, frozen3)
+    return phi
+
+def _three_pops_lean(phi, xx, T, nu1, nu2, nu3, m12, m13, m21, m23, m31, m32,
+                     gamma1, gamma2, gamma3, h1, h2, h3, theta0, initial_t,
+                     frozen1, frozen2, frozen3):
+    """
+    Integrate three populations with constant parameters, in low memory.
+
+    See low_memory_3D. Parameters have already been checked by
+    _three_pops_const_params.
+    """
+    xx, yy, zz = _axis_grids(xx, phi.shape)
+    dx,dy,dz = numpy.diff(xx),numpy.diff(yy),numpy.diff(zz)
+    dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
+             _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
+             _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
+
+    if use_delj_trick:
+        # The coefficients then aren't linear in the migration terms, so we
+        # fall back to computing them from scratch on every step.
+        params = numpy.array([[0, p] for p in [nu1, nu2, nu3, m12, m13, m21,
+                                               m23, m31, m32, gamma1, gamma2,
+                                               gamma3, h1, h2, h3, theta0]],
+                             dtype=float)
+        phi, status = int_c.integrate_schedule_3D(phi, xx, yy, zz, params, T,
+                                                  initial_t,
+                                                  timescale_factor
+                                                  * _timescale(),
+                                                  frozen1, frozen2, frozen3,
+                                                  use_delj_trick)
+        _check_schedule_status(status[0])
+        return phi
+
+    coefx, cornersx = _lean_abc(xx, yy, zz, nu1, m12, m13, gamma1, h1)
+    coefy, cornersy = _lean_abc(yy, xx, zz, nu2, m21, m23, gamma2, h2)
+    coefz, cornersz = _lean_abc(zz, xx, yy, nu3, m31, m32, gamma3, h3)
+    corners = numpy.array(cornersx + cornersy + cornersz)
+    phi = int_c.integrate_lean_3D(phi, xx, yy, zz, coefx, coefy, coefz,
+                                  corners, dt, T, initial_t, theta0,
+                                  frozen1, frozen2, frozen3)
     return phi
+
+def _lean_abc(xx, uu, vv, nu, m_u, m_v, gamma, h):
+    """
+    Factored a,b,c coefficients for one sweep of a constant-parameter 3D
+    integration, as used by implicit_lean_3D.
+
+    xx: Grid along the sweep direction
+    uu, vv: Grids of the other two directions
+    m_u, m_v: Migration rates from the populations of the other directions
+
+    Returns an array of shape (9, len(xx)) holding a,b,c at u = v = 0, then
+    their derivatives with respect to u and to v. The b's do *not* include
+    the 1/dt contribution. Also returns the boundary terms to add to b at the
+    first and last corners of the domain.
+    """
+    dx = numpy.diff(xx)
+    dfact = _compute_dfactor(dx)
+    xInt = (xx[:-1]+xx[1:])/2
+    # Without the delj trick, delj is 0.5 everywhere.
+    delj = 0.5
+
+    def abc(MInt, V):
+        a, b, c = [numpy.zeros(len(xx)) for ii in range(3)]
+        a[ 1:] += dfact[ 1:]*(-MInt*delj     - V[:-1]/(2*dx))
+        c[:-1] += dfact[:-1]*( MInt*(1-delj) - V[ 1:]/(2*dx))
+        b[:-1] += dfact[:-1]*( MInt*delj     + V[:-1]/(2*dx))
+        b[ 1:] += dfact[ 1:]*(-MInt*(1-delj) + V[ 1:]/(2*dx))
+        return [a, b, c]
+
+    # M = m_u*(u-x) + m_v*(v-x) + selection, which is linear in u and v.
+    MInt0 = _Mfunc1D(xInt, gamma, h) - (m_u + m_v)*xInt
+    no_drift = numpy.zeros(len(xx))
+    coef = numpy.array(abc(MInt0, _Vfunc(xx, nu))
+                       + abc(m_u*numpy.ones(len(dx)), no_drift)
+                       + abc(m_v*numpy.ones(len(dx)), no_drift))
+
+    Mfirst = _Mfunc3D(xx[0], uu[0], vv[0], m_u, m_v, gamma, h)
+    Mlast = _Mfunc3D(xx[-1], uu[-1], vv[-1], m_u, m_v, gamma, h)
+    bfirst, blast = 0, 0
+    if Mfirst <= 0:
+        bfirst = (0.5/nu - Mfirst)*2/dx[0]
+    if Mlast >= 0:
+        blast = -(-0.5/nu - Mlast)*2/dx[-1]
+    return coef, [bfirst, blast]
@@ -4,7 +4,7 @@ Numerically useful functions, including extrapolation and default grid.
 import logging
 logger = logging.getLogger('Numerics')
 
-import functools, os
+import collections, functools, hashlib, inspect, os, threading
 import numpy
 # Account for difference in scipy installations.
 try:
@@ -196,7 +196,7 @@ def reverse_array(arr):
     """
     Reverse an array along all axes, so arr[i,j] -> arr[-(i+1),-(j+1)].
     """
-    reverse_slice = [slice(None, None, -1) for ii in arr.shape]
+    reverse_slice = tuple(slice(None, None, -1) for ii in arr.shape)
     return arr[reverse_slice]
 
 def intersect_masks(m1, m2):
@@ -245,13 +245,19 @@ def trapz(yy, xx=None, dx=None, axis=-1):
 
     return numpy.sum(dx[sliceX] * (yy[slice1]+yy[slice2])/2.0, axis=axis)
 
-def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
+def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10,
+                     executor=None):
     """
     Generate a version of func that extrapolates to infinitely many gridpoints.
 
     func: A function that returns a single scalar or array and whose last
         non-keyword argument is 'pts': the number of default_grid points to use
         in calculation.  
+        For models that use a different grid for each population (see
+        Integration.two_pops), pts may instead be a sequence of numbers of grid
+        points, one per population. The sizes should then be scaled together
+        across the list of pts, e.g. [(40,20), (50,25), (60,30)], so that the
+        discretization errors of all populations shrink at the same rate.
     extrap_x_l: An explict list of x values to use for extrapolation. If not 
         provided, the extrapolation routine will look for '.extrap_x'
         attributes on the results of func. The method Spectrum.from_phi will
@@ -264,6 +270,17 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
         extrapolation values (and use the input result with the smallest x) 
         if the extrapolation is more than fail_mag orders of magnitude away
         from the smallest x input result.
+    executor: How to evaluate func for the different numbers of grid points.
+        If None, they are evaluated one after another. If 'thread', they are
+        evaluated concurrently in threads. This works well because the
+        integrations release Python's global interpreter lock. If 'process',
+        each is evaluated in a separate forked process. These inherit func, so
+        it need not be picklable, but its results must be. (The children's
+        additions to Integration.epoch_cache are lost when they exit.) Where
+        fork is unavailable, as on Windows, threads are used instead.
+        Because OpenMP cannot safely be used across a fork, the forked
+        processes integrate with a single thread, whatever
+        Integration.set_num_threads is set to.
 
     Returns a new function whose last argument is a list of numbers of grid
     points and that returns a result extrapolated to infinitely many grid
@@ -288,35 +305,13 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
 
         if numpy.isscalar(pts_l):
             pts_l = [pts_l]
+        _check_pts_scaling(pts_l)
 
         # Create a sub-function that fixes all other arguments and only
         # takes in pts.
         partial_func = functools.partial(func, *other_args, **kwargs)
 
-        ##
-        ## The commented-out code implements distribution of fs calculations
-        ## among multiple processors. Unfortunately, it doesn't work with
-        ## iPython, because pickling functions is very fragile in the
-        ## interactive interpreter. If we had some sort of data structure for
-        ## defining models, then this would be much easier to implement. Note
-        ## that there might still be issues on Windows systems, because of its
-        ## poor-man's version of fork().
-        ##
-        #import cPickle, multiprocessing
-        #try:
-        #    # Test whether sub-function is picklable. If not, pool.map will
-        #    # hang.
-        #    cPickle.dumps(partial_func)
-        #    pool = multiprocessing.Pool()
-        #    result_l = pool.map(partial_func, pts_l)
-        #    pool.close()
-        #except (cPickle.PicklingError, TypeError):
-        #    print('Function passed to extrap func must be picklable for '
-        #          'multi-processor executation.')
-        #    import sys
-        #    sys.exit()
-
-        result_l = map(partial_func, pts_l)
+        result_l = _map_pts(partial_func, pts_l, executor)
         if no_extrap:
             return result_l
 
@@ -380,7 +375,85 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
 
     return extrap_func
 
-def make_extrap_log_func(func, extrap_x_l=None):
+# Function being evaluated by the forked workers of _map_pts. It is set before
+# the workers are created, so they inherit it without pickling.
+_fork_func = None
+_fork_lock = threading.Lock()
+
+def _check_pts_scaling(pts_l):
+    """
+    Warn if per-population grid sizes in pts_l are not scaled together, in
+    which case extrapolation is unreliable.
+    """
+    sizes = [numpy.atleast_1d(pts).astype(float) for pts in pts_l]
+    if all(len(size) == 1 for size in sizes):
+        return
+    ratios = [size/size[0] for size in sizes]
+    if any(ratio.shape != ratios[0].shape
+           or not numpy.allclose(ratio, ratios[0], rtol=0.1)
+           for ratio in ratios):
+        logger.warn('Grid sizes %s are not scaled together across '
+                    'populations, so extrapolation may fail.' % str(pts_l))
+
+def _call_fork_func(pts):
+    return _fork_func(pts)
+
+def _fork_initializer():
+    """
+    Set up a forked worker of _map_pts.
+    """
+    # OpenMP (libgomp) is not fork-safe. If the parent has already run a
+    # multi-threaded integration, a child starting its own thread team
+    # deadlocks, so children integrate single-threaded.
+    import Integration
+    if Integration.num_threads > 1:
+        Integration.set_num_threads(1)
+
+def _map_pts(func, pts_l, executor=None):
+    """
+    Evaluate func for each of pts_l, as directed by executor.
+
+    See make_extrap_func for the possible values of executor.
+    """
+    if executor not in [None, 'thread', 'process']:
+        raise ValueError("executor must be None, 'thread', or 'process', not "
+                         "%s." % str(executor))
+    pts_l = list(pts_l)
+    if executor is None or len(pts_l) == 1:
+        return [func(pts) for pts in pts_l]
+
+    import multiprocessing, multiprocessing.pool
+    if executor == 'process':
+        try:
+            # Python 3 allows other start methods, which would require
+            # pickling func.
+            pool_maker = multiprocessing.get_context('fork').Pool
+        except AttributeError:
+            pool_maker = multiprocessing.Pool
+        except ValueError:
+            pool_maker = None
+        if pool_maker is not None and os.name == 'posix':
+            global _fork_func
+            with _fork_lock:
+                _fork_func = func
+                pool = pool_maker(len(pts_l), _fork_initializer)
+                try:
+                    return pool.map(_call_fork_func, pts_l)
+                finally:
+                    pool.close()
+                    pool.join()
+                    _fork_func = None
+        logger.warn('Forked processes are not available on this system, so '
+                    'threads are used to evaluate grid sizes instead.')
+
+    pool = multiprocessing.pool.ThreadPool(len(pts_l))
+    try:
+        return pool.map(func, pts_l)
+    finally:
+        pool.close()
+        pool.join()
+
+def make_extrap_log_func(func, extrap_x_l=None, executor=None):
     """
     Generate a version of func that extrapolates to infinitely many gridpoints.
 
@@ -397,12 +470,15 @@ def make_extrap_log_func(func, extrap_x_l=None):
          add an extrap_x attribute to resulting Spectra, equal to the x-value
          of the first non-zero grid point. An explicit list is useful if you
          want to override this behavior for testing.
+    executor: How to evaluate func for the different numbers of grid points.
+         See make_extrap_func.
 
     Returns a new function whose last argument is a list of numbers of grid
     points and that returns a result extrapolated to infinitely many grid
     points.
     """
-    return make_extrap_func(func, extrap_x_l=extrap_x_l, extrap_log=True)
+    return make_extrap_func(func, extrap_x_l=extrap_x_l, extrap_log=True,
+                            executor=executor)
 
 _projection_cache = {}
 def _lncomb(N,k):
@@ -445,6 +521,171 @@ def _cached_projection(proj_to, proj_from, hits):
     _projection_cache[key] = contrib
     return contrib
 
+class ResultCache(object):
+    """
+    Store of computed arrays, keyed by the content of their inputs.
+
+    Because keys are computed from the actual input values (including the
+    contents of input arrays), a cached result is returned whenever the same
+    computation is repeated, no matter how its inputs were arrived at. Within a
+    model evaluation, branches that go through identical epochs thus only
+    integrate them once. Across evaluations, as when optimization perturbs a
+    parameter that only affects a late epoch, all the earlier epochs are
+    found in the cache.
+
+    Results are copied on the way in and out, so callers may freely modify
+    what they get back. Access is protected by a lock, so a cache may be
+    shared between threads.
+
+    max_bytes: Maximum total size of the results held. Once it is reached,
+               the least recently used results are dropped.
+    enabled: If False, cached functions are simply evaluated.
+
+    The hits, misses, and evictions attributes count cache events since
+    creation or the last reset_stats(). See also stats().
+    """
+    def __init__(self, max_bytes=128*1024**2, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._store = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Copy of the result stored under key, or None if there is none.
+        """
+        with self._lock:
+            value = self._store.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            # Re-inserting marks this entry as the most recently used.
+            self._store[key] = value
+            self.hits += 1
+        return _copy_result(value)
+
+    def put(self, key, value):
+        """
+        Store a copy of value under key.
+
+        Values larger than max_bytes are not stored.
+        """
+        size = _result_nbytes(value)
+        if size > self.max_bytes:
+            return
+        value = _copy_result(value)
+        with self._lock:
+            if key in self._store:
+                self.nbytes -= _result_nbytes(self._store.pop(key))
+            self._store[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                old_key, old_value = self._store.popitem(last=False)
+                self.nbytes -= _result_nbytes(old_value)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all stored results.
+        """
+        with self._lock:
+            self._store.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Dictionary of the cache's usage statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self._store),
+                    'nbytes': self.nbytes, 'max_bytes': self.max_bytes,
+                    'hit_rate': float(self.hits)/lookups if lookups else 0.}
+
+    def reset_stats(self):
+        """
+        Zero the hit, miss, and eviction counts.
+        """
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def cached(self, settings=None):
+        """
+        Decorator that caches the results of a function in this cache.
+
+        settings: Optional function returning any global state the result
+                  depends upon, which is included in the key.
+
+        Calls with arguments that cannot be keyed by content, such as
+        arbitrary Python functions of time, are simply evaluated.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                callargs = inspect.getcallargs(func, *args, **kwargs)
+                extra = settings() if settings is not None else None
+                key = _content_key((func.__module__, func.__name__,
+                                    sorted(callargs.items()), extra))
+                if key is None:
+                    return func(*args, **kwargs)
+                result = self.get(key)
+                if result is None:
+                    result = func(*args, **kwargs)
+                    self.put(key, result)
+                return result
+            return wrapper
+        return decorator
+
+def _result_nbytes(value):
+    if isinstance(value, list):
+        return sum(_result_nbytes(v) for v in value)
+    return value.nbytes
+
+def _copy_result(value):
+    if isinstance(value, list):
+        return [_copy_result(v) for v in value]
+    return value.copy()
+
+def _update_key(hasher, obj):
+    """
+    Add obj to the hash. Returns False if obj cannot be keyed by content.
+    """
+    if isinstance(obj, numpy.ndarray):
+        obj = numpy.ascontiguousarray(obj)
+        hasher.update(repr(('array', obj.dtype.str, obj.shape)).encode())
+        hasher.update(obj.tobytes())
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(repr((type(obj).__name__, len(obj))).encode())
+        for item in obj:
+            if not _update_key(hasher, item):
+                return False
+    elif hasattr(obj, '_encode'):
+        # Parametric schedules are described by their encoding.
+        hasher.update(repr((type(obj).__name__, obj._encode())).encode())
+    elif obj is None or isinstance(obj, str) or numpy.isscalar(obj):
+        hasher.update(repr((type(obj).__name__, obj)).encode())
+    else:
+        return False
+    return True
+
+def _content_key(obj):
+    """
+    Digest of the content of obj, or None if it cannot be keyed by content.
+    """
+    hasher = hashlib.sha1()
+    if not _update_key(hasher, obj):
+        return None
+    return hasher.hexdigest()
+
+# Cache of integration epochs and initial phi's, shared by Integration and
+# PhiManip.
+epoch_cache = ResultCache()
+
 def array_from_file(fid, return_comments=False):
     """
     Read array from file.
@@ -6,8 +6,9 @@ import numpy
 from numpy import newaxis as nuax
 import scipy.integrate
 
-from dadi import Numerics
+from dadi import Integration, Numerics
 
+@Numerics.epoch_cache.cached()
 def phi_1D(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5,
            theta=None):
     """
@@ -138,42 +139,105 @@ def phi_1D_snm(xx, nu=1.0, theta0=1.0, theta=None):
         phi = nu*theta0/xx
     return phi
 
-def phi_1D_to_2D(xx, phi_1D):
+def _equilibrium_settings():
+    """
+    Integration settings that phi_2D_equilibrium depends upon, for keying the
+    cache.
+    """
+    return Integration.use_delj_trick
+
+@Numerics.epoch_cache.cached(settings=_equilibrium_settings)
+def phi_2D_equilibrium(xx, nu1=1.0, nu2=1.0, m12=0, m21=0, gamma1=0, gamma2=0,
+                       h1=0.5, h2=0.5, theta0=1.0, yy=None):
+    """
+    Two-dimensional phi at equilibrium under constant population sizes,
+    migration, and selection.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined. It is
+        used in both dimensions, unless yy is given.
+    nu1,nu2: Population sizes
+    m12,m21: Migration rates. Note that m12 is the rate *into 1 from 2*.
+    gamma1,gamma2: Selection coefficients on *all* segregating alleles
+    h1,h2: Dominance coefficients. h = 0.5 corresponds to genic selection.
+    theta0: Propotional to ancestral size. Typically constant.
+    yy: Optional grid of frequencies for population 2.
+
+    This is the phi that Integration.two_pops with these parameters would
+    converge to given long enough, found with a single sparse linear solve of
+    the stationary diffusion equation.
+
+    Returns a new phi array.
+    """
+    if numpy.any(numpy.less([nu1,nu2,m12,m21,theta0], 0)):
+        raise ValueError('A population size, migration rate, or theta0 '
+                         'is < 0. Has the model been mis-specified?')
+    if numpy.any(numpy.equal([nu1,nu2], 0)):
+        raise ValueError('A population size is 0. Has the model been '
+                         'mis-specified?')
+    yy = xx if yy is None else yy
+    abc = Integration._two_pops_const_abc(xx, yy, nu1, nu2, m12, m21,
+                                          gamma1, gamma2, h1, h2)
+    A = Integration._two_pops_const_operator(*abc)
+    return Integration._two_pops_equilibrium(A, xx, yy, theta0)
+
+def phi_1D_to_2D(xx, phi_1D, yy=None):
     """
     Implement a one-to-two population split.
 
     xx: one-dimensional grid of frequencies upon which phi is defined
     phi1D: initial probability density
+    yy: Optional grid of frequencies for population 2. If None, xx is used for
+        both populations.
 
-    Returns a new two-dimensional phi array.
+    Returns a new two-dimensional phi array, of shape (len(xx), len(yy)).
     """
-    pts = len(xx)
-    phi_2D = numpy.zeros((pts, pts))
-    for ii in range(1, pts-1):
-        phi_2D[ii,ii] = phi_1D[ii] * 2/(xx[ii+1]-xx[ii-1])
+    if yy is None:
+        pts = len(xx)
+        phi_2D = numpy.zeros((pts, pts))
+        for ii in range(1, pts-1):
+            phi_2D[ii,ii] = phi_1D[ii] * 2/(xx[ii+1]-xx[ii-1])
+        return phi_2D
+
+    # Right after the split the populations have equal frequencies. With
+    # different grids, the density at each x is shared between the points of
+    # yy on either side of it, as for admixture.
+    lower_y_index, upper_y_index, frac_lower, frac_upper, norm \
+            = _admixture_intermediates(phi_1D, xx, yy)
+    idx_i = numpy.arange(1, len(xx)-1)
+    phi_2D = numpy.zeros((len(xx), len(yy)))
+    phi_2D[idx_i, lower_y_index[idx_i]] = frac_lower[idx_i]*norm[idx_i]
+    phi_2D[idx_i, upper_y_index[idx_i]] += frac_upper[idx_i]*norm[idx_i]
     return phi_2D
 
-def phi_2D_to_3D_split_2(xx, phi_2D):
+def phi_2D_to_3D_split_2(xx, phi_2D, yy=None, zz=None):
     """
     Split population 2 into populations 2 and 3.
 
     xx: one-dimensional grid of frequencies upon which phi is defined
     phi2D: initial probability density
+    yy,zz: Optional grids of frequencies for populations 2 and 3. Those that
+           are None are taken to be xx.
 
     Returns a new three-dimensional phi array.
     """
-    return phi_2D_to_3D_admix(phi_2D,0,xx,xx,xx)
+    yy = xx if yy is None else yy
+    zz = xx if zz is None else zz
+    return phi_2D_to_3D_admix(phi_2D,0,xx,yy,zz)
 
-def phi_2D_to_3D_split_1(xx, phi_2D):
+def phi_2D_to_3D_split_1(xx, phi_2D, yy=None, zz=None):
     """
     Split population 1 into populations 1 and 3.
 
     xx: one-dimensional grid of frequencies upon which phi is defined
     phi2D: initial probability density
+    yy,zz: Optional grids of frequencies for populations 2 and 3. Those that
+           are None are taken to be xx.
 
     Returns a new three-dimensional phi array.
     """
-    return phi_2D_to_3D_admix(phi_2D,1,xx,xx,xx)
+    yy = xx if yy is None else yy
+    zz = xx if zz is None else zz
+    return phi_2D_to_3D_admix(phi_2D,1,xx,yy,zz)
 
 def _admixture_intermediates(phi, ad_z, zz):
     # Find where those z values map to in the zz array.
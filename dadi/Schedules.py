@@ -0,0 +1,129 @@
+"""
+Parametric schedules for time-dependent integration parameters.
+
+Any one-argument function of time can be passed to the Integration functions
+as a population size, migration rate, etc. An arbitrary function, though, has
+to be called from Python on every timestep. The schedules here describe the
+common cases as data, so that when every time-dependent parameter of an
+integration is a schedule, the whole integration runs in C.
+
+Schedules are also ordinary functions of time, so they can be used anywhere a
+time-dependent parameter is accepted. Integrations with schedules agree with
+those using the equivalent plain functions to rounding error (about 1e-16
+relative), but not bitwise, because the C code evaluates them with a
+different order of floating-point operations.
+
+For example, exponential growth from nu0 to nuF over time T:
+    nu_func = dadi.Schedules.Exponential(nu0, nuF, T)
+is equivalent to
+    nu_func = lambda t: nu0 * (nuF/nu0)**(t/T)
+"""
+import numpy
+
+# Codes for each kind of schedule, shared with eval_schedule in
+# integration_shared.c.
+_CONSTANT, _EXPONENTIAL, _LINEAR, _PIECEWISE = 0, 1, 2, 3
+
+class Schedule(object):
+    """
+    Base class for parametric schedules.
+    """
+    def __call__(self, t):
+        raise NotImplementedError
+
+    def _encode(self):
+        """
+        Flat list of floats describing this schedule to the C code.
+
+        The first entry is the kind of schedule, and the remainder its
+        parameters.
+        """
+        raise NotImplementedError
+
+class Exponential(Schedule):
+    """
+    Exponential change from start to end over an interval of length T.
+
+    The value at time t is start * (end/start)**((t - initial_t)/T). Outside
+    the interval it continues to grow or decline exponentially.
+    """
+    def __init__(self, start, end, T, initial_t=0):
+        if T <= 0:
+            raise ValueError('Schedule duration T (%f) must be > 0.' % T)
+        if start == 0:
+            raise ValueError('Exponential schedule cannot start at 0.')
+        self.start, self.end, self.T = float(start), float(end), float(T)
+        self.initial_t = float(initial_t)
+
+    def __call__(self, t):
+        return self.start * (self.end/self.start)**((t - self.initial_t)/self.T)
+
+    def _encode(self):
+        return [_EXPONENTIAL, self.start, self.end, self.T, self.initial_t]
+
+class Linear(Schedule):
+    """
+    Linear change from start to end over an interval of length T.
+
+    The value at time t is start + (end - start)*(t - initial_t)/T. Outside
+    the interval it continues to change at the same rate.
+    """
+    def __init__(self, start, end, T, initial_t=0):
+        if T <= 0:
+            raise ValueError('Schedule duration T (%f) must be > 0.' % T)
+        self.start, self.end, self.T = float(start), float(end), float(T)
+        self.initial_t = float(initial_t)
+
+    def __call__(self, t):
+        return self.start + (self.end - self.start)*(t - self.initial_t)/self.T
+
+    def _encode(self):
+        return [_LINEAR, self.start, self.end, self.T, self.initial_t]
+
+class PiecewiseConstant(Schedule):
+    """
+    Constant values that change at a sequence of breakpoints.
+
+    times: Increasing sequence of breakpoints.
+    values: Sequence of len(times)+1 values. values[0] applies before
+            times[0], values[i] from times[i-1] up to times[i], and values[-1]
+            from times[-1] on.
+    """
+    def __init__(self, times, values):
+        times = [float(t) for t in times]
+        values = [float(v) for v in values]
+        if len(values) != len(times) + 1:
+            raise ValueError('PiecewiseConstant requires one more value (%i) '
+                             'than breakpoint (%i).' % (len(values),
+                                                        len(times)))
+        if numpy.any(numpy.diff(times) <= 0):
+            raise ValueError('PiecewiseConstant breakpoints must be '
+                             'increasing.')
+        self.times, self.values = times, values
+
+    def __call__(self, t):
+        return self.values[numpy.searchsorted(self.times, t, side='right')]
+
+    def _encode(self):
+        return [_PIECEWISE, len(self.times)] + self.times + self.values
+
+def _encode_params(params):
+    """
+    Table describing a list of integration parameters to the C code.
+
+    Each parameter must be a constant or a Schedule. Returns an array with one
+    row per parameter, padded with zeros, or None if any parameter is some
+    other function of time.
+    """
+    rows = []
+    for var in params:
+        if numpy.isscalar(var):
+            rows.append([_CONSTANT, var])
+        elif isinstance(var, Schedule):
+            rows.append(var._encode())
+        else:
+            return None
+    table = numpy.zeros((len(rows), max(len(row) for row in rows)))
+    for ii, row in enumerate(rows):
+        table[ii,:len(row)] = row
+    return table
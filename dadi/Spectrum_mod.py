@@ -20,6 +20,22 @@ from scipy.special import betainc
 
 import dadi.Numerics
 from dadi.Numerics import reverse_array, _cached_projection, _lncomb
+from dadi.Numerics import ResultCache
+
+#: Cache of the sampling weight matrices used by from_phi, keyed by sample
+#: size and grid. These stay fixed over an optimization, so after the first
+#: evaluation from_phi need not evaluate any special functions. The least
+#: recently used matrices are dropped once weights_cache.max_bytes is
+#: reached. See also Spectrum.precompute_weights.
+weights_cache = ResultCache(max_bytes=32*1024**2)
+
+#: Largest nx+ny for which from_phi integrates analytically over a 2D phi in
+#: which both sampled populations are admixed. The cost of that calculation
+#: grows as the fifth power of sample size, so for larger samples direct
+#: integration is used instead, which is faster on grids of similar size.
+#: This depends only on the sample sizes, so all grids of an extrapolation
+#: use the same method.
+admix_analytic_max_n = 140
 
 class Spectrum(numpy.ma.masked_array):
     """
@@ -1043,7 +1059,7 @@ class Spectrum(numpy.ma.masked_array):
 
     @staticmethod
     def _from_phi_1D_analytic(n, xx, phi, mask_corners=True, 
-                              divergent=False):
+                              divergent=False, het_ascertained=None):
         """
         Compute sample Spectrum from population frequency distribution phi.
 
@@ -1060,6 +1076,11 @@ class Spectrum(numpy.ma.masked_array):
         # \int_0^y \Gamma(a+b)/\Gamma(a) \Gamma(b) x^{a-1) (1-x)^{b-1} 
         # is betainc(a,b,y)
         # So the integral in analytic for a piece-wise linear phi.
+        if not divergent:
+            het = het_ascertained == 'xx'
+            data = numpy.dot(Spectrum._analytic_weights(n, xx, het), phi)
+            return dadi.Spectrum(data, mask_corners=mask_corners)
+
         data = numpy.zeros(n+1)
 
         # Values for xx just slighly (~1e-16) outside the range [0,1] can cause
@@ -1107,7 +1128,7 @@ class Spectrum(numpy.ma.masked_array):
         for ii in range(0, nx+1):
             factorx = comb(nx, ii) * xadmix**ii * (1-xadmix)**(nx-ii)
             if het_ascertained == 'xx':
-                factorx *= xx*(1-xx)
+                factorx *= xx[:,nuax]*(1-xx[:,nuax])
             factorx_cache[nx,ii] = factorx
     
         dx, dy = numpy.diff(xx), numpy.diff(yy)
@@ -1125,7 +1146,199 @@ class Spectrum(numpy.ma.masked_array):
         return fs
 
     @staticmethod
-    def _from_phi_2D_analytic(nx, ny, xx, yy, phi, mask_corners=True):
+    @weights_cache.cached()
+    def _direct_weights(n, xx, het_ascertained=False):
+        """
+        Weights for trapezoid-rule integration of the sampling formula along
+        one axis.
+
+        Returns an (n+1, len(xx)) array W such that W.dot(phi)[d] is the
+        trapezoid-rule integral of phi times the probability of d derived
+        alleles in a sample of n. If het_ascertained, the probability is
+        also weighted by xx*(1-xx), as for the het_ascertained option of
+        from_phi.
+
+        Results are stored in weights_cache.
+        """
+        d = numpy.arange(n+1)[:,nuax]
+        factor = comb(n, d) * xx[nuax,:]**d * (1-xx[nuax,:])**(n-d)
+        if het_ascertained:
+            factor *= xx*(1-xx)
+        dx = numpy.diff(xx)
+        trap = numpy.zeros(len(xx))
+        trap[:-1] += dx/2.
+        trap[1:] += dx/2.
+        return factor * trap
+
+    @staticmethod
+    def _contract_3D(phi, weights_x, weights_y, weights_z):
+        """
+        Apply per-axis weight matrices to a 3D phi.
+
+        Returns the array with entries
+        sum_abc weights_x[i,a] weights_y[j,b] weights_z[k,c] phi[a,b,c].
+        Each axis is contracted in turn, so the cost is a few matrix products
+        rather than a reduction for each entry.
+        """
+        # Contracting the last axis each time cycles the remaining axes
+        # around, so after three contractions they are back in order.
+        data = numpy.tensordot(weights_z, phi, axes=([1],[2]))
+        data = numpy.tensordot(weights_y, data, axes=([1],[2]))
+        data = numpy.tensordot(weights_x, data, axes=([1],[2]))
+        return data
+
+    @staticmethod
+    @weights_cache.cached()
+    def _analytic_weights(n, xx, het_ascertained=False):
+        """
+        Weights for analytic integration of the sampling formula along one
+        axis.
+
+        Returns an (n+1, len(xx)) array W such that, for phi piecewise-linear
+        on xx, W.dot(phi)[d] is the integral of phi times the probability of
+        d derived alleles in a sample of n. This is the calculation done by
+        _from_phi_1D_analytic, with the terms regrouped by grid point. If
+        het_ascertained, the probability is also weighted by xx*(1-xx), as
+        for the het_ascertained option of from_phi.
+
+        Results are stored in weights_cache.
+        """
+        if het_ascertained:
+            # x(1-x) times the probability of d derived in n is a multiple of
+            # the probability of d+1 derived in n+2.
+            d = numpy.arange(n+1)
+            scale = (d+1.)*(n-d+1)/((n+1)*(n+2))
+            return Spectrum._analytic_weights(n+2, xx)[1:-1] * scale[:,nuax]
+
+        xx = numpy.minimum(numpy.maximum(xx, 0), 1.0)
+        d = numpy.arange(n+1)[:,nuax]
+        beta1 = betainc(d+1, n-d+1, xx[nuax,:])
+        beta2 = betainc(d+2, n-d+1, xx[nuax,:])
+
+        # The integral over the interval from xx[k] to xx[k+1] is
+        # A*(phi[k] - s*xx[k]) + B*s, where s is the slope of phi over the
+        # interval.
+        A = (beta1[:,1:]-beta1[:,:-1])/(n+1)
+        B = (beta2[:,1:]-beta2[:,:-1]) * (d+1)/((n+1)*(n+2))
+        G = (B - A*xx[nuax,:-1])/(xx[nuax,1:]-xx[nuax,:-1])
+
+        weights = numpy.zeros((n+1, len(xx)))
+        weights[:,:-1] = A - G
+        weights[:,1:] += G
+        return weights
+
+    @staticmethod
+    def _admix_weights(n, frac):
+        """
+        Sampling probabilities for an admixed sample, in a tensor-product
+        polynomial basis.
+
+        In a sample of n from a population with allele frequency
+        frac*x + (1-frac)*y, the probability of d derived alleles is
+          sum_uv h[d,u,v] x**u (1-x)**(n-u) y**v (1-y)**(n-v).
+        Returns the array h.
+
+        These are not cached, since frac is usually a model parameter that
+        changes between evaluations.
+        """
+        # In this basis, multiplying polynomials convolves their
+        # coefficients. frac*x + (1-frac)*y has coefficients
+        # [[0, 1-frac], [frac, 1]] for degree one, and its complement
+        # [[1, frac], [1-frac, 0]]. The powers p**d q**(k-d) for each degree
+        # k are built up from those for k-1, by multiplying by p (or by q
+        # when d = 0).
+        a, b = frac, 1-frac
+        powers = numpy.ones((1, 1, 1))
+        for k in range(1, n+1):
+            new = numpy.zeros((k+1, k+1, k+1))
+            new[1:,:-1,1:] += b*powers
+            new[1:,1:,:-1] += a*powers
+            new[1:,1:,1:] += powers
+            new[0,:-1,:-1] += powers[0]
+            new[0,:-1,1:] += a*powers[0]
+            new[0,1:,:-1] += b*powers[0]
+            powers = new
+        return comb(n, numpy.arange(n+1))[:,nuax,nuax] * powers
+
+    @staticmethod
+    def _analytic_moments(nx, ny, xx, yy, phi):
+        """
+        Integrals of phi times x**u (1-x)**(nx-u) y**v (1-y)**(ny-v), for
+        phi piecewise-linear on xx and yy.
+
+        These are the unadmixed analytic spectrum for samples of nx and ny,
+        without the binomial coefficients.
+        """
+        moments = numpy.dot(numpy.dot(Spectrum._analytic_weights(nx, xx), phi),
+                            Spectrum._analytic_weights(ny, yy).T)
+        moments /= comb(nx, numpy.arange(nx+1))[:,nuax]
+        moments /= comb(ny, numpy.arange(ny+1))[nuax,:]
+        return moments
+
+    @staticmethod
+    def _from_phi_2D_admix_analytic(nx, ny, xx, yy, phi, admix_props):
+        """
+        Data for a 2D spectrum of admixed samples, by analytic integration
+        of a piecewise-linear approximation to phi.
+
+        See from_phi for explanation of arguments.
+        """
+        for row in admix_props:
+            if len(row) != 2 or not numpy.allclose(numpy.sum(row), 1):
+                raise ValueError('Admixture proportions {0} must sum to 1 for '
+                                 'all populations.'.format(str(admix_props)))
+        fracs = [row[0] for row in admix_props]
+        pure = [frac in (0, 1) for frac in fracs]
+        if pure[0] and not pure[1]:
+            # Handle the admixed population first.
+            data = Spectrum._from_phi_2D_admix_analytic(ny, nx, xx, yy, phi,
+                                                        admix_props[::-1])
+            return data.T
+
+        # The sampling probabilities are polynomials in x and y (see
+        # _admix_weights), and the product of basis polynomials u,v and
+        # u',v' is the basis polynomial u+u',v+v'. So the spectrum is a
+        # contraction of the coefficients for each population with moments
+        # of phi.
+        n = nx + ny
+        kx, ky = numpy.arange(nx+1), numpy.arange(ny+1)
+        hx = Spectrum._admix_weights(nx, fracs[0])
+        if pure[1]:
+            # The second population is sampled from a single variable, so its
+            # sampling probabilities are single basis polynomials.
+            if fracs[1] == 0:
+                moments = Spectrum._analytic_moments(nx, n, xx, yy, phi)
+                products = moments[kx[:,nuax,nuax],
+                                   kx[nuax,:,nuax] + ky[nuax,nuax,:]]
+            else:
+                moments = Spectrum._analytic_moments(n, nx, xx, yy, phi)
+                products = moments[kx[:,nuax,nuax] + ky[nuax,nuax,:],
+                                   kx[nuax,:,nuax]]
+            data = numpy.tensordot(hx, products, axes=([1,2],[0,1]))
+            return data * comb(ny, ky)[nuax,:]
+
+        # Both populations are admixed. The second population's coefficients
+        # are products of powers of the two degree one polynomials of
+        # _admix_weights, so contracting the moments with them is a series
+        # of correlations with those 2x2 coefficient arrays. These are built
+        # up as in _admix_weights, without forming the coefficients.
+        a, b = fracs[1], 1-fracs[1]
+        over_y = Spectrum._analytic_moments(n, n, xx, yy, phi)[nuax]
+        for k in range(1, ny+1):
+            new = numpy.empty((k+1,) + tuple(numpy.subtract(over_y.shape[1:],
+                                                            1)))
+            new[1:] = b*over_y[:,:-1,1:] + a*over_y[:,1:,:-1]\
+                    + over_y[:,1:,1:]
+            new[0] = over_y[0,:-1,:-1] + a*over_y[0,:-1,1:]\
+                    + b*over_y[0,1:,:-1]
+            over_y = new
+        # Axes of over_y are now (d2, u, v).
+        over_y *= comb(ny, ky)[:,nuax,nuax]
+        return numpy.tensordot(hx, over_y, axes=([1,2],[1,2]))
+
+    @staticmethod
+    def _from_phi_2D_analytic(nx, ny, xx, yy, phi, mask_corners=True,
+                              admix_props=None, het_ascertained=None):
         """
         Compute sample Spectrum from population frequency distribution phi.
 
@@ -1134,35 +1347,23 @@ class Spectrum(numpy.ma.masked_array):
 
         See from_phi for explanation of arguments.
         """
-        data = numpy.zeros((nx+1,ny+1))
-
-        xx = numpy.minimum(numpy.maximum(xx, 0), 1.0)
-        yy = numpy.minimum(numpy.maximum(yy, 0), 1.0)
-
-        beta_cache_xx = {}
-        for ii in range(0, nx+1):
-            beta_cache_xx[ii+1,nx-ii+1] = betainc(ii+1,nx-ii+1,xx)
-            beta_cache_xx[ii+2,nx-ii+1] = betainc(ii+2,nx-ii+1,xx)
-
-        s_yy = (phi[:,1:]-phi[:,:-1])/(yy[nuax,1:]-yy[nuax,:-1])
-        c1_yy = (phi[:,:-1] - s_yy*yy[nuax,:-1])/(ny+1)
-        for jj in range(0, ny+1):
-            c2_yy = s_yy*(jj+1)/((ny+1)*(ny+2))
-            beta1_yy = betainc(jj+1,ny-jj+1,yy)
-            beta2_yy = betainc(jj+2,ny-jj+1,yy)
-            over_y = numpy.sum(c1_yy*(beta1_yy[nuax,1:]-beta1_yy[nuax,:-1])
-                               + c2_yy*(beta2_yy[nuax,1:]-beta2_yy[nuax,:-1]),
-                               axis=-1)
-
-            s_xx = (over_y[1:]-over_y[:-1])/(xx[1:]-xx[:-1])
-            c1_xx = (over_y[:-1] - s_xx*xx[:-1])/(nx+1)
-            for ii in range(0, nx+1):
-                c2_xx = s_xx*(ii+1)/((nx+1)*(nx+2))
-                beta1_xx = beta_cache_xx[ii+1,nx-ii+1]
-                beta2_xx = beta_cache_xx[ii+2,nx-ii+1]
-                value = numpy.sum(c1_xx*(beta1_xx[1:]-beta1_xx[:-1])
-                                  + c2_xx*(beta2_xx[1:]-beta2_xx[:-1]))
-                data[ii,jj] = value
+        if admix_props is not None\
+           and not numpy.array_equal(admix_props, numpy.identity(2)):
+            if nx + ny > admix_analytic_max_n\
+               and all(0 < row[0] < 1 for row in admix_props):
+                return Spectrum._from_phi_2D_direct(nx, ny, xx, yy, phi,
+                                                    mask_corners, admix_props)
+            data = Spectrum._from_phi_2D_admix_analytic(nx, ny, xx, yy, phi,
+                                                        admix_props)
+            return dadi.Spectrum(data, mask_corners=mask_corners)
+
+        # The integral is linear in phi along each axis, so the whole
+        # spectrum is Wx . phi . Wy^T. This gives the same result as the
+        # entry-by-entry calculation, up to rounding (see
+        # examples/benchmarks/from_phi_contraction.py).
+        weights_x = Spectrum._analytic_weights(nx, xx, het_ascertained == 'xx')
+        weights_y = Spectrum._analytic_weights(ny, yy, het_ascertained == 'yy')
+        data = numpy.dot(numpy.dot(weights_x, phi), weights_y.T)
         fs = dadi.Spectrum(data, mask_corners=mask_corners)
         return fs
 
@@ -1174,8 +1375,15 @@ class Spectrum(numpy.ma.masked_array):
 
         See from_phi for explanation of arguments.
         """
-        if admix_props is None:
-            admix_props = ((1,0,0), (0,1,0), (0,0,1))
+        if admix_props is None\
+           or numpy.array_equal(admix_props, numpy.identity(3)):
+            # Without admixture the sampling probabilities factor by
+            # population, and the integral is a sequence of contractions.
+            data = Spectrum._contract_3D(phi,
+                    Spectrum._direct_weights(nx, xx, het_ascertained == 'xx'),
+                    Spectrum._direct_weights(ny, yy, het_ascertained == 'yy'),
+                    Spectrum._direct_weights(nz, zz, het_ascertained == 'zz'))
+            return Spectrum(data, mask_corners=mask_corners)
 
         xadmix = admix_props[0][0]*xx[:,nuax,nuax]\
                 + admix_props[0][1]*yy[nuax,:,nuax]\
@@ -1187,44 +1395,30 @@ class Spectrum(numpy.ma.masked_array):
                 + admix_props[2][1]*yy[nuax,:,nuax]\
                 + admix_props[2][2]*zz[nuax,nuax,:]
 
+        # Trapezoid-rule weights for the full grid.
+        trap = [Spectrum._direct_weights(0, grid)[0] for grid in (xx,yy,zz)]
+        weighted = phi * trap[0][:,nuax,nuax] * trap[1][nuax,:,nuax]\
+                * trap[2][nuax,nuax,:]
+
+        # With admixture, each sampling probability varies over the full
+        # grid. Those for the first population are stacked into a matrix,
+        # so each column of the spectrum is one matrix-vector product.
+        # (from_phi does not allow het_ascertained here.)
+        factorx = numpy.array([comb(nx, ii) * xadmix**ii * (1-xadmix)**(nx-ii)
+                               for ii in range(0, nx+1)])
+        factorx = factorx.reshape(nx+1, -1)
         data = numpy.zeros((nx+1, ny+1, nz+1))
-    
-        dx, dy, dz = numpy.diff(xx), numpy.diff(yy), numpy.diff(zz)
-        half_dx = dx/2.0
-    
-        # We cache these calculations...
-        factorx_cache, factory_cache = {}, {}
-        for ii in range(0, nx+1):
-            factorx = comb(nx, ii) * xadmix**ii * (1-xadmix)**(nx-ii)
-            factorx_cache[nx,ii] = factorx
-            if het_ascertained == 'xx':
-                factorx *= xx*(1-xx)
-        for jj in range(0, ny+1):
-            factory = comb(ny, jj) * yadmix**jj * (1-yadmix)**(ny-jj)
-            factory_cache[ny,jj] = factory[nuax,:]
-            if het_ascertained == 'yy':
-                factory *= yy*(1-yy)
-    
         for kk in range(0, nz+1):
-            factorz = comb(nz, kk) * zadmix**kk * (1-zadmix)**(nz-kk)
-            if het_ascertained == 'zz':
-                factorz *= zz*(1-zz)
-            over_z = trapz(factorz[nuax, nuax,:] * phi, dx=dz)
+            over_z = comb(nz, kk) * zadmix**kk * (1-zadmix)**(nz-kk) * weighted
             for jj in range(0, ny+1):
-                factory = factory_cache[ny,jj]
-                over_y = trapz(factory * over_z, dx=dy)
-                for ii in range(0, nx+1):
-                    factorx = factorx_cache[nx,ii]
-                    # It's faster here to do the trapezoid rule explicitly
-                    # rather than using SciPy's more general routine.
-                    integrand = factorx * over_y
-                    ans = numpy.sum(half_dx * (integrand[1:]+integrand[:-1]))
-                    data[ii,jj,kk] = ans
+                factory = comb(ny, jj) * yadmix**jj * (1-yadmix)**(ny-jj)
+                data[:,jj,kk] = numpy.dot(factorx, (factory*over_z).ravel())
     
         return Spectrum(data, mask_corners=mask_corners)
 
     @staticmethod
-    def _from_phi_3D_analytic(nx, ny, nz, xx, yy, zz, phi, mask_corners=True):
+    def _from_phi_3D_analytic(nx, ny, nz, xx, yy, zz, phi, mask_corners=True,
+                              het_ascertained=None):
         """
         Compute sample Spectrum from population frequency distribution phi.
 
@@ -1233,48 +1427,37 @@ class Spectrum(numpy.ma.masked_array):
 
         See from_phi for explanation of arguments.
         """
-        data = numpy.zeros((nx+1,ny+1,nz+1))
+        data = Spectrum._contract_3D(phi,
+                Spectrum._analytic_weights(nx, xx, het_ascertained == 'xx'),
+                Spectrum._analytic_weights(ny, yy, het_ascertained == 'yy'),
+                Spectrum._analytic_weights(nz, zz, het_ascertained == 'zz'))
+        fs = dadi.Spectrum(data, mask_corners=mask_corners)
+        return fs
 
-        xx = numpy.minimum(numpy.maximum(xx, 0), 1.0)
-        yy = numpy.minimum(numpy.maximum(yy, 0), 1.0)
-        zz = numpy.minimum(numpy.maximum(zz, 0), 1.0)
 
-        beta_cache_xx = {}
-        for ii in range(0, nx+1):
-            beta_cache_xx[ii+1,nx-ii+1] = betainc(ii+1,nx-ii+1,xx)
-            beta_cache_xx[ii+2,nx-ii+1] = betainc(ii+2,nx-ii+1,xx)
-        beta_cache_yy = {}
-        for jj in range(0, ny+1):
-            beta_cache_yy[jj+1,ny-jj+1] = betainc(jj+1,ny-jj+1,yy)
-            beta_cache_yy[jj+2,ny-jj+1] = betainc(jj+2,ny-jj+1,yy)
-
-        s_zz = (phi[:,:,1:]-phi[:,:,:-1])/(zz[nuax,nuax,1:]-zz[nuax,nuax,:-1])
-        c1_zz = (phi[:,:,:-1] - s_zz*zz[nuax,nuax,:-1])/(nz+1)
-        for kk in range(0, nz+1):
-            c2_zz = s_zz*(kk+1)/((nz+1)*(nz+2))
-            beta1_zz = betainc(kk+1,nz-kk+1,zz)
-            beta2_zz = betainc(kk+2,nz-kk+1,zz)
-            over_z = numpy.sum(c1_zz*(beta1_zz[nuax,nuax,1:]-beta1_zz[nuax,nuax,:-1]) + c2_zz*(beta2_zz[nuax,nuax,1:]-beta2_zz[nuax,nuax,:-1]), axis=-1)
+    @staticmethod
+    def precompute_weights(ns, pts_l, crwd=8.):
+        """
+        Fill weights_cache with the sampling weights for a set of grids.
 
-            s_yy = (over_z[:,1:]-over_z[:,:-1])/(yy[nuax,1:]-yy[nuax,:-1])
-            c1_yy = (over_z[:,:-1] - s_yy*yy[nuax,:-1])/(ny+1)
-            for jj in range(0, ny+1):
-                c2_yy = s_yy*(jj+1)/((ny+1)*(ny+2))
-                beta1_yy = beta_cache_yy[jj+1,ny-jj+1]
-                beta2_yy = beta_cache_yy[jj+2,ny-jj+1]
-                over_y = numpy.sum(c1_yy*(beta1_yy[nuax,1:]-beta1_yy[nuax,:-1]) + c2_yy*(beta2_yy[nuax,1:]-beta2_yy[nuax,:-1]), axis=-1)
-        
-                s_xx = (over_y[1:]-over_y[:-1])/(xx[1:]-xx[:-1])
-                c1_xx = (over_y[:-1] - s_xx*xx[:-1])/(nx+1)
-                for ii in range(0, nx+1):
-                    c2_xx = s_xx*(ii+1)/((nx+1)*(nx+2))
-                    beta1_xx = beta_cache_xx[ii+1,nx-ii+1]
-                    beta2_xx = beta_cache_xx[ii+2,nx-ii+1]
-                    value = numpy.sum(c1_xx*(beta1_xx[1:]-beta1_xx[:-1]) + c2_xx*(beta2_xx[1:]-beta2_xx[:-1]))
-                    data[ii,jj,kk] = value
-        fs = dadi.Spectrum(data, mask_corners=mask_corners)
-        return fs
+        Calling this before an optimization moves the cost of computing the
+        weights out of the first model evaluation.
 
+        ns: Sequence of P sample sizes for each population.
+        pts_l: Sequence of grid sizes, as passed to an extrapolated model
+               function. Each entry is either a single size for all
+               populations or a sequence of P sizes.
+        crwd: Crowding of the grids, as in Numerics.default_grid.
+        """
+        for pts in pts_l:
+            if numpy.isscalar(pts):
+                pts = [pts]*len(ns)
+            if len(pts) != len(ns):
+                raise ValueError('Grid sizes %s do not match sample sizes %s.'
+                                 % (str(pts), str(ns)))
+            for n, p in zip(ns, pts):
+                xx = dadi.Numerics.default_grid(p, crwd=crwd)
+                Spectrum._analytic_weights(n, xx)
 
     @staticmethod
     def from_phi(phi, ns, xxs, mask_corners=True, 
@@ -1285,7 +1468,8 @@ class Spectrum(numpy.ma.masked_array):
 
         phi: P-dimensional population frequency distribution.
         ns: Sequence of P sample sizes for each population.
-        xxs: Sequence of P one-dimesional grids on which phi is defined.
+        xxs: Sequence of P one-dimesional grids on which phi is defined. These
+             may differ between populations (see Integration.two_pops).
         mask_corners: If True, resulting FS is masked in 'absent' and 'fixed'
                       entries.
         pop_ids: Optional list of strings containing the population labels.
@@ -1296,19 +1480,16 @@ class Spectrum(numpy.ma.masked_array):
                      population, then admix_props=((1-f,f),(0,1)). For three
                      populations, the no-admixture setting is
                      admix_props=((1,0,0),(0,1,0),(0,0,1)). 
-                     (Note that this option also forces direct integration,
-                     which may be less accurate than the semi-analytic
-                     method.)
+                     (Note that for three populations this option forces
+                     direct integration, which may be less accurate than
+                     the semi-analytic method.)
         het_ascertained: If 'xx', then FS is calculated assuming that SNPs have
  	                 been ascertained by being heterozygous in one
  	                 individual from population 1. (This individual is
  	                 *not* in the current sample.) If 'yy' or 'zz', it
  	                 assumed that the ascertainment individual came from
  	                 population 2 or 3, respectively.
- 	                 (Note that this option also forces direct integration,
- 	                 which may be less accurate than the semi-analytic
- 	                 method. This could be fixed if there is interest. Note
-                         also that this option cannot be used simultaneously
+                         (Note that this option cannot be used simultaneously
                          with admix_props.)
         force_direct: Forces integration to use older direct integration method,
                       rather than using analytic integration of sampling 
@@ -1320,6 +1501,9 @@ class Spectrum(numpy.ma.masked_array):
         if not phi.ndim == len(ns) == len(xxs):
             raise ValueError('Dimensionality of phi and lengths of ns and xxs '
                              'do not all agree.')
+        if tuple(len(xx) for xx in xxs) != phi.shape:
+            raise ValueError('Lengths of the grids in xxs do not match the '
+                             'shape of phi.')
         if het_ascertained and not het_ascertained in ['xx','yy','zz']:
             raise ValueError("If used, het_ascertained must be 'xx', 'yy', or "
                              "'zz'.")
@@ -1332,26 +1516,29 @@ class Spectrum(numpy.ma.masked_array):
             both options simultaneously in the future."""
             raise NotImplementedError(error)
         if phi.ndim == 1:
-            if not het_ascertained and not force_direct:
+            if not force_direct:
                 fs = Spectrum._from_phi_1D_analytic(ns[0], xxs[0], phi,
-                                                    mask_corners)
+                                                    mask_corners, False,
+                                                    het_ascertained)
             else:
                 fs = Spectrum._from_phi_1D_direct(ns[0], xxs[0], phi, 
                                                   mask_corners, het_ascertained)
         elif phi.ndim == 2:
-            if not het_ascertained and not admix_props and not force_direct:
+            if not force_direct:
                 fs = Spectrum._from_phi_2D_analytic(ns[0], ns[1], 
                                                     xxs[0], xxs[1], phi,
-                                                    mask_corners)
+                                                    mask_corners, admix_props,
+                                                    het_ascertained)
             else:
                 fs = Spectrum._from_phi_2D_direct(ns[0], ns[1], xxs[0], xxs[1], 
                                                   phi, mask_corners, 
                                                   admix_props, het_ascertained)
         elif phi.ndim == 3:
-            if not het_ascertained and not admix_props and not force_direct:
+            if not admix_props and not force_direct:
                 fs = Spectrum._from_phi_3D_analytic(ns[0], ns[1], ns[2], 
                                                     xxs[0], xxs[1], xxs[2], 
-                                                    phi, mask_corners)
+                                                    phi, mask_corners,
+                                                    het_ascertained)
             else:
                 fs = Spectrum._from_phi_3D_direct(ns[0], ns[1], ns[2], 
                                                   xxs[0], xxs[1], xxs[2], 
@@ -1361,13 +1548,59 @@ class Spectrum(numpy.ma.masked_array):
             raise ValueError('Only implemented for dimensions 1,2 or 3.')
         fs.pop_ids = pop_ids
         # Record value to use for extrapolation. This is the first grid point,
-        # which is where new mutations are introduced. Note that extrapolation
-        # will likely fail if grids differ between dimensions.
-        fs.extrap_x = xxs[0][1]
-        for xx in xxs[1:]:
-            if not xx[1] == fs.extrap_x:
-                logger.warn('Spectrum calculated from phi different grids for '
-                            'different dimensions. Extrapolation may fail.')
+        # which is where new mutations are introduced. If the grids differ
+        # between dimensions, the coarsest is used. Provided their sizes are
+        # scaled together between the grids extrapolated over, the errors of
+        # all dimensions then shrink in step with it.
+        fs.extrap_x = max(xx[1] for xx in xxs)
+        return fs
+
+    @staticmethod
+    def from_phi_mixture(phis, weights, ns, xxs, misorientation=None,
+                         mask_corners=True, pop_ids=None, admix_props=None,
+                         het_ascertained=None, force_direct=False):
+        """
+        Compute sample Spectrum from a weighted sum of population frequency
+        distributions.
+
+        Because from_phi is linear in phi, this is the weighted sum of the
+        spectra from each phi, but it only projects once. For example, a
+        model mixing non-recombining and recombining regions in proportion
+        nr, with a fraction O of SNPs correctly oriented, may use
+          fs = Spectrum.from_phi_mixture([phinr, phir], [nr, 1-nr], ns,
+                                         (xx,xx), misorientation=O)
+        in place of
+          fsnrO = Spectrum.from_phi(phinr, ns, (xx,xx))
+          fsrO = Spectrum.from_phi(phir, ns, (xx,xx))
+          fsO = nr*fsnrO + (1-nr)*fsrO
+          fs = O*fsO + (1-O)*Numerics.reverse_array(fsO)
+
+        phis: Sequence of population frequency distributions, all defined on
+              the same grids.
+        weights: Sequence of weights for each phi.
+        misorientation: If not None, the fraction of SNPs whose ancestral
+                        state is correctly assigned. The remainder contribute
+                        the reversed spectrum.
+
+        See from_phi for explanation of the other arguments.
+        """
+        if len(phis) == 0 or len(phis) != len(weights):
+            raise ValueError('Must have one weight for each of a non-empty '
+                             'sequence of phis.')
+        if len(set(phi.shape for phi in phis)) != 1:
+            raise ValueError('All phis must have the same shape.')
+
+        phi = weights[0]*phis[0]
+        for w, other in zip(weights[1:], phis[1:]):
+            phi = phi + w*other
+
+        fs = Spectrum.from_phi(phi, ns, xxs, mask_corners=mask_corners,
+                               pop_ids=pop_ids, admix_props=admix_props,
+                               het_ascertained=het_ascertained,
+                               force_direct=force_direct)
+        if misorientation is not None:
+            O = misorientation
+            fs = O*fs + (1-O)*reverse_array(fs)
         return fs
 
     def scramble_pop_ids(self, mask_corners=True):
@@ -15,6 +15,7 @@ import Integration
 import Misc
 import Numerics
 import PhiManip
+import Schedules
 # Protect import of Plotting in case matplotlib not installed.
 try:
     import Plotting
@@ -14,114 +14,138 @@
  *
  * To see versions of these functions that use variable-length arrays (and
  * thus are easier to understand, look prior to SVN revision 351.
+ *
+ * The loops over rows and columns are independent, so when dadi is built
+ * with OpenMP they are split among dadi_num_threads threads. Each thread
+ * allocates its own working arrays inside the parallel region, and uses
+ * tridiag_scratch rather than the global memory of tridiag_premalloc.
  */
 
 void implicit_2Dx(double *phi, double *xx, double *yy,
         double nu1, double m12, double gamma1, double h1,
         double dt, int L, int M, int use_delj_trick){
-    int ii, jj;
+    /* The systems for this sweep run down the columns of phi, so they are
+     * solved DADI_BLOCK neighboring columns at a time by tridiag_block. This
+     * keeps memory access contiguous, as it is in the y sweep.
+     */
+    int ii;
+    int nblocks = (M + DADI_BLOCK - 1)/DADI_BLOCK;
 
     double *dx = malloc((L-1) * sizeof(*dx));
     double *dfactor = malloc(L * sizeof(*dfactor));
     double *xInt = malloc((L-1) * sizeof(*xInt));
 
-    double Mfirst, Mlast;
-    double *MInt = malloc((L-1) * sizeof(*MInt));
     double *V = malloc(L * sizeof(*V));
     double *VInt = malloc((L-1) * sizeof(*VInt));
 
-    double *delj = malloc((L-1) * sizeof(*delj));
-
-    double *a = malloc(L * sizeof(*a));
-    double *b = malloc(L * sizeof(*b));
-    double *c = malloc(L * sizeof(*c));
-    double *r = malloc(L * sizeof(*r));
-    double *temp = malloc(L * sizeof(*temp));
-
-    double y;
-
     compute_dx(xx, L, dx);
     compute_dfactor(dx, L, dfactor);
     compute_xInt(xx, L, xInt);
-    
+
     for(ii=0; ii < L; ii++)
         V[ii] = Vfunc(xx[ii], nu1);
     for(ii=0; ii < L-1; ii++)
         VInt[ii] = Vfunc(xInt[ii], nu1);
 
-    tridiag_malloc(L);
-    for(jj=0; jj < M; jj++){
-        y = yy[jj];
-
-        Mfirst = Mfunc2D(xx[0], y, m12, gamma1, h1);
-        Mlast = Mfunc2D(xx[L-1], y, m12, gamma1, h1);
-        for(ii=0; ii < L-1; ii++)
-            MInt[ii] = Mfunc2D(xInt[ii], y, m12, gamma1, h1);
-
-        compute_delj(dx, MInt, VInt, L, delj, use_delj_trick);
-        compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, L, a, b, c);
-        for(ii = 0; ii < L; ii++)
-            r[ii] = phi[ii*M + jj]/dt;
-
-        if((jj==0) && (Mfirst <= 0))
-            b[0] += (0.5/nu1 - Mfirst)*2./dx[0];
-        if((jj==M-1) && (Mlast >= 0))
-            b[L-1] += -(-0.5/nu1 - Mlast)*2./dx[L-2];
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj, kk, jstart, B, block;
+    double y, Mfirst, Mlast;
+    double *MInt = malloc((L-1) * sizeof(*MInt));
+    double *delj = malloc((L-1) * sizeof(*delj));
+    double *a = malloc(L * sizeof(*a));
+    double *b = malloc(L * sizeof(*b));
+    double *c = malloc(L * sizeof(*c));
+    double *ablock = malloc(L*DADI_BLOCK * sizeof(*ablock));
+    double *bblock = malloc(L*DADI_BLOCK * sizeof(*bblock));
+    double *cblock = malloc(L*DADI_BLOCK * sizeof(*cblock));
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(block=0; block < nblocks; block++){
+        jstart = block*DADI_BLOCK;
+        B = (M - jstart < DADI_BLOCK) ? M - jstart : DADI_BLOCK;
+        for(kk=0; kk < B; kk++){
+            jj = jstart + kk;
+            y = yy[jj];
+
+            Mfirst = Mfunc2D(xx[0], y, m12, gamma1, h1);
+            Mlast = Mfunc2D(xx[L-1], y, m12, gamma1, h1);
+            for(ii=0; ii < L-1; ii++)
+                MInt[ii] = Mfunc2D(xInt[ii], y, m12, gamma1, h1);
+
+            compute_delj(dx, MInt, VInt, L, delj, use_delj_trick);
+            compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, L, a, b, c);
+
+            if((jj==0) && (Mfirst <= 0))
+                b[0] += (0.5/nu1 - Mfirst)*2./dx[0];
+            if((jj==M-1) && (Mlast >= 0))
+                b[L-1] += -(-0.5/nu1 - Mlast)*2./dx[L-2];
+
+            for(ii=0; ii < L; ii++){
+                ablock[ii*B + kk] = a[ii];
+                bblock[ii*B + kk] = b[ii];
+                cblock[ii*B + kk] = c[ii];
+            }
+        }
+        tridiag_block(&phi[jstart], M, ablock, bblock, cblock, B, 0, 1./dt,
+                L, B, gam, bet);
+    }
 
-        tridiag_premalloc(a, b, c, r, temp, L);
-        for(ii = 0; ii < L; ii++)
-            phi[ii*M + jj] = temp[ii];
+    free(MInt);
+    free(delj);
+    free(a);
+    free(b);
+    free(c);
+    free(ablock);
+    free(bblock);
+    free(cblock);
+    free(gam);
+    free(bet);
     }
-    tridiag_free();
 
     free(dx);
     free(dfactor);
     free(xInt);
-    free(MInt);
     free(V);
     free(VInt);
-    free(delj);
-    free(a);
-    free(b);
-    free(c);
-    free(r);
-    free(temp);
 }
 
 void implicit_2Dy(double *phi, double *xx, double *yy,
         double nu2, double m21, double gamma2, double h2,
         double dt, int L, int M, int use_delj_trick){
-    int ii, jj;
+    int jj;
 
     double *dy = malloc((M-1) * sizeof(*dy));
     double *dfactor = malloc(M * sizeof(*dfactor));
     double *yInt = malloc((M-1) * sizeof(*yInt));
 
-    double Mfirst, Mlast;
-
-    double *MInt = malloc((M-1) * sizeof(*MInt));
     double *V = malloc(M * sizeof(*V));
     double *VInt = malloc((M-1) * sizeof(*VInt));
 
-    double *delj = malloc((M-1) * sizeof(*delj));
-
-    double *a = malloc(M * sizeof(*a));
-    double *b = malloc(M * sizeof(*b));
-    double *c = malloc(M * sizeof(*c));
-    double *r = malloc(M * sizeof(*r));
-
-    double x;
-
     compute_dx(yy, M, dy);
     compute_dfactor(dy, M, dfactor);
     compute_xInt(yy, M, yInt);
-    
+
     for(jj=0; jj < M; jj++)
         V[jj] = Vfunc(yy[jj], nu2);
     for(jj=0; jj < M-1; jj++)
         VInt[jj] = Vfunc(yInt[jj], nu2);
 
-    tridiag_malloc(M);
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj;
+    double x, Mfirst, Mlast;
+    double *MInt = malloc((M-1) * sizeof(*MInt));
+    double *delj = malloc((M-1) * sizeof(*delj));
+    double *a = malloc(M * sizeof(*a));
+    double *b = malloc(M * sizeof(*b));
+    double *c = malloc(M * sizeof(*c));
+    double *r = malloc(M * sizeof(*r));
+    double *scratch = malloc(M * sizeof(*scratch));
+
+#pragma omp for
     for(ii=0; ii < L; ii++){
         x = xx[ii];
 
@@ -140,76 +164,558 @@ void implicit_2Dy(double *phi, double *xx, double *yy,
         if((ii==L-1) && (Mlast >= 0))
             b[M-1] += -(-0.5/nu2 - Mlast)*2./dy[M-2];
 
-        tridiag_premalloc(a, b, c, r, &phi[ii*M], M);
+        tridiag_scratch(a, b, c, r, &phi[ii*M], scratch, M);
     }
-    tridiag_free();
 
-    free(dy);
-    free(dfactor);
-    free(yInt);
     free(MInt);
-    free(V);
-    free(VInt);
     free(delj);
     free(a);
     free(b);
     free(c);
     free(r);
+    free(scratch);
+    }
+
+    free(dy);
+    free(dfactor);
+    free(yInt);
+    free(V);
+    free(VInt);
 }
 
 void implicit_precalc_2Dx(double *phi, double *ax, double *bx, double *cx,
         double dt, int L, int M){
     /* Warning: The bx passed in here should *not* include the 1/dt
      * contribution.
+     *
+     * As in implicit_2Dx, the columns are solved in blocks of neighbors.
      */
-    int ii, jj;
-
-    double *a = malloc(L * sizeof(*a));
-    double *b = malloc(L * sizeof(*b));
-    double *c = malloc(L * sizeof(*c));
-    double *r = malloc(L * sizeof(*r));
-    double *temp = malloc(L * sizeof(*temp));
-
-    tridiag_malloc(L);
-    for(jj=0; jj < M; jj++){
-        for(ii = 0; ii < L; ii++){
-            a[ii] = ax[ii*M + jj];
-            b[ii] = bx[ii*M + jj] + 1/dt;
-            c[ii] = cx[ii*M + jj];
-            r[ii] = 1/dt * phi[ii*M + jj];
-        }
-
-        tridiag_premalloc(a, b, c, r, temp, L);
-        for(ii = 0; ii < L; ii++)
-            phi[ii*M + jj] = temp[ii];
+    int nblocks = (M + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int jstart, B, block;
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(block=0; block < nblocks; block++){
+        jstart = block*DADI_BLOCK;
+        B = (M - jstart < DADI_BLOCK) ? M - jstart : DADI_BLOCK;
+        tridiag_block(&phi[jstart], M, &ax[jstart], &bx[jstart], &cx[jstart],
+                M, 1/dt, 1/dt, L, B, gam, bet);
     }
-    tridiag_free();
 
-    free(a);
-    free(b);
-    free(c);
-    free(r);
-    free(temp);
+    free(gam);
+    free(bet);
+    }
 }
 
 void implicit_precalc_2Dy(double *phi, double *ay, double *by, double *cy,
         double dt, int L, int M){
-    int ii, jj;
+    /* If dadi_tridiag_width is more than 1, that many neighboring rows are
+     * solved together by tridiag_interleaved.
+     */
+    int width = dadi_tridiag_width;
+    if(width > 1){
+        int ngroups = (L + width - 1)/width;
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+        {
+        int group, istart, K;
+        double *work = malloc((5*M + 1)*width * sizeof(*work));
+
+#pragma omp for
+        for(group = 0; group < ngroups; group++){
+            istart = group*width;
+            K = (L - istart < width) ? L - istart : width;
+            tridiag_interleaved(&phi[istart*M], &ay[istart*M], &by[istart*M],
+                    &cy[istart*M], M, 1/dt, 1/dt, M, K, work);
+        }
 
+        free(work);
+        }
+        return;
+    }
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj;
     double *b = malloc(M * sizeof(*b));
     double *r = malloc(M * sizeof(*r));
+    double *scratch = malloc(M * sizeof(*scratch));
 
-    tridiag_malloc(M);
+#pragma omp for
     for(ii = 0; ii < L; ii++){
         for(jj = 0; jj < M; jj++){
             b[jj] = by[ii*M + jj] + 1/dt;
             r[jj] = 1/dt * phi[ii*M + jj];
         }
 
-        tridiag_premalloc(&ay[ii*M], b, &cy[ii*M], r, &phi[ii*M], M);
+        tridiag_scratch(&ay[ii*M], b, &cy[ii*M], r, &phi[ii*M], scratch, M);
     }
-    tridiag_free();
 
     free(b);
     free(r);
+    free(scratch);
+    }
+}
+
+void implicit_precalc_2Dx_batched(double *phi, double *ax, double *bx,
+        double *cx, double *dt, int K, int L, int M){
+    /* Stack of K independent phi's, each L by M, with their own a,b,c
+     * arrays and timesteps. The kk-th phi lives at &phi[kk*L*M]. Entries
+     * with dt[kk] <= 0 have finished integrating and are left untouched.
+     */
+    int kk;
+    for(kk=0; kk < K; kk++)
+        if(dt[kk] > 0)
+            implicit_precalc_2Dx(&phi[kk*L*M], &ax[kk*L*M], &bx[kk*L*M],
+                    &cx[kk*L*M], dt[kk], L, M);
+}
+
+void implicit_precalc_2Dy_batched(double *phi, double *ay, double *by,
+        double *cy, double *dt, int K, int L, int M){
+    int kk;
+    for(kk=0; kk < K; kk++)
+        if(dt[kk] > 0)
+            implicit_precalc_2Dy(&phi[kk*L*M], &ay[kk*L*M], &by[kk*L*M],
+                    &cy[kk*L*M], dt[kk], L, M);
+}
+
+void factor_precalc_2Dx(double *ax, double *bx, double *cx, double dt,
+        int L, int M, double *gam, double *bet){
+    /* Elimination factors for implicit_precalc_2Dx with timestep dt, for use
+     * with solve_factored_2Dx. gam and bet each need room for L*M values. The
+     * factors for the block starting at column jstart are stored starting at
+     * L*jstart.
+     */
+    int nblocks = (M + DADI_BLOCK - 1)/DADI_BLOCK;
+    int block;
+
+#pragma omp parallel for if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    for(block=0; block < nblocks; block++){
+        int jstart = block*DADI_BLOCK;
+        int B = (M - jstart < DADI_BLOCK) ? M - jstart : DADI_BLOCK;
+        tridiag_block_factor(&ax[jstart], &bx[jstart], &cx[jstart], M, 1/dt,
+                L, B, &gam[L*jstart], &bet[L*jstart]);
+    }
+}
+
+void solve_factored_2Dx(double *phi, double *ax, double dt, int L, int M,
+        double *gam, double *bet){
+    /* Same result as implicit_precalc_2Dx, given the factors computed by
+     * factor_precalc_2Dx for the same dt.
+     */
+    int nblocks = (M + DADI_BLOCK - 1)/DADI_BLOCK;
+    int block;
+
+#pragma omp parallel for if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    for(block=0; block < nblocks; block++){
+        int jstart = block*DADI_BLOCK;
+        int B = (M - jstart < DADI_BLOCK) ? M - jstart : DADI_BLOCK;
+        tridiag_block_solve(&phi[jstart], M, &ax[jstart], M, 1/dt, L, B,
+                &gam[L*jstart], &bet[L*jstart]);
+    }
+}
+
+void factor_precalc_2Dy(double *ay, double *by, double *cy, double dt,
+        int L, int M, int width, double *gam, double *bet){
+    /* Elimination factors for implicit_precalc_2Dy with timestep dt, for use
+     * with solve_factored_2Dy. gam and bet each need room for L*M values.
+     *
+     * If width is more than 1, the rows are factored in groups of that many
+     * by tridiag_interleaved_factor, and the factors for the group starting
+     * at row istart are stored interleaved from gam[istart*M] on.
+     */
+    if(width > 1){
+        int ngroups = (L + width - 1)/width;
+        int group;
+#pragma omp parallel for if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+        for(group = 0; group < ngroups; group++){
+            int istart = group*width;
+            int K = (L - istart < width) ? L - istart : width;
+            tridiag_interleaved_factor(&ay[istart*M], &by[istart*M],
+                    &cy[istart*M], M, 1/dt, M, K, &gam[istart*M],
+                    &bet[istart*M]);
+        }
+        return;
+    }
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj;
+    double *b = malloc(M * sizeof(*b));
+
+#pragma omp for
+    for(ii = 0; ii < L; ii++){
+        for(jj = 0; jj < M; jj++)
+            b[jj] = by[ii*M + jj] + 1/dt;
+        tridiag_factor(&ay[ii*M], b, &cy[ii*M], &gam[ii*M], &bet[ii*M], M);
+    }
+
+    free(b);
+    }
+}
+
+void solve_factored_2Dy(double *phi, double *ay, double dt, int L, int M,
+        int width, double *gam, double *bet){
+    /* Same result as implicit_precalc_2Dy, given the factors computed by
+     * factor_precalc_2Dy for the same dt and width.
+     */
+    if(width > 1){
+        int ngroups = (L + width - 1)/width;
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+        {
+        int group, istart, K;
+        double *work = malloc(2*M*width * sizeof(*work));
+
+#pragma omp for
+        for(group = 0; group < ngroups; group++){
+            istart = group*width;
+            K = (L - istart < width) ? L - istart : width;
+            tridiag_interleaved_solve(&phi[istart*M], &ay[istart*M], M, 1/dt,
+                    M, K, &gam[istart*M], &bet[istart*M], work);
+        }
+
+        free(work);
+        }
+        return;
+    }
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj;
+    double *r = malloc(M * sizeof(*r));
+
+#pragma omp for
+    for(ii = 0; ii < L; ii++){
+        for(jj = 0; jj < M; jj++)
+            r[jj] = 1/dt * phi[ii*M + jj];
+        tridiag_solve_factored(&ay[ii*M], &gam[ii*M], &bet[ii*M], r,
+                &phi[ii*M], M);
+    }
+
+    free(r);
+    }
+}
+
+void integrate_precalc_2D(double *phi, double *xx, double *yy,
+        double *ax, double *bx, double *cx, double *ay, double *by, double *cy,
+        double dt, double T, double initial_t, double theta0,
+        int frozen1, int frozen2, int L, int M){
+    /* Integrate an entire constant-parameter epoch, from initial_t to T.
+     *
+     * This is the timestep loop of _two_pops_const_params, including the
+     * injection of new mutations, moved into C so the whole epoch costs a
+     * single call from Python. The arithmetic matches the Python loop
+     * exactly, so results are identical.
+     *
+     * Every step but the last uses the same dt, so the elimination factors
+     * for the tridiagonal solves are computed once up front. Only the
+     * truncated final step, if any, does a full solve.
+     */
+    double this_dt;
+    double current_t = initial_t;
+    int width = dadi_tridiag_width;
+    double *gamx = malloc(L*M * sizeof(*gamx));
+    double *betx = malloc(L*M * sizeof(*betx));
+    double *gamy = malloc(L*M * sizeof(*gamy));
+    double *bety = malloc(L*M * sizeof(*bety));
+
+    if(current_t < T){
+        if(!frozen1)
+            factor_precalc_2Dx(ax, bx, cx, dt, L, M, gamx, betx);
+        if(!frozen2)
+            factor_precalc_2Dy(ay, by, cy, dt, L, M, width, gamy, bety);
+    }
+    while(current_t < T){
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+        if(!frozen1)
+            phi[1*M + 0] += this_dt/xx[1] * theta0/2 * 4/((xx[2] - xx[0]) * yy[1]);
+        if(!frozen2)
+            phi[0*M + 1] += this_dt/yy[1] * theta0/2 * 4/((yy[2] - yy[0]) * xx[1]);
+        if(this_dt == dt){
+            if(!frozen1)
+                solve_factored_2Dx(phi, ax, dt, L, M, gamx, betx);
+            if(!frozen2)
+                solve_factored_2Dy(phi, ay, dt, L, M, width, gamy,
+                        bety);
+        }
+        else{
+            if(!frozen1)
+                implicit_precalc_2Dx(phi, ax, bx, cx, this_dt, L, M);
+            if(!frozen2)
+                implicit_precalc_2Dy(phi, ay, by, cy, this_dt, L, M);
+        }
+        current_t += this_dt;
+    }
+
+    free(gamx);
+    free(betx);
+    free(gamy);
+    free(bety);
+}
+
+void integrate_schedule_2D(double *phi, double *xx, double *yy,
+        double *params, double T, double initial_t, double timescale_factor,
+        int frozen1, int frozen2, int use_delj_trick, int *status,
+        int L, int M, int W){
+    /* Integrate from initial_t to T with time-dependent parameters.
+     *
+     * params has one row of length W for each of nu1, nu2, m12, m21, gamma1,
+     * gamma2, h1, h2, and theta0, each describing a schedule that is
+     * evaluated by eval_schedule. This is the timestep loop of two_pops,
+     * moved into C. If invalid parameters are encountered, integration stops
+     * and status is set to one of the DADI_PARAMS codes.
+     */
+    double nu1, nu2, m12, m21, gamma1, gamma2, h1, h2, theta0;
+    double dt, dt2, this_dt, next_t;
+    double current_t = initial_t;
+
+    status[0] = DADI_PARAMS_OK;
+
+    nu1 = eval_schedule(&params[0*W], current_t);
+    nu2 = eval_schedule(&params[1*W], current_t);
+    m12 = eval_schedule(&params[2*W], current_t);
+    m21 = eval_schedule(&params[3*W], current_t);
+    gamma1 = eval_schedule(&params[4*W], current_t);
+    gamma2 = eval_schedule(&params[5*W], current_t);
+    h1 = eval_schedule(&params[6*W], current_t);
+    h2 = eval_schedule(&params[7*W], current_t);
+    while(current_t < T){
+        dt = compute_dt_native(nu1, m12, gamma1, h1, timescale_factor);
+        dt2 = compute_dt_native(nu2, m21, gamma2, h2, timescale_factor);
+        if(dt == 0 || dt2 == 0){
+            status[0] = DADI_PARAMS_ZERO_DT;
+            return;
+        }
+        if(dt2 < dt)
+            dt = dt2;
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+
+        next_t = current_t + this_dt;
+
+        nu1 = eval_schedule(&params[0*W], next_t);
+        nu2 = eval_schedule(&params[1*W], next_t);
+        m12 = eval_schedule(&params[2*W], next_t);
+        m21 = eval_schedule(&params[3*W], next_t);
+        gamma1 = eval_schedule(&params[4*W], next_t);
+        gamma2 = eval_schedule(&params[5*W], next_t);
+        h1 = eval_schedule(&params[6*W], next_t);
+        h2 = eval_schedule(&params[7*W], next_t);
+        theta0 = eval_schedule(&params[8*W], next_t);
+
+        if(T < 0 || nu1 < 0 || nu2 < 0 || m12 < 0 || m21 < 0 || theta0 < 0){
+            status[0] = DADI_PARAMS_NEGATIVE;
+            return;
+        }
+        if(nu1 == 0 || nu2 == 0){
+            status[0] = DADI_PARAMS_ZERO_SIZE;
+            return;
+        }
+
+        if(!frozen1)
+            phi[1*M + 0] += this_dt/xx[1] * theta0/2 * 4/((xx[2] - xx[0]) * yy[1]);
+        if(!frozen2)
+            phi[0*M + 1] += this_dt/yy[1] * theta0/2 * 4/((yy[2] - yy[0]) * xx[1]);
+        if(!frozen1)
+            implicit_2Dx(phi, xx, yy, nu1, m12, gamma1, h1, this_dt, L, M,
+                    use_delj_trick);
+        if(!frozen2)
+            implicit_2Dy(phi, xx, yy, nu2, m21, gamma2, h2, this_dt, L, M,
+                    use_delj_trick);
+
+        current_t = next_t;
+    }
+}
+
+void lincomb_precalc_2Dx(double *phi, double *axM, double *bxM, double *cxM,
+        double *axV, double *bxV, double *cxV, double vscale, double dt,
+        int L, int M){
+    /* implicit_precalc_2Dx with coefficients ax = axM + vscale*axV, etc. */
+    int nblocks = (M + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int jstart, B, block;
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(block=0; block < nblocks; block++){
+        jstart = block*DADI_BLOCK;
+        B = (M - jstart < DADI_BLOCK) ? M - jstart : DADI_BLOCK;
+        tridiag_block_lincomb(&phi[jstart], M, &axM[jstart], &bxM[jstart],
+                &cxM[jstart], &axV[jstart], &bxV[jstart], &cxV[jstart], M,
+                vscale, 1/dt, 1/dt, L, B, gam, bet);
+    }
+
+    free(gam);
+    free(bet);
+    }
+}
+
+void lincomb_precalc_2Dy(double *phi, double *ayM, double *byM, double *cyM,
+        double *ayV, double *byV, double *cyV, double vscale, double dt,
+        int L, int M){
+    /* implicit_precalc_2Dy with coefficients ay = ayM + vscale*ayV, etc. Each
+     * row is a single contiguous system, solved as a block of width one.
+     */
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii;
+    double *gam = malloc(M * sizeof(*gam));
+    double bet;
+
+#pragma omp for
+    for(ii = 0; ii < L; ii++)
+        tridiag_block_lincomb(&phi[ii*M], 1, &ayM[ii*M], &byM[ii*M],
+                &cyM[ii*M], &ayV[ii*M], &byV[ii*M], &cyV[ii*M], 1, vscale,
+                1/dt, 1/dt, M, 1, gam, &bet);
+
+    free(gam);
+    }
+}
+
+void integrate_nu_schedule_2D(double *phi, double *xx, double *yy,
+        double *axM, double *bxM, double *cxM,
+        double *axV, double *bxV, double *cxV,
+        double *ayM, double *byM, double *cyM,
+        double *ayV, double *byV, double *cyV,
+        double *params, double T, double initial_t, double timescale_factor,
+        int frozen1, int frozen2, int *status, int L, int M, int W){
+    /* A faster version of integrate_schedule_2D for when only the population
+     * sizes and theta0 change over time, as in models of exponential growth.
+     *
+     * In that case the coefficients of the x sweep are axM + axV/nu1, where
+     * the M arrays hold the fixed migration and selection terms and the V
+     * arrays the drift terms for nu1 = 1 (likewise for the y sweep). So
+     * nothing needs to be recomputed from scratch on each step, and the
+     * sweeps cost little more than those for constant parameters.
+     */
+    double nu1, nu2, m12, m21, gamma1, gamma2, h1, h2, theta0;
+    double dt, dt2, this_dt, next_t;
+    double current_t = initial_t;
+
+    status[0] = DADI_PARAMS_OK;
+
+    nu1 = eval_schedule(&params[0*W], current_t);
+    nu2 = eval_schedule(&params[1*W], current_t);
+    m12 = eval_schedule(&params[2*W], current_t);
+    m21 = eval_schedule(&params[3*W], current_t);
+    gamma1 = eval_schedule(&params[4*W], current_t);
+    gamma2 = eval_schedule(&params[5*W], current_t);
+    h1 = eval_schedule(&params[6*W], current_t);
+    h2 = eval_schedule(&params[7*W], current_t);
+    while(current_t < T){
+        dt = compute_dt_native(nu1, m12, gamma1, h1, timescale_factor);
+        dt2 = compute_dt_native(nu2, m21, gamma2, h2, timescale_factor);
+        if(dt == 0 || dt2 == 0){
+            status[0] = DADI_PARAMS_ZERO_DT;
+            return;
+        }
+        if(dt2 < dt)
+            dt = dt2;
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+
+        next_t = current_t + this_dt;
+
+        nu1 = eval_schedule(&params[0*W], next_t);
+        nu2 = eval_schedule(&params[1*W], next_t);
+        theta0 = eval_schedule(&params[8*W], next_t);
+
+        if(T < 0 || nu1 < 0 || nu2 < 0 || m12 < 0 || m21 < 0 || theta0 < 0){
+            status[0] = DADI_PARAMS_NEGATIVE;
+            return;
+        }
+        if(nu1 == 0 || nu2 == 0){
+            status[0] = DADI_PARAMS_ZERO_SIZE;
+            return;
+        }
+
+        if(!frozen1)
+            phi[1*M + 0] += this_dt/xx[1] * theta0/2 * 4/((xx[2] - xx[0]) * yy[1]);
+        if(!frozen2)
+            phi[0*M + 1] += this_dt/yy[1] * theta0/2 * 4/((yy[2] - yy[0]) * xx[1]);
+        if(!frozen1)
+            lincomb_precalc_2Dx(phi, axM, bxM, cxM, axV, bxV, cxV, 1./nu1,
+                    this_dt, L, M);
+        if(!frozen2)
+            lincomb_precalc_2Dy(phi, ayM, byM, cyM, ayV, byV, cyV, 1./nu2,
+                    this_dt, L, M);
+
+        current_t = next_t;
+    }
+}
+
+void implicit_precalc_2Dx_fl(float *phi, float *ax, float *bx, float *cx,
+        double dt, int L, int M){
+    /* As implicit_precalc_2Dx, with single precision storage. */
+    int nblocks = (M + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int jstart, B, block;
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+    double *u = malloc(L*DADI_BLOCK * sizeof(*u));
+
+#pragma omp for
+    for(block=0; block < nblocks; block++){
+        jstart = block*DADI_BLOCK;
+        B = (M - jstart < DADI_BLOCK) ? M - jstart : DADI_BLOCK;
+        tridiag_block_mixed(&phi[jstart], M, &ax[jstart], &bx[jstart],
+                &cx[jstart], M, 1/dt, 1/dt, L, B, gam, bet, u);
+    }
+
+    free(gam);
+    free(bet);
+    free(u);
+    }
+}
+
+void implicit_precalc_2Dy_fl(float *phi, float *ay, float *by, float *cy,
+        double dt, int L, int M){
+    /* As implicit_precalc_2Dy, with single precision storage. Each row is
+     * contiguous, so is solved on its own.
+     */
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii;
+    double *gam = malloc(M * sizeof(*gam));
+    double bet;
+    double *u = malloc(M * sizeof(*u));
+
+#pragma omp for
+    for(ii = 0; ii < L; ii++)
+        tridiag_block_mixed(&phi[ii*M], 1, &ay[ii*M], &by[ii*M], &cy[ii*M],
+                1, 1/dt, 1/dt, M, 1, gam, &bet, u);
+
+    free(gam);
+    free(u);
+    }
+}
+
+void integrate_precalc_2D_fl(float *phi, double *xx, double *yy,
+        float *ax, float *bx, float *cx, float *ay, float *by, float *cy,
+        double dt, double T, double initial_t, double theta0,
+        int frozen1, int frozen2, int L, int M){
+    /* As integrate_precalc_2D, but with phi and the coefficients stored in
+     * single precision, which halves the memory traffic of the sweeps. The
+     * arithmetic of each solve is still done in double precision.
+     */
+    double this_dt;
+    double current_t = initial_t;
+    while(current_t < T){
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+        if(!frozen1)
+            phi[1*M + 0] += this_dt/xx[1] * theta0/2 * 4/((xx[2] - xx[0]) * yy[1]);
+        if(!frozen2)
+            phi[0*M + 1] += this_dt/yy[1] * theta0/2 * 4/((yy[2] - yy[0]) * xx[1]);
+        if(!frozen1)
+            implicit_precalc_2Dx_fl(phi, ax, bx, cx, this_dt, L, M);
+        if(!frozen2)
+            implicit_precalc_2Dy_fl(phi, ay, by, cy, this_dt, L, M);
+        current_t += this_dt;
+    }
 }
@@ -7,45 +7,57 @@
  * variable-length arrays such as arr[L][M][N].
  *
  * See integration2D.c for detail on how this complicates indexing, and what
- * tricks are necessary.
+ * tricks are necessary, and for how the loops are split among threads.
  */
 
 void implicit_3Dx(double *phi, double *xx, double *yy, double *zz,
         double nu1, double m12, double m13, double gamma1, double h1,
         double dt, int L, int M, int N, int use_delj_trick){
-    int ii,jj,kk;
+    /* For each jj, the systems for neighboring kk sit side by side in memory,
+     * so they are solved DADI_BLOCK at a time by tridiag_block. See
+     * implicit_2Dx.
+     */
+    int ii;
+    int nblocks = (N + DADI_BLOCK - 1)/DADI_BLOCK;
 
     double *dx = malloc((L-1) * sizeof(*dx));
     double *dfactor = malloc(L * sizeof(*dfactor));
     double *xInt = malloc((L-1) * sizeof(*xInt));
 
-    double Mfirst, Mlast;
-    double *MInt = malloc((L-1) * sizeof(*MInt));
     double *V = malloc(L * sizeof(*V));
     double *VInt = malloc((L-1) * sizeof(*VInt));
 
-    double *delj = malloc((L-1) * sizeof(*delj));
-
-    double *a = malloc(L * sizeof(*a));
-    double *b = malloc(L * sizeof(*b));
-    double *c = malloc(L * sizeof(*c));
-    double *r = malloc(L * sizeof(*r));
-    double *temp = malloc(L * sizeof(*temp));
-
-    double y, z;
-
     compute_dx(xx, L, dx);
     compute_dfactor(dx, L, dfactor);
     compute_xInt(xx, L, xInt);
-    
+
     for(ii=0; ii < L; ii++)
         V[ii] = Vfunc(xx[ii], nu1);
     for(ii=0; ii < L-1; ii++)
         VInt[ii] = Vfunc(xInt[ii], nu1);
 
-    tridiag_malloc(L);
-    for(jj = 0; jj < M; jj++){
-        for(kk = 0; kk < N; kk++){
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj, kk, ll, kstart, B, item;
+    double y, z, Mfirst, Mlast;
+    double *MInt = malloc((L-1) * sizeof(*MInt));
+    double *delj = malloc((L-1) * sizeof(*delj));
+    double *a = malloc(L * sizeof(*a));
+    double *b = malloc(L * sizeof(*b));
+    double *c = malloc(L * sizeof(*c));
+    double *ablock = malloc(L*DADI_BLOCK * sizeof(*ablock));
+    double *bblock = malloc(L*DADI_BLOCK * sizeof(*bblock));
+    double *cblock = malloc(L*DADI_BLOCK * sizeof(*cblock));
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(item = 0; item < M*nblocks; item++){
+        jj = item / nblocks;
+        kstart = (item % nblocks)*DADI_BLOCK;
+        B = (N - kstart < DADI_BLOCK) ? N - kstart : DADI_BLOCK;
+        for(ll = 0; ll < B; ll++){
+            kk = kstart + ll;
             y = yy[jj];
             z = zz[kk];
 
@@ -56,72 +68,86 @@ void implicit_3Dx(double *phi, double *xx, double *yy, double *zz,
 
             compute_delj(dx, MInt, VInt, L, delj, use_delj_trick);
             compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, L, a, b, c);
-            for(ii = 0; ii < L; ii++)
-                r[ii] = phi[ii*M*N + jj*N + kk]/dt;
 
             if((jj==0) && (kk==0) && (Mfirst <= 0))
                 b[0] += (0.5/nu1 - Mfirst)*2./dx[0];
             if((jj==M-1) && (kk==N-1) && (Mlast >= 0))
                 b[L-1] += -(-0.5/nu1 - Mlast)*2./dx[L-2];
 
-            tridiag_premalloc(a, b, c, r, temp, L);
-            for(ii = 0; ii < L; ii++)
-                phi[ii*M*N + jj*N + kk] = temp[ii];
+            for(ii=0; ii < L; ii++){
+                ablock[ii*B + ll] = a[ii];
+                bblock[ii*B + ll] = b[ii];
+                cblock[ii*B + ll] = c[ii];
+            }
         }
+        tridiag_block(&phi[jj*N + kstart], M*N, ablock, bblock, cblock, B,
+                0, 1./dt, L, B, gam, bet);
     }
-    tridiag_free();
 
-    free(dx);
-    free(dfactor);
-    free(xInt);
     free(MInt);
-    free(V);
-    free(VInt);
     free(delj);
     free(a);
     free(b);
     free(c);
-    free(r);
-    free(temp);
+    free(ablock);
+    free(bblock);
+    free(cblock);
+    free(gam);
+    free(bet);
+    }
+
+    free(dx);
+    free(dfactor);
+    free(xInt);
+    free(V);
+    free(VInt);
 }
 
 void implicit_3Dy(double *phi, double *xx, double *yy, double *zz,
         double nu2, double m21, double m23, double gamma2, double h2,
         double dt, int L, int M, int N, int use_delj_trick){
-    int ii,jj,kk;
+    /* Blocked over neighboring kk, as in implicit_3Dx. */
+    int jj;
+    int nblocks = (N + DADI_BLOCK - 1)/DADI_BLOCK;
 
     double *dy = malloc((M-1) * sizeof(*dy));
     double *dfactor = malloc(M * sizeof(*dfactor));
     double *yInt = malloc((M-1) * sizeof(*yInt));
 
-    double Mfirst, Mlast;
-
-    double *MInt = malloc((M-1) * sizeof(*MInt));
     double *V = malloc(M * sizeof(*V));
     double *VInt = malloc((M-1) * sizeof(*VInt));
 
-    double *delj = malloc((M-1) * sizeof(*delj));
-
-    double *a = malloc(M * sizeof(*a));
-    double *b = malloc(M * sizeof(*b));
-    double *c = malloc(M * sizeof(*c));
-    double *r = malloc(M * sizeof(*r));
-    double *temp = malloc(M * sizeof(*temp));
-
-    double x, z;
-
     compute_dx(yy, M, dy);
     compute_dfactor(dy, M, dfactor);
     compute_xInt(yy, M, yInt);
-    
+
     for(jj=0; jj < M; jj++)
         V[jj] = Vfunc(yy[jj], nu2);
     for(jj=0; jj < M-1; jj++)
         VInt[jj] = Vfunc(yInt[jj], nu2);
 
-    tridiag_malloc(M);
-    for(ii = 0; ii < L; ii++){
-        for(kk = 0; kk < N; kk++){
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj, kk, ll, kstart, B, item;
+    double x, z, Mfirst, Mlast;
+    double *MInt = malloc((M-1) * sizeof(*MInt));
+    double *delj = malloc((M-1) * sizeof(*delj));
+    double *a = malloc(M * sizeof(*a));
+    double *b = malloc(M * sizeof(*b));
+    double *c = malloc(M * sizeof(*c));
+    double *ablock = malloc(M*DADI_BLOCK * sizeof(*ablock));
+    double *bblock = malloc(M*DADI_BLOCK * sizeof(*bblock));
+    double *cblock = malloc(M*DADI_BLOCK * sizeof(*cblock));
+    double *gam = malloc(M*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(item = 0; item < L*nblocks; item++){
+        ii = item / nblocks;
+        kstart = (item % nblocks)*DADI_BLOCK;
+        B = (N - kstart < DADI_BLOCK) ? N - kstart : DADI_BLOCK;
+        for(ll = 0; ll < B; ll++){
+            kk = kstart + ll;
             x = xx[ii];
             z = zz[kk];
 
@@ -132,70 +158,75 @@ void implicit_3Dy(double *phi, double *xx, double *yy, double *zz,
 
             compute_delj(dy, MInt, VInt, M, delj, use_delj_trick);
             compute_abc_nobc(dy, dfactor, delj, MInt, V, dt, M, a, b, c);
-            for(jj = 0; jj < M; jj++)
-                r[jj] = phi[ii*M*N + jj*N + kk]/dt;
 
             if((ii==0) && (kk==0) && (Mfirst <= 0))
                 b[0] += (0.5/nu2 - Mfirst)*2./dy[0];
             if((ii==L-1) && (kk==N-1) && (Mlast >= 0))
                 b[M-1] += -(-0.5/nu2 - Mlast)*2./dy[M-2];
 
-            tridiag_premalloc(a, b, c, r, temp, M);
-            for(jj = 0; jj < M; jj++)
-                phi[ii*M*N + jj*N + kk] = temp[jj];
+            for(jj=0; jj < M; jj++){
+                ablock[jj*B + ll] = a[jj];
+                bblock[jj*B + ll] = b[jj];
+                cblock[jj*B + ll] = c[jj];
+            }
         }
+        tridiag_block(&phi[ii*M*N + kstart], N, ablock, bblock, cblock, B,
+                0, 1./dt, M, B, gam, bet);
     }
-    tridiag_free();
 
-    free(dy);
-    free(dfactor);
-    free(yInt);
     free(MInt);
-    free(V);
-    free(VInt);
     free(delj);
     free(a);
     free(b);
     free(c);
-    free(r);
-    free(temp);
+    free(ablock);
+    free(bblock);
+    free(cblock);
+    free(gam);
+    free(bet);
+    }
+
+    free(dy);
+    free(dfactor);
+    free(yInt);
+    free(V);
+    free(VInt);
 }
 
 void implicit_3Dz(double *phi, double *xx, double *yy, double *zz,
         double nu3, double m31, double m32, double gamma3, double h3,
         double dt, int L, int M, int N, int use_delj_trick){
-    int ii,jj,kk;
+    int kk;
 
     double *dz = malloc((N-1) * sizeof(*dz));
     double *dfactor = malloc(N * sizeof(*dfactor));
     double *zInt = malloc((N-1) * sizeof(*zInt));
 
-    double Mfirst, Mlast;
-
-    double *MInt = malloc((N-1) * sizeof(*MInt));
     double *V = malloc(N * sizeof(*V));
     double *VInt = malloc((N-1) * sizeof(*VInt));
 
-    double *delj = malloc((N-1) * sizeof(*delj));
-
-    double *a = malloc(N * sizeof(*a));
-    double *b = malloc(N * sizeof(*b));
-    double *c = malloc(N * sizeof(*c));
-    double *r = malloc(N * sizeof(*r));
-    double *temp = malloc(N * sizeof(*temp));
-
-    double x, y;
-
     compute_dx(zz, N, dz);
     compute_dfactor(dz, N, dfactor);
     compute_xInt(zz, N, zInt);
-    
+
     for(kk=0; kk < N; kk++)
         V[kk] = Vfunc(zz[kk], nu3);
     for(kk=0; kk < N-1; kk++)
         VInt[kk] = Vfunc(zInt[kk], nu3);
 
-    tridiag_malloc(N);
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, jj, kk;
+    double x, y, Mfirst, Mlast;
+    double *MInt = malloc((N-1) * sizeof(*MInt));
+    double *delj = malloc((N-1) * sizeof(*delj));
+    double *a = malloc(N * sizeof(*a));
+    double *b = malloc(N * sizeof(*b));
+    double *c = malloc(N * sizeof(*c));
+    double *r = malloc(N * sizeof(*r));
+    double *scratch = malloc(N * sizeof(*scratch));
+
+#pragma omp for
     for(ii = 0; ii < L; ii++){
         for(jj = 0; jj < M; jj++){
             x = xx[ii];
@@ -216,109 +247,115 @@ void implicit_3Dz(double *phi, double *xx, double *yy, double *zz,
             if((ii==L-1) && (jj==M-1) && (Mlast >= 0))
                 b[N-1] += -(-0.5/nu3 - Mlast)*2./dz[N-2];
 
-            tridiag_premalloc(a, b, c, r, &phi[ii*M*N + jj*N], N);
+            tridiag_scratch(a, b, c, r, &phi[ii*M*N + jj*N], scratch, N);
         }
     }
-    tridiag_free();
 
-    free(dz);
-    free(dfactor);
-    free(zInt);
     free(MInt);
-    free(V);
-    free(VInt);
     free(delj);
     free(a);
     free(b);
     free(c);
     free(r);
-    free(temp);
+    free(scratch);
+    }
+
+    free(dz);
+    free(dfactor);
+    free(zInt);
+    free(V);
+    free(VInt);
 }
 
 void implicit_precalc_3Dx(double *phi, double *ax, double *bx, double *cx,
         double dt, int L, int M, int N){
-    int ii,jj,kk;
-    int index;
-
-    double *a = malloc(L * sizeof(*a));
-    double *b = malloc(L * sizeof(*b));
-    double *c = malloc(L * sizeof(*c));
-    double *r = malloc(L * sizeof(*r));
-    double *new_row = malloc(L * sizeof(*new_row));
-
-    tridiag_malloc(L);
-    for(jj = 0; jj < M; jj++){
-        for(kk = 0; kk < N; kk++){
-            for(ii = 0; ii < L; ii++){
-                index = ii*M*N + jj*N + kk;
-                a[ii] = ax[index];
-                b[ii] = bx[index] + 1/dt;
-                c[ii] = cx[index];
-                r[ii] = 1/dt * phi[index];
-            }
-
-            tridiag_premalloc(a, b, c, r, new_row, L);
-            for(ii = 0; ii < L; ii++)
-                phi[ii*M*N + jj*N + kk] = new_row[ii];
-        }
+    /* Blocked over neighboring kk, as in implicit_3Dx. */
+    int nblocks = (N + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int jj, kstart, B, item, index;
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(item = 0; item < M*nblocks; item++){
+        jj = item / nblocks;
+        kstart = (item % nblocks)*DADI_BLOCK;
+        B = (N - kstart < DADI_BLOCK) ? N - kstart : DADI_BLOCK;
+        index = jj*N + kstart;
+        tridiag_block(&phi[index], M*N, &ax[index], &bx[index], &cx[index],
+                M*N, 1/dt, 1/dt, L, B, gam, bet);
     }
-    tridiag_free();
 
-    free(a);
-    free(b);
-    free(c);
-    free(r);
-    free(new_row);
+    free(gam);
+    free(bet);
+    }
 }
 
 void implicit_precalc_3Dy(double *phi, double *ay, double *by, double *cy,
         double dt, int L, int M, int N){
-    int ii,jj,kk;
-    int index;
-
-    double *a = malloc(M * sizeof(*a));
-    double *b = malloc(M * sizeof(*b));
-    double *c = malloc(M * sizeof(*c));
-    double *r = malloc(M * sizeof(*r));
-    double *new_row = malloc(M * sizeof(*new_row));
-
-    tridiag_malloc(M);
-    for(ii = 0; ii < L; ii++){
-        for(kk = 0; kk < N; kk++){
-            for(jj = 0; jj < M; jj++){
-                index = ii*M*N + jj*N + kk;
-                a[jj] = ay[index];
-                b[jj] = by[index] + 1/dt;
-                c[jj] = cy[index];
-                r[jj] = 1/dt * phi[index];
-            }
-
-            tridiag_premalloc(a, b, c, r, new_row, M);
-            for(jj = 0; jj < M; jj++)
-                phi[ii*M*N + jj*N + kk] = new_row[jj];
-        }
+    /* Blocked over neighboring kk, as in implicit_3Dx. */
+    int nblocks = (N + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, kstart, B, item, index;
+    double *gam = malloc(M*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+
+#pragma omp for
+    for(item = 0; item < L*nblocks; item++){
+        ii = item / nblocks;
+        kstart = (item % nblocks)*DADI_BLOCK;
+        B = (N - kstart < DADI_BLOCK) ? N - kstart : DADI_BLOCK;
+        index = ii*M*N + kstart;
+        tridiag_block(&phi[index], N, &ay[index], &by[index], &cy[index],
+                N, 1/dt, 1/dt, M, B, gam, bet);
     }
-    tridiag_free();
 
-    free(a);
-    free(b);
-    free(c);
-    free(r);
-    free(new_row);
+    free(gam);
+    free(bet);
+    }
 }
 
 void implicit_precalc_3Dz(double *phi, double *az, double *bz, double *cz,
         double dt, int L, int M, int N){
+    /* As in implicit_precalc_2Dy, the systems are solved dadi_tridiag_width
+     * at a time if that is more than 1.
+     */
+    int width = dadi_tridiag_width;
+    if(width > 1){
+        int ngroups = (L*M + width - 1)/width;
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+        {
+        int group, start, K;
+        double *work = malloc((5*N + 1)*width * sizeof(*work));
+
+#pragma omp for
+        for(group = 0; group < ngroups; group++){
+            start = group*width;
+            K = (L*M - start < width) ? L*M - start : width;
+            tridiag_interleaved(&phi[start*N], &az[start*N], &bz[start*N],
+                    &cz[start*N], N, 1/dt, 1/dt, N, K, work);
+        }
+
+        free(work);
+        }
+        return;
+    }
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
     int ii,jj,kk;
     int index;
-
     double *a = malloc(N * sizeof(*a));
     double *b = malloc(N * sizeof(*b));
     double *c = malloc(N * sizeof(*c));
     double *r = malloc(N * sizeof(*r));
-    double *new_row = malloc(N * sizeof(*new_row));
+    double *scratch = malloc(N * sizeof(*scratch));
 
-    tridiag_malloc(N);
+#pragma omp for
     for(ii = 0; ii < L; ii++){
         for(jj = 0; jj < M; jj++){
             for(kk = 0; kk < N; kk++){
@@ -329,14 +366,325 @@ void implicit_precalc_3Dz(double *phi, double *az, double *bz, double *cz,
                 r[kk] = 1/dt * phi[index];
             }
 
-            tridiag_premalloc(a, b, c, r, &phi[ii*M*N + jj*N], N);
+            tridiag_scratch(a, b, c, r, &phi[ii*M*N + jj*N], scratch, N);
         }
     }
-    tridiag_free();
 
     free(a);
     free(b);
     free(c);
     free(r);
-    free(new_row);
+    free(scratch);
+    }
+}
+
+void integrate_precalc_3D(double *phi, double *xx, double *yy, double *zz,
+        double *ax, double *bx, double *cx, double *ay, double *by, double *cy,
+        double *az, double *bz, double *cz,
+        double dt, double T, double initial_t, double theta0,
+        int frozen1, int frozen2, int frozen3, int L, int M, int N){
+    /* Integrate an entire constant-parameter epoch, from initial_t to T.
+     *
+     * As integrate_precalc_2D, this is the timestep loop of
+     * _three_pops_const_params, including mutation injection.
+     */
+    double this_dt;
+    double current_t = initial_t;
+    while(current_t < T){
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+        if(!frozen1)
+            phi[1*M*N] += this_dt/xx[1] * theta0/2 * 8/((xx[2] - xx[0]) * yy[1] * zz[1]);
+        if(!frozen2)
+            phi[1*N] += this_dt/yy[1] * theta0/2 * 8/((yy[2] - yy[0]) * xx[1] * zz[1]);
+        if(!frozen3)
+            phi[1] += this_dt/zz[1] * theta0/2 * 8/((zz[2] - zz[0]) * xx[1] * yy[1]);
+        if(!frozen1)
+            implicit_precalc_3Dx(phi, ax, bx, cx, this_dt, L, M, N);
+        if(!frozen2)
+            implicit_precalc_3Dy(phi, ay, by, cy, this_dt, L, M, N);
+        if(!frozen3)
+            implicit_precalc_3Dz(phi, az, bz, cz, this_dt, L, M, N);
+        current_t += this_dt;
+    }
+}
+
+void integrate_schedule_3D(double *phi, double *xx, double *yy, double *zz,
+        double *params, double T, double initial_t, double timescale_factor,
+        int frozen1, int frozen2, int frozen3, int use_delj_trick,
+        int *status, int L, int M, int N, int W){
+    /* As integrate_schedule_2D, for three populations. The rows of params
+     * are nu1, nu2, nu3, m12, m13, m21, m23, m31, m32, gamma1, gamma2,
+     * gamma3, h1, h2, h3, and theta0.
+     */
+    double p[16];
+    double dt, dt2, dt3, this_dt, next_t;
+    double current_t = initial_t;
+    int ii;
+    /* Aliases into p, in the order of the rows of params. */
+    double *nu = &p[0], *m = &p[3], *gamma = &p[9], *h = &p[12];
+
+    status[0] = DADI_PARAMS_OK;
+
+    for(ii=0; ii < 15; ii++)
+        p[ii] = eval_schedule(&params[ii*W], current_t);
+    while(current_t < T){
+        /* The sums of migration rates are accumulated as Python's sum()
+         * would, so the timesteps match those of three_pops exactly. */
+        dt = compute_dt_native(nu[0], 0 + m[0] + m[1], gamma[0], h[0],
+                timescale_factor);
+        dt2 = compute_dt_native(nu[1], 0 + m[2] + m[3], gamma[1], h[1],
+                timescale_factor);
+        dt3 = compute_dt_native(nu[2], 0 + m[4] + m[5], gamma[2], h[2],
+                timescale_factor);
+        if(dt == 0 || dt2 == 0 || dt3 == 0){
+            status[0] = DADI_PARAMS_ZERO_DT;
+            return;
+        }
+        if(dt2 < dt)
+            dt = dt2;
+        if(dt3 < dt)
+            dt = dt3;
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+
+        next_t = current_t + this_dt;
+
+        for(ii=0; ii < 16; ii++)
+            p[ii] = eval_schedule(&params[ii*W], next_t);
+
+        if(T < 0 || p[15] < 0){
+            status[0] = DADI_PARAMS_NEGATIVE;
+            return;
+        }
+        for(ii=0; ii < 9; ii++){
+            if(p[ii] < 0){
+                status[0] = DADI_PARAMS_NEGATIVE;
+                return;
+            }
+        }
+        if(nu[0] == 0 || nu[1] == 0 || nu[2] == 0){
+            status[0] = DADI_PARAMS_ZERO_SIZE;
+            return;
+        }
+
+        if(!frozen1)
+            phi[1*M*N] += this_dt/xx[1] * p[15]/2 * 8/((xx[2] - xx[0]) * yy[1] * zz[1]);
+        if(!frozen2)
+            phi[1*N] += this_dt/yy[1] * p[15]/2 * 8/((yy[2] - yy[0]) * xx[1] * zz[1]);
+        if(!frozen3)
+            phi[1] += this_dt/zz[1] * p[15]/2 * 8/((zz[2] - zz[0]) * xx[1] * yy[1]);
+        if(!frozen1)
+            implicit_3Dx(phi, xx, yy, zz, nu[0], m[0], m[1], gamma[0], h[0],
+                    this_dt, L, M, N, use_delj_trick);
+        if(!frozen2)
+            implicit_3Dy(phi, xx, yy, zz, nu[1], m[2], m[3], gamma[1], h[1],
+                    this_dt, L, M, N, use_delj_trick);
+        if(!frozen3)
+            implicit_3Dz(phi, xx, yy, zz, nu[2], m[4], m[5], gamma[2], h[2],
+                    this_dt, L, M, N, use_delj_trick);
+
+        current_t = next_t;
+    }
+}
+
+void implicit_lean_3D(double *phi, double *coef, double bfirst, double blast,
+        double *uu, double *vv, double dt, int n, int own_stride,
+        int nu_len, int u_stride, int nv_len, int v_stride){
+    /* One sweep of a constant-parameter 3D integration, without the full
+     * pts^3 coefficient arrays of implicit_precalc_3Dx etc.
+     *
+     * With constant parameters (and no delj trick), the coefficients along
+     * the sweep direction depend on the other two coordinates u and v only
+     * through the migration terms, linearly. So coef holds nine arrays of
+     * length n: the a, b, and c coefficients at u = v = 0, then their
+     * derivatives with respect to u, then with respect to v. The coefficients
+     * for each system are assembled from these on the fly. bfirst and blast
+     * are the boundary terms added to b at the two corners of the domain.
+     *
+     * The sweep runs along an axis of length n and stride own_stride in phi.
+     * uu and vv hold the grids of the other two axes. If v_stride is 1,
+     * neighboring systems in v are solved together, DADI_BLOCK at a time.
+     */
+    int Bmax = (v_stride == 1) ? DADI_BLOCK : 1;
+    int nblocks = (nv_len + Bmax - 1)/Bmax;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, ll, uind, vstart, B, item;
+    double u, v;
+    double *a = malloc(n*Bmax * sizeof(*a));
+    double *b = malloc(n*Bmax * sizeof(*b));
+    double *c = malloc(n*Bmax * sizeof(*c));
+    double *gam = malloc(n*Bmax * sizeof(*gam));
+    double *bet = malloc(Bmax * sizeof(*bet));
+
+#pragma omp for
+    for(item = 0; item < nu_len*nblocks; item++){
+        uind = item / nblocks;
+        vstart = (item % nblocks)*Bmax;
+        B = (nv_len - vstart < Bmax) ? nv_len - vstart : Bmax;
+        u = uu[uind];
+        for(ii = 0; ii < n; ii++){
+            for(ll = 0; ll < B; ll++){
+                v = vv[vstart + ll];
+                a[ii*B + ll] = coef[0*n + ii] + u*coef[3*n + ii]
+                        + v*coef[6*n + ii];
+                b[ii*B + ll] = coef[1*n + ii] + u*coef[4*n + ii]
+                        + v*coef[7*n + ii];
+                c[ii*B + ll] = coef[2*n + ii] + u*coef[5*n + ii]
+                        + v*coef[8*n + ii];
+            }
+        }
+        if((uind == 0) && (vstart == 0))
+            b[0] += bfirst;
+        if((uind == nu_len-1) && (vstart + B == nv_len))
+            b[(n-1)*B + B-1] += blast;
+
+        tridiag_block(&phi[uind*u_stride + vstart*v_stride], own_stride,
+                a, b, c, B, 1/dt, 1/dt, n, B, gam, bet);
+    }
+
+    free(a);
+    free(b);
+    free(c);
+    free(gam);
+    free(bet);
+    }
+}
+
+void integrate_lean_3D(double *phi, double *xx, double *yy, double *zz,
+        double *coefx, double *coefy, double *coefz, double *corners,
+        double dt, double T, double initial_t, double theta0,
+        int frozen1, int frozen2, int frozen3, int L, int M, int N){
+    /* As integrate_precalc_3D, but with coefficients in the factored form of
+     * implicit_lean_3D. corners holds bfirst and blast for x, then for y,
+     * then for z.
+     */
+    double this_dt;
+    double current_t = initial_t;
+    while(current_t < T){
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+        if(!frozen1)
+            phi[1*M*N] += this_dt/xx[1] * theta0/2 * 8/((xx[2] - xx[0]) * yy[1] * zz[1]);
+        if(!frozen2)
+            phi[1*N] += this_dt/yy[1] * theta0/2 * 8/((yy[2] - yy[0]) * xx[1] * zz[1]);
+        if(!frozen3)
+            phi[1] += this_dt/zz[1] * theta0/2 * 8/((zz[2] - zz[0]) * xx[1] * yy[1]);
+        if(!frozen1)
+            implicit_lean_3D(phi, coefx, corners[0], corners[1], yy, zz,
+                    this_dt, L, M*N, M, N, N, 1);
+        if(!frozen2)
+            implicit_lean_3D(phi, coefy, corners[2], corners[3], xx, zz,
+                    this_dt, M, N, L, M*N, N, 1);
+        if(!frozen3)
+            implicit_lean_3D(phi, coefz, corners[4], corners[5], xx, yy,
+                    this_dt, N, 1, L, M*N, M, N);
+        current_t += this_dt;
+    }
+}
+
+void implicit_precalc_3Dx_fl(float *phi, float *ax, float *bx, float *cx,
+        double dt, int L, int M, int N){
+    /* As implicit_precalc_3Dx, with single precision storage. */
+    int nblocks = (N + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int jj, kstart, B, item, index;
+    double *gam = malloc(L*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+    double *u = malloc(L*DADI_BLOCK * sizeof(*u));
+
+#pragma omp for
+    for(item = 0; item < M*nblocks; item++){
+        jj = item / nblocks;
+        kstart = (item % nblocks)*DADI_BLOCK;
+        B = (N - kstart < DADI_BLOCK) ? N - kstart : DADI_BLOCK;
+        index = jj*N + kstart;
+        tridiag_block_mixed(&phi[index], M*N, &ax[index], &bx[index],
+                &cx[index], M*N, 1/dt, 1/dt, L, B, gam, bet, u);
+    }
+
+    free(gam);
+    free(bet);
+    free(u);
+    }
+}
+
+void implicit_precalc_3Dy_fl(float *phi, float *ay, float *by, float *cy,
+        double dt, int L, int M, int N){
+    /* As implicit_precalc_3Dy, with single precision storage. */
+    int nblocks = (N + DADI_BLOCK - 1)/DADI_BLOCK;
+
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int ii, kstart, B, item, index;
+    double *gam = malloc(M*DADI_BLOCK * sizeof(*gam));
+    double *bet = malloc(DADI_BLOCK * sizeof(*bet));
+    double *u = malloc(M*DADI_BLOCK * sizeof(*u));
+
+#pragma omp for
+    for(item = 0; item < L*nblocks; item++){
+        ii = item / nblocks;
+        kstart = (item % nblocks)*DADI_BLOCK;
+        B = (N - kstart < DADI_BLOCK) ? N - kstart : DADI_BLOCK;
+        index = ii*M*N + kstart;
+        tridiag_block_mixed(&phi[index], N, &ay[index], &by[index],
+                &cy[index], N, 1/dt, 1/dt, M, B, gam, bet, u);
+    }
+
+    free(gam);
+    free(bet);
+    free(u);
+    }
+}
+
+void implicit_precalc_3Dz_fl(float *phi, float *az, float *bz, float *cz,
+        double dt, int L, int M, int N){
+    /* As implicit_precalc_3Dz, with single precision storage. Each row is
+     * contiguous, so is solved on its own.
+     */
+#pragma omp parallel if(dadi_num_threads > 1) num_threads(dadi_num_threads)
+    {
+    int row;
+    double *gam = malloc(N * sizeof(*gam));
+    double bet;
+    double *u = malloc(N * sizeof(*u));
+
+#pragma omp for
+    for(row = 0; row < L*M; row++)
+        tridiag_block_mixed(&phi[row*N], 1, &az[row*N], &bz[row*N],
+                &cz[row*N], 1, 1/dt, 1/dt, N, 1, gam, &bet, u);
+
+    free(gam);
+    free(u);
+    }
+}
+
+void integrate_precalc_3D_fl(float *phi, double *xx, double *yy, double *zz,
+        float *ax, float *bx, float *cx, float *ay, float *by, float *cy,
+        float *az, float *bz, float *cz,
+        double dt, double T, double initial_t, double theta0,
+        int frozen1, int frozen2, int frozen3, int L, int M, int N){
+    /* As integrate_precalc_3D, but with phi and the coefficients stored in
+     * single precision. The arithmetic of each solve is still done in double
+     * precision.
+     */
+    double this_dt;
+    double current_t = initial_t;
+    while(current_t < T){
+        this_dt = (T - current_t < dt) ? T - current_t : dt;
+        if(!frozen1)
+            phi[1*M*N] += this_dt/xx[1] * theta0/2 * 8/((xx[2] - xx[0]) * yy[1] * zz[1]);
+        if(!frozen2)
+            phi[1*N] += this_dt/yy[1] * theta0/2 * 8/((yy[2] - yy[0]) * xx[1] * zz[1]);
+        if(!frozen3)
+            phi[1] += this_dt/zz[1] * theta0/2 * 8/((zz[2] - zz[0]) * xx[1] * yy[1]);
+        if(!frozen1)
+            implicit_precalc_3Dx_fl(phi, ax, bx, cx, this_dt, L, M, N);
+        if(!frozen2)
+            implicit_precalc_3Dy_fl(phi, ay, by, cy, this_dt, L, M, N);
+        if(!frozen3)
+            implicit_precalc_3Dz_fl(phi, az, bz, cz, this_dt, L, M, N);
+        current_t += this_dt;
+    }
 }
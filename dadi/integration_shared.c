@@ -1,5 +1,61 @@
 #include <stdio.h>
 #include <math.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#include "integration_shared.h"
+
+int dadi_num_threads = 1;
+
+void set_num_threads(int n){
+    dadi_num_threads = (n > 0) ? n : 1;
+}
+
+void get_max_threads(int *n){
+    /* 0 indicates that dadi was built without OpenMP. */
+#ifdef _OPENMP
+    *n = omp_get_max_threads();
+#else
+    *n = 0;
+#endif
+}
+
+double eval_schedule(double *s, double t){
+    /* Kind codes and layouts match _encode in Schedules.py. */
+    int ii, n;
+    switch((int)s[0]){
+        case 1:
+            return s[1] * pow(s[2]/s[1], (t - s[4])/s[3]);
+        case 2:
+            return s[1] + (s[2] - s[1])*(t - s[4])/s[3];
+        case 3:
+            n = (int)s[1];
+            for(ii=0; ii < n && s[2+ii] <= t; ii++);
+            return s[2+n+ii];
+        default:
+            return s[1];
+    }
+}
+
+double compute_dt_native(double nu, double msum, double gamma, double h,
+        double timescale_factor){
+    /* The same calculation as _compute_dt in Integration.py. */
+    double maxVM = 0.25/nu;
+    double hfact = fabs(h + (1-2*h)*0.5) * 0.5*(1-0.5);
+    double hfact2 = fabs(h + (1-2*h)*0.25) * 0.25*(1-0.25);
+    double gfact;
+    if(hfact2 > hfact)
+        hfact = hfact2;
+    gfact = fabs(gamma) * 2*hfact;
+    if(msum > maxVM)
+        maxVM = msum;
+    if(gfact > maxVM)
+        maxVM = gfact;
+    if(maxVM > 0)
+        return timescale_factor / maxVM;
+    return HUGE_VAL;
+}
 
 double Vfunc(double x, double nu){
     return 1./nu * x*(1.-x);
@@ -79,3 +135,282 @@ void compute_abc_nobc(double *dx, double *dfactor,
         c[ii] = -dfactor[ii]*ctemp;
     }
 }
+
+void tridiag_block(double *phi, int phi_stride, double *a, double *b,
+        double *c, int coef_stride, double bshift, double rscale, int n, int B,
+        double *gam, double *bet){
+    int ii, kk;
+    double *row, *prev;
+    double g;
+
+    for(kk=0; kk < B; kk++){
+        bet[kk] = b[kk] + bshift;
+        phi[kk] = rscale * phi[kk]/bet[kk];
+    }
+    for(ii=1; ii < n; ii++){
+        row = &phi[ii*phi_stride];
+        prev = &phi[(ii-1)*phi_stride];
+        for(kk=0; kk < B; kk++){
+            g = c[(ii-1)*coef_stride + kk]/bet[kk];
+            gam[ii*B + kk] = g;
+            bet[kk] = b[ii*coef_stride + kk] + bshift 
+                    - a[ii*coef_stride + kk]*g;
+            row[kk] = (rscale * row[kk] - a[ii*coef_stride + kk]*prev[kk])
+                    / bet[kk];
+        }
+    }
+    for(ii=n-2; ii >= 0; ii--){
+        row = &phi[ii*phi_stride];
+        prev = &phi[(ii+1)*phi_stride];
+        for(kk=0; kk < B; kk++)
+            row[kk] -= gam[(ii+1)*B + kk]*prev[kk];
+    }
+}
+
+void tridiag_block_factor(double *a, double *b, double *c, int coef_stride,
+        double bshift, int n, int B, double *gam, double *bet){
+    int ii, kk;
+
+    for(kk=0; kk < B; kk++)
+        bet[kk] = b[kk] + bshift;
+    for(ii=1; ii < n; ii++){
+        for(kk=0; kk < B; kk++){
+            gam[ii*B + kk] = c[(ii-1)*coef_stride + kk]/bet[(ii-1)*B + kk];
+            bet[ii*B + kk] = b[ii*coef_stride + kk] + bshift
+                    - a[ii*coef_stride + kk]*gam[ii*B + kk];
+        }
+    }
+}
+
+void tridiag_block_solve(double *phi, int phi_stride, double *a,
+        int coef_stride, double rscale, int n, int B, double *gam,
+        double *bet){
+    int ii, kk;
+    double *row, *prev;
+
+    for(kk=0; kk < B; kk++)
+        phi[kk] = rscale * phi[kk]/bet[kk];
+    for(ii=1; ii < n; ii++){
+        row = &phi[ii*phi_stride];
+        prev = &phi[(ii-1)*phi_stride];
+        for(kk=0; kk < B; kk++)
+            row[kk] = (rscale * row[kk] - a[ii*coef_stride + kk]*prev[kk])
+                    / bet[ii*B + kk];
+    }
+    for(ii=n-2; ii >= 0; ii--){
+        row = &phi[ii*phi_stride];
+        prev = &phi[(ii+1)*phi_stride];
+        for(kk=0; kk < B; kk++)
+            row[kk] -= gam[(ii+1)*B + kk]*prev[kk];
+    }
+}
+
+void tridiag_block_lincomb(double *phi, int phi_stride, double *aM,
+        double *bM, double *cM, double *aV, double *bV, double *cV,
+        int coef_stride, double vscale, double bshift, double rscale, int n,
+        int B, double *gam, double *bet){
+    int ii, kk, index;
+    double *row, *prev;
+    double g, a;
+
+    for(kk=0; kk < B; kk++){
+        bet[kk] = bM[kk] + vscale*bV[kk] + bshift;
+        phi[kk] = rscale * phi[kk]/bet[kk];
+    }
+    for(ii=1; ii < n; ii++){
+        row = &phi[ii*phi_stride];
+        prev = &phi[(ii-1)*phi_stride];
+        for(kk=0; kk < B; kk++){
+            index = ii*coef_stride + kk;
+            g = (cM[index - coef_stride] + vscale*cV[index - coef_stride])
+                    /bet[kk];
+            a = aM[index] + vscale*aV[index];
+            gam[ii*B + kk] = g;
+            bet[kk] = bM[index] + vscale*bV[index] + bshift - a*g;
+            row[kk] = (rscale * row[kk] - a*prev[kk])/bet[kk];
+        }
+    }
+    for(ii=n-2; ii >= 0; ii--){
+        row = &phi[ii*phi_stride];
+        prev = &phi[(ii+1)*phi_stride];
+        for(kk=0; kk < B; kk++)
+            row[kk] -= gam[(ii+1)*B + kk]*prev[kk];
+    }
+}
+
+void tridiag_block_mixed(float *phi, int phi_stride, float *a, float *b,
+        float *c, int coef_stride, double bshift, double rscale, int n, int B,
+        double *gam, double *bet, double *u){
+    int ii, kk;
+    double g;
+
+    for(kk=0; kk < B; kk++){
+        bet[kk] = b[kk] + bshift;
+        u[kk] = rscale * phi[kk]/bet[kk];
+    }
+    for(ii=1; ii < n; ii++){
+        for(kk=0; kk < B; kk++){
+            g = c[(ii-1)*coef_stride + kk]/bet[kk];
+            gam[ii*B + kk] = g;
+            bet[kk] = b[ii*coef_stride + kk] + bshift
+                    - a[ii*coef_stride + kk]*g;
+            u[ii*B + kk] = (rscale * phi[ii*phi_stride + kk]
+                    - a[ii*coef_stride + kk]*u[(ii-1)*B + kk]) / bet[kk];
+        }
+    }
+    for(kk=0; kk < B; kk++)
+        phi[(n-1)*phi_stride + kk] = (float)u[(n-1)*B + kk];
+    for(ii=n-2; ii >= 0; ii--){
+        for(kk=0; kk < B; kk++){
+            u[ii*B + kk] -= gam[(ii+1)*B + kk]*u[(ii+1)*B + kk];
+            phi[ii*phi_stride + kk] = (float)u[ii*B + kk];
+        }
+    }
+}
+
+int dadi_tridiag_width = 4;
+
+void set_tridiag_width(int k){
+    dadi_tridiag_width = (k > 1) ? k : 1;
+}
+
+static inline void tridiag_interleaved_k(double *phi, double *a, double *b,
+        double *c, int stride, double bshift, double rscale, int n, const int k,
+        double *work){
+    /* The body of tridiag_interleaved, written out so that it can be
+     * specialized for the common widths. With k known at compile time the
+     * loops over kk have a fixed length and vectorize cleanly.
+     */
+    double *ai = work, *bi = &work[n*k], *ci = &work[2*n*k];
+    double *u = &work[3*n*k], *gam = &work[4*n*k], *bet = &work[5*n*k];
+    int ii, kk;
+    double g;
+
+    for(kk=0; kk < k; kk++){
+        for(ii=0; ii < n; ii++){
+            ai[ii*k + kk] = a[kk*stride + ii];
+            bi[ii*k + kk] = b[kk*stride + ii];
+            ci[ii*k + kk] = c[kk*stride + ii];
+            u[ii*k + kk] = phi[kk*stride + ii];
+        }
+    }
+
+    for(kk=0; kk < k; kk++){
+        bet[kk] = bi[kk] + bshift;
+        u[kk] = rscale * u[kk]/bet[kk];
+    }
+    for(ii=1; ii < n; ii++){
+        for(kk=0; kk < k; kk++){
+            g = ci[(ii-1)*k + kk]/bet[kk];
+            gam[ii*k + kk] = g;
+            bet[kk] = bi[ii*k + kk] + bshift - ai[ii*k + kk]*g;
+            u[ii*k + kk] = (rscale * u[ii*k + kk]
+                    - ai[ii*k + kk]*u[(ii-1)*k + kk]) / bet[kk];
+        }
+    }
+    for(ii=n-2; ii >= 0; ii--){
+        for(kk=0; kk < k; kk++)
+            u[ii*k + kk] -= gam[(ii+1)*k + kk]*u[(ii+1)*k + kk];
+    }
+
+    for(kk=0; kk < k; kk++)
+        for(ii=0; ii < n; ii++)
+            phi[kk*stride + ii] = u[ii*k + kk];
+}
+
+void tridiag_interleaved(double *phi, double *a, double *b, double *c,
+        int stride, double bshift, double rscale, int n, int K, double *work){
+    switch(K){
+        case 4:
+            tridiag_interleaved_k(phi, a, b, c, stride, bshift, rscale, n, 4,
+                    work);
+            break;
+        case 8:
+            tridiag_interleaved_k(phi, a, b, c, stride, bshift, rscale, n, 8,
+                    work);
+            break;
+        default:
+            tridiag_interleaved_k(phi, a, b, c, stride, bshift, rscale, n, K,
+                    work);
+    }
+}
+
+static inline void tridiag_interleaved_factor_k(double *a, double *b,
+        double *c, int stride, double bshift, int n, const int k, double *gam,
+        double *bet){
+    int ii, kk;
+
+    for(kk=0; kk < k; kk++)
+        bet[kk] = b[kk*stride] + bshift;
+    for(ii=1; ii < n; ii++){
+        for(kk=0; kk < k; kk++){
+            gam[ii*k + kk] = c[kk*stride + ii-1]/bet[(ii-1)*k + kk];
+            bet[ii*k + kk] = b[kk*stride + ii] + bshift
+                    - a[kk*stride + ii]*gam[ii*k + kk];
+        }
+    }
+}
+
+void tridiag_interleaved_factor(double *a, double *b, double *c, int stride,
+        double bshift, int n, int K, double *gam, double *bet){
+    switch(K){
+        case 4:
+            tridiag_interleaved_factor_k(a, b, c, stride, bshift, n, 4, gam,
+                    bet);
+            break;
+        case 8:
+            tridiag_interleaved_factor_k(a, b, c, stride, bshift, n, 8, gam,
+                    bet);
+            break;
+        default:
+            tridiag_interleaved_factor_k(a, b, c, stride, bshift, n, K, gam,
+                    bet);
+    }
+}
+
+static inline void tridiag_interleaved_solve_k(double *phi, double *a,
+        int stride, double rscale, int n, const int k, double *gam,
+        double *bet, double *work){
+    double *ai = work, *u = &work[n*k];
+    int ii, kk;
+
+    for(kk=0; kk < k; kk++){
+        for(ii=0; ii < n; ii++){
+            ai[ii*k + kk] = a[kk*stride + ii];
+            u[ii*k + kk] = phi[kk*stride + ii];
+        }
+    }
+
+    for(kk=0; kk < k; kk++)
+        u[kk] = rscale * u[kk]/bet[kk];
+    for(ii=1; ii < n; ii++){
+        for(kk=0; kk < k; kk++)
+            u[ii*k + kk] = (rscale * u[ii*k + kk]
+                    - ai[ii*k + kk]*u[(ii-1)*k + kk]) / bet[ii*k + kk];
+    }
+    for(ii=n-2; ii >= 0; ii--){
+        for(kk=0; kk < k; kk++)
+            u[ii*k + kk] -= gam[(ii+1)*k + kk]*u[(ii+1)*k + kk];
+    }
+
+    for(kk=0; kk < k; kk++)
+        for(ii=0; ii < n; ii++)
+            phi[kk*stride + ii] = u[ii*k + kk];
+}
+
+void tridiag_interleaved_solve(double *phi, double *a, int stride,
+        double rscale, int n, int K, double *gam, double *bet, double *work){
+    switch(K){
+        case 4:
+            tridiag_interleaved_solve_k(phi, a, stride, rscale, n, 4, gam, bet,
+                    work);
+            break;
+        case 8:
+            tridiag_interleaved_solve_k(phi, a, stride, rscale, n, 8, gam, bet,
+                    work);
+            break;
+        default:
+            tridiag_interleaved_solve_k(phi, a, stride, rscale, n, K, gam, bet,
+                    work);
+    }
+}
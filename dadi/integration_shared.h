@@ -1,3 +1,37 @@
+/* Number of threads used for the sweeps over independent rows and columns in
+ * the 2D and 3D integrations. This only has an effect if dadi was built with
+ * OpenMP.
+ */
+extern int dadi_num_threads;
+void set_num_threads(int n);
+/* Maximum number of threads available to OpenMP, or 0 if dadi was built
+ * without OpenMP.
+ */
+void get_max_threads(int *n);
+/* Number of tridiagonal systems interleaved by tridiag_interleaved in the
+ * sweeps whose systems are contiguous in memory (along y in 2D and z in 3D).
+ * 1 means those systems are solved one at a time with tridiag_scratch. The
+ * default is 4.
+ */
+extern int dadi_tridiag_width;
+void set_tridiag_width(int k);
+
+/* Value at time t of the parameter schedule s, encoded as by _encode in
+ * Schedules.py.
+ */
+double eval_schedule(double *s, double t);
+/* Timestep for the given parameters, as computed by _compute_dt in
+ * Integration.py. msum is the sum of the migration rates into the population.
+ */
+double compute_dt_native(double nu, double msum, double gamma, double h,
+        double timescale_factor);
+/* Status codes returned by the integrations that evaluate schedules natively.
+ */
+#define DADI_PARAMS_OK 0
+#define DADI_PARAMS_NEGATIVE 1
+#define DADI_PARAMS_ZERO_SIZE 2
+#define DADI_PARAMS_ZERO_DT 3
+
 /* First, functions that define the dynamics we're integrating. These are not
  * used in the 'precalc' integration functions. For those, we do all this work
  * in Python.
@@ -29,3 +63,68 @@ void compute_delj(double *dx, double *MInt, double *VInt,
 void compute_abc_nobc(double *dx, double *dfactor, 
         double *delj, double *MInt, double *V, double dt, int N,
         double *a, double *b, double *c);
+
+/* Width of the tiles of neighboring systems solved together by tridiag_block.
+ */
+#define DADI_BLOCK 32
+/* Solve B tridiagonal systems of size n at once, in place in phi.
+ *
+ * Element ii of system kk is at phi[ii*phi_stride + kk], and the corresponding
+ * coefficients at a[ii*coef_stride + kk] (likewise b and c). So the B systems
+ * sit side by side in memory, and every step of the Thomas algorithm works on
+ * a contiguous stretch of B values rather than striding down one system.
+ *
+ * Each system solved is (b + bshift) u = rscale * phi, with a and c on the
+ * off-diagonals. gam must have room for n*B values and bet for B values.
+ */
+void tridiag_block(double *phi, int phi_stride, double *a, double *b,
+        double *c, int coef_stride, double bshift, double rscale, int n, int B,
+        double *gam, double *bet);
+/* tridiag_block split in two, for when the same systems are solved for many
+ * right-hand sides. tridiag_block_factor computes the elimination factors
+ * for b + bshift once, and tridiag_block_solve then solves in place for
+ * rscale * phi. Both gam and bet must have room for n*B values, and the
+ * results are identical to those of tridiag_block.
+ */
+void tridiag_block_factor(double *a, double *b, double *c, int coef_stride,
+        double bshift, int n, int B, double *gam, double *bet);
+void tridiag_block_solve(double *phi, int phi_stride, double *a,
+        int coef_stride, double rscale, int n, int B, double *gam,
+        double *bet);
+/* As tridiag_block, but each coefficient is given by two parts, as
+ * a = aM + vscale*aV. This is used when only the population size changes over
+ * time, in which case the drift (V) part of the coefficients simply scales by
+ * 1/nu and the migration and selection (M) part is fixed.
+ */
+void tridiag_block_lincomb(double *phi, int phi_stride, double *aM,
+        double *bM, double *cM, double *aV, double *bV, double *cV,
+        int coef_stride, double vscale, double bshift, double rscale, int n,
+        int B, double *gam, double *bet);
+/* As tridiag_block, but with phi and the coefficients stored in single
+ * precision. The elimination is carried out in double precision, in the
+ * scratch array u of n*B values, and only the solution is rounded back to
+ * single precision.
+ */
+void tridiag_block_mixed(float *phi, int phi_stride, float *a, float *b,
+        float *c, int coef_stride, double bshift, double rscale, int n, int B,
+        double *gam, double *bet, double *u);
+/* Solve K tridiagonal systems of size n in place, each stored contiguously.
+ *
+ * Element ii of system kk is at phi[kk*stride + ii], and likewise for a, b,
+ * and c. The systems are copied into work interleaved, as tridiag_block
+ * expects, solved together, and copied back. This lets the Thomas algorithm
+ * work on K systems at each step, rather than following the serial chain of
+ * a single system. K of 4 and 8 are specialized for vectorization. The
+ * systems and results are as for tridiag_block, and work must have room for
+ * (5*n + 1)*K values.
+ */
+void tridiag_interleaved(double *phi, double *a, double *b, double *c,
+        int stride, double bshift, double rscale, int n, int K, double *work);
+/* tridiag_interleaved split in two, as tridiag_block_factor and
+ * tridiag_block_solve. The factors are stored interleaved, so gam and bet
+ * each need room for n*K values, and work for 2*n*K values.
+ */
+void tridiag_interleaved_factor(double *a, double *b, double *c, int stride,
+        double bshift, int n, int K, double *gam, double *bet);
+void tridiag_interleaved_solve(double *phi, double *a, int stride,
+        double rscale, int n, int K, double *gam, double *bet, double *work);
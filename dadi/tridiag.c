@@ -18,25 +18,73 @@ void tridiag_premalloc(double a[], double b[], double c[], double r[], double u[
     This version can re-use dynamically allocated memory in the global gam
     variable.
     */
+    tridiag_scratch(a, b, c, r, u, gam, n);
+}
+
+void tridiag_scratch(double a[], double b[], double c[], double r[], double u[],
+        double scratch[], int n){
+    /*
+    Based on Numerical Recipes in C tridiag function.
+
+    This version uses caller-provided scratch memory of length n, so it is
+    safe to call from multiple threads as long as each has its own scratch.
+    */
     double bet = b[0];
     int j;
 
     u[0] = r[0]/bet;
     for(j=1; j <= n-1; j++){
-        gam[j] = c[j-1]/bet;
-        bet = b[j] - a[j]*gam[j];
+        scratch[j] = c[j-1]/bet;
+        bet = b[j] - a[j]*scratch[j];
         u[j] = (r[j]-a[j]*u[j-1])/bet;
     }
     
+    for(j=(n-2); j >= 0; j--){
+        u[j] -= scratch[j+1]*u[j+1];
+    }
+}
+
+void tridiag_factor(double a[], double b[], double c[], double gam[],
+        double bet[], int n){
+    /*
+    Elimination factors of tridiag_scratch for the matrix given by a, b, and c.
+
+    These depend only on the matrix, so when the same system is solved for
+    many right-hand sides they need only be computed once. gam[0] is unused.
+    */
+    int j;
+
+    bet[0] = b[0];
+    for(j=1; j <= n-1; j++){
+        gam[j] = c[j-1]/bet[j-1];
+        bet[j] = b[j] - a[j]*gam[j];
+    }
+}
+
+void tridiag_solve_factored(double a[], double gam[], double bet[],
+        double r[], double u[], int n){
+    /*
+    Solve the tridiagonal system factored by tridiag_factor.
+
+    The result is identical to that of tridiag_scratch, at about half the
+    cost.
+    */
+    int j;
+
+    u[0] = r[0]/bet[0];
+    for(j=1; j <= n-1; j++){
+        u[j] = (r[j]-a[j]*u[j-1])/bet[j];
+    }
+    
     for(j=(n-2); j >= 0; j--){
         u[j] -= gam[j+1]*u[j+1];
     }
 }
 
 void tridiag(double a[], double b[], double c[], double r[], double u[], int n){
-    tridiag_malloc(n);
-    tridiag_premalloc(a,b,c,r,u,n);
-    tridiag_free();
+    double *scratch = malloc(n * sizeof(*scratch));
+    tridiag_scratch(a,b,c,r,u,scratch,n);
+    free(scratch);
 }
 
 void tridiag_fl(float a[], float b[], float c[], float r[], float u[], int n){
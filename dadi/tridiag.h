@@ -9,4 +9,17 @@ void tridiag_free();
  * improved performance with repeated solution of problems of the same size.
  */
 void tridiag_premalloc(double a[], double b[], double c[], double r[], double u[], int n);
+/* This version uses caller-provided scratch memory of length n, rather than
+ * the global memory used by tridiag_premalloc, so it is thread-safe.
+ */
+void tridiag_scratch(double a[], double b[], double c[], double r[], double u[],
+        double scratch[], int n);
+/* Factor the tridiagonal matrix given by a, b, c once, so that systems
+ * involving it can be solved repeatedly with tridiag_solve_factored. gam and
+ * bet must each have room for n values.
+ */
+void tridiag_factor(double a[], double b[], double c[], double gam[],
+        double bet[], int n);
+void tridiag_solve_factored(double a[], double gam[], double bet[],
+        double r[], double u[], int n);
 #endif
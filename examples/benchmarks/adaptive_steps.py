@@ -0,0 +1,58 @@
+"""
+Steps taken and accuracy of adaptive timestepping, compared with the fixed
+timesteps set by timescale_factor.
+
+The model is a brief, severe bottleneck followed by growth, with migration.
+Errors are the maximum difference from a reference spectrum computed with
+very fine fixed timesteps, relative to the maximum entry.
+"""
+import time
+
+import numpy
+
+import dadi
+
+pts, ns = 60, (20, 20)
+xx = dadi.Numerics.default_grid(pts)
+epochs = [(0.05, 0.1, 0.1), (0.5, 2.0, 3.0)]
+
+def model():
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    for T, nu1, nu2 in epochs:
+        phi = dadi.Integration.two_pops(phi, xx, T, nu1, nu2, m12=1, m21=1)
+    return dadi.Spectrum.from_phi(phi, ns, (xx, xx))
+
+def fixed_steps():
+    # Number of steps taken with constant parameters in each epoch.
+    steps = 0
+    for T, nu1, nu2 in epochs:
+        dt = dadi.Integration.timescale_factor / max(0.25/nu1, 0.25/nu2, 1)
+        steps += int(numpy.ceil(T/dt - 1e-9))
+    return steps
+
+dadi.Integration.epoch_cache.enabled = False
+dadi.Integration.timescale_factor = 1e-5
+ref = model()
+
+def error(fs):
+    return abs(fs - ref).max() / abs(ref).max()
+
+print '%-10s %8s %8s %10s %8s' % ('mode', 'setting', 'steps', 'error', 'time')
+for factor in [1e-2, 3e-3, 1e-3, 3e-4]:
+    dadi.Integration.timescale_factor = factor
+    start = time.time()
+    fs = model()
+    print '%-10s %8.0e %8i %10.2e %8.2f' % ('fixed', factor, fixed_steps(),
+                                            error(fs), time.time() - start)
+
+dadi.Integration.timescale_factor = 1e-3
+dadi.Integration.adaptive_timestep = True
+for tol in [1e-3, 1e-4, 1e-5]:
+    dadi.Integration.adaptive_tolerance = tol
+    dadi.Integration.reset_step_counts()
+    start = time.time()
+    fs = model()
+    print '%-10s %8.0e %8i %10.2e %8.2f' % ('adaptive', tol,
+                                            dadi.Integration.step_counts['accepted'],
+                                            error(fs), time.time() - start)
@@ -0,0 +1,41 @@
+"""
+Agreement of PhiManip.phi_2D_equilibrium with a long two_pops integration,
+with and without Integration.use_delj_trick. The difference column is the
+maximum difference between the two spectra, relative to the maximum entry.
+It is the time discretization error of the stepped integration.
+
+The epoch cache is left on, so this also checks that changing
+use_delj_trick gives a new equilibrium rather than a cached one.
+"""
+import time
+
+import numpy
+
+import dadi
+
+params = dict(nu1=2, nu2=0.5, m12=1, m21=0.3, gamma1=-1, gamma2=2)
+
+print '%6s %6s %12s %10s %10s' % ('pts', 'delj', 'difference', 'two_pops',
+                                  'solve')
+for pts in [30, 60]:
+    xx = dadi.Numerics.default_grid(pts)
+    phi0 = dadi.PhiManip.phi_1D(xx)
+    phi0 = dadi.PhiManip.phi_1D_to_2D(xx, phi0)
+    equilibria = []
+    for delj in [False, True]:
+        dadi.Integration.use_delj_trick = delj
+        start = time.time()
+        phi = dadi.Integration.two_pops(phi0, xx, 100, **params)
+        t_integrate = time.time() - start
+        start = time.time()
+        eq = dadi.PhiManip.phi_2D_equilibrium(xx, **params)
+        t_solve = time.time() - start
+        equilibria.append(eq)
+        fs = dadi.Spectrum.from_phi(phi, (20, 20), (xx, xx))
+        fs_eq = dadi.Spectrum.from_phi(eq, (20, 20), (xx, xx))
+        diff = abs(fs - fs_eq).max() / abs(fs).max()
+        print '%6i %6s %12.2e %10.3f %10.3f' % (pts, delj, diff, t_integrate,
+                                                t_solve)
+    dadi.Integration.use_delj_trick = False
+    assert not numpy.allclose(equilibria[0], equilibria[1], rtol=1e-12,
+                              atol=0), 'use_delj_trick had no effect'
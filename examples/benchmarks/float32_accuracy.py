@@ -0,0 +1,68 @@
+"""
+Accuracy and timing of single precision integration
+(Integration.use_float32) on observed spectra.
+
+Usage: python float32_accuracy.py data1.fs [data2.fs ...]
+
+e.g. the Lampetra spectra in Lampetra_data_Demo/Unfolded/DataUnfolded.
+
+For each data set, secondary contact and isolation-with-migration models
+with typical parameters are evaluated, by extrapolation, at the sample sizes
+of the data in double and in single precision. Reported are the largest
+relative difference between the two model spectra (over entries larger than
+1e-6 of the total), and the difference in multinomial log-likelihood of the
+data.
+"""
+import sys
+import time
+
+import numpy
+
+import dadi
+
+def SC(params, ns, pts):
+    nu1, nu2, m12, m21, Ts, Tsc = params
+    xx = dadi.Numerics.default_grid(pts)
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    phi = dadi.Integration.two_pops(phi, xx, Ts, nu1, nu2, m12=0, m21=0)
+    phi = dadi.Integration.two_pops(phi, xx, Tsc, nu1, nu2, m12=m12, m21=m21)
+    return dadi.Spectrum.from_phi(phi, ns, (xx,xx))
+
+def IM(params, ns, pts):
+    nu1, nu2, m12, m21, Ts = params
+    xx = dadi.Numerics.default_grid(pts)
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    phi = dadi.Integration.two_pops(phi, xx, Ts, nu1, nu2, m12=m12, m21=m21)
+    return dadi.Spectrum.from_phi(phi, ns, (xx,xx))
+
+models = [('SC', SC, [1.5, 0.8, 2.0, 1.0, 1.0, 0.2]),
+          ('IM', IM, [1.5, 0.8, 0.5, 0.3, 2.0])]
+
+dadi.Integration.epoch_cache.enabled = False
+
+print '%-28s %5s %6s %12s %12s %8s %8s' % ('data', 'model', 'pts', 'max rel',
+                                           'delta ll', 't64', 't32')
+for fname in sys.argv[1:]:
+    data = dadi.Spectrum.from_file(fname)
+    n = max(data.sample_sizes)
+    pts_l = [n+10, n+20, n+30]
+    for name, func, params in models:
+        func_ex = dadi.Numerics.make_extrap_log_func(func)
+        results = []
+        for single in [False, True]:
+            dadi.Integration.use_float32 = single
+            start = time.time()
+            model = func_ex(params, data.sample_sizes, pts_l)
+            results.append((model, time.time() - start))
+        dadi.Integration.use_float32 = False
+        (fs64, t64), (fs32, t32) = results
+
+        big = fs64 > 1e-6 * fs64.sum()
+        maxrel = numpy.max(abs(fs32 - fs64)[big] / fs64[big])
+        dll = dadi.Inference.ll_multinom(fs32, data)\
+                - dadi.Inference.ll_multinom(fs64, data)
+        print '%-28s %5s %6i %12.2e %12.2e %8.3f %8.3f' % (fname[-28:], name,
+                                                           pts_l[-1], maxrel,
+                                                           dll, t64, t32)
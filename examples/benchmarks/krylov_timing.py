@@ -0,0 +1,34 @@
+"""
+Timing of constant-parameter two-population epochs of increasing length,
+integrated by implicit timestepping and by the Krylov propagator
+(Integration.use_krylov_propagator).
+
+The difference column is the maximum difference between the two spectra,
+relative to the maximum entry. It is the time discretization error of the
+stepped integration.
+"""
+import time
+
+import dadi
+
+dadi.Integration.epoch_cache.enabled = False
+
+print '%6s %6s %10s %10s %12s' % ('pts', 'T', 'stepping', 'krylov',
+                                  'difference')
+for pts in [40, 80, 120]:
+    xx = dadi.Numerics.default_grid(pts)
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    for T in [0.1, 1, 10]:
+        results = []
+        for krylov in [False, True]:
+            dadi.Integration.use_krylov_propagator = krylov
+            start = time.time()
+            out = dadi.Integration.two_pops(phi, xx, T, nu1=2, nu2=0.5,
+                                            m12=1, m21=0.3)
+            results.append((time.time() - start,
+                            dadi.Spectrum.from_phi(out, (20, 20), (xx, xx))))
+        dadi.Integration.use_krylov_propagator = False
+        (t_step, fs_step), (t_krylov, fs_krylov) = results
+        diff = abs(fs_step - fs_krylov).max() / abs(fs_step).max()
+        print '%6i %6g %10.3f %10.3f %12.2e' % (pts, T, t_step, t_krylov, diff)
@@ -0,0 +1,47 @@
+"""
+Accuracy and cost of per-population grid sizes, for a pair of populations
+with very unequal sample sizes.
+
+The model is isolation with migration. Spectra are extrapolated from three
+grid sizes, either shared by both populations or with a smaller grid for the
+population with the smaller sample. Errors are the summed absolute difference
+from a reference spectrum extrapolated from very fine grids, relative to its
+total.
+"""
+import time
+
+import numpy
+
+import dadi
+
+ns = (40, 8)
+
+def IM(params, ns, pts):
+    nu1, nu2, m12, m21, Ts = params
+    if numpy.isscalar(pts):
+        pts = (pts, pts)
+    xx, yy = [dadi.Numerics.default_grid(p) for p in pts]
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi, yy)
+    phi = dadi.Integration.two_pops(phi, (xx, yy), Ts, nu1, nu2,
+                                    m12=m12, m21=m21)
+    return dadi.Spectrum.from_phi(phi, ns, (xx, yy))
+
+func_ex = dadi.Numerics.make_extrap_log_func(IM)
+dadi.Integration.epoch_cache.enabled = False
+
+pts_ls = [[30, 35, 40],
+          [50, 60, 70],
+          [(50, 20), (60, 24), (70, 28)],
+          [(50, 30), (60, 36), (70, 42)],
+          [(50, 36), (60, 43), (70, 50)]]
+
+print '%-28s %-26s %10s %8s' % ('params', 'pts_l', 'error', 'time')
+for params in [[1.5, 0.8, 0.5, 0.3, 2.0], [2.0, 0.5, 2.0, 1.0, 0.5]]:
+    ref = func_ex(params, ns, [140, 150, 160])
+    for pts_l in pts_ls:
+        start = time.time()
+        fs = func_ex(params, ns, pts_l)
+        elapsed = time.time() - start
+        error = abs(fs - ref).sum() / ref.sum()
+        print '%-28s %-26s %10.2e %8.3f' % (params, pts_l, error, elapsed)
@@ -0,0 +1,25 @@
+"""
+Timing of exponential growth specified as a Python function versus as a
+dadi.Schedules.Exponential, compared with constant population sizes.
+"""
+import time
+
+import dadi
+
+T = 2.0
+nu0, nuF = 0.5, 3.0
+growth_funcs = [('lambda', lambda t: nu0 * (nuF/nu0)**(t/T)),
+                ('Schedule', dadi.Schedules.Exponential(nu0, nuF, T)),
+                ('constant', nu0)]
+
+print '%6s %10s %10s %10s' % tuple(['pts'] + [name for name, f in growth_funcs])
+for pts in [20, 40, 60, 100]:
+    xx = dadi.Numerics.default_grid(pts)
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    times = []
+    for name, nu1 in growth_funcs:
+        start = time.time()
+        dadi.Integration.two_pops(phi, xx, T, nu1=nu1, nu2=2, m12=1, m21=1)
+        times.append(time.time() - start)
+    print '%6i %10.3f %10.3f %10.3f' % tuple([pts] + times)
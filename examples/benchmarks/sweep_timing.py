@@ -0,0 +1,50 @@
+"""
+Timing of the individual x, y, and z sweeps of the ADI integration.
+
+The x sweeps solve systems that run down the columns of phi, so without
+blocking their memory access is strided. This compares the time per sweep in
+each direction for a constant-parameter integration over a range of grid
+sizes.
+"""
+import timeit
+
+import numpy
+
+import dadi
+from dadi import Integration, integration_c as int_c
+
+repeats = 20
+
+def time_sweep(sweep, phi, a, b, c, dt):
+    # Copy so that every repetition starts from the same phi.
+    timer = timeit.Timer(lambda: sweep(phi.copy(), a, b, c, dt))
+    return min(timer.repeat(3, repeats))/repeats
+
+print '2D sweeps (seconds per sweep)'
+print '%6s %12s %12s %8s' % ('pts', 'x', 'y', 'x/y')
+for pts in [100, 150, 200, 300]:
+    xx = dadi.Numerics.default_grid(pts)
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    ax, bx, cx, ay, by, cy = Integration._two_pops_const_abc(xx, xx, 1.2, 0.8,
+                                                             2.0, 1.0, 0, 0,
+                                                             0.5, 0.5)
+    dt = 1e-3
+    tx = time_sweep(int_c.implicit_precalc_2Dx, phi, ax, bx, cx, dt)
+    ty = time_sweep(int_c.implicit_precalc_2Dy, phi, ay, by, cy, dt)
+    print '%6i %12.3g %12.3g %8.2f' % (pts, tx, ty, tx/ty)
+
+print
+print '3D sweeps (seconds per sweep)'
+print '%6s %12s %12s %12s' % ('pts', 'x', 'y', 'z')
+for pts in [40, 60, 100]:
+    xx = dadi.Numerics.default_grid(pts)
+    phi = numpy.random.uniform(size=(pts,pts,pts))
+    a, c = -numpy.ones(phi.shape), -numpy.ones(phi.shape)
+    b = 2*numpy.ones(phi.shape)
+    dt = 1e-3
+    times = [time_sweep(sweep, phi, a, b, c, dt)
+             for sweep in [int_c.implicit_precalc_3Dx,
+                           int_c.implicit_precalc_3Dy,
+                           int_c.implicit_precalc_3Dz]]
+    print '%6i %12.3g %12.3g %12.3g' % tuple([pts] + times)
@@ -0,0 +1,44 @@
+"""
+Convergence in time of the default implicit scheme and of Richardson
+extrapolation in dt (Integration.use_richardson_in_time), as timescale_factor
+is varied.
+
+The model is exponential growth into a bottleneck followed by recovery, with
+migration. Errors are the maximum difference from a reference spectrum
+computed with very fine timesteps, relative to the maximum entry. The error
+of the default scheme falls in proportion to timescale_factor, and that of
+the extrapolated scheme in proportion to its square.
+"""
+import time
+
+import dadi
+
+pts, ns = 60, (20, 20)
+xx = dadi.Numerics.default_grid(pts)
+
+def model():
+    phi = dadi.PhiManip.phi_1D(xx)
+    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    phi = dadi.Integration.two_pops(phi, xx, 0.1,
+                                    nu1=dadi.Schedules.Exponential(1, 0.1, 0.1),
+                                    nu2=0.5, m12=1, m21=1)
+    phi = dadi.Integration.two_pops(phi, xx, 0.5, nu1=2, nu2=3, m12=1, m21=1)
+    return dadi.Spectrum.from_phi(phi, ns, (xx, xx))
+
+dadi.Integration.epoch_cache.enabled = False
+dadi.Integration.timescale_factor = 1e-5
+ref = model()
+
+print '%8s %10s %8s %10s %8s' % ('factor', 'default', 'time', 'richardson',
+                                 'time')
+for factor in [3e-2, 1e-2, 3e-3, 1e-3, 3e-4]:
+    dadi.Integration.timescale_factor = factor
+    results = []
+    for richardson in [False, True]:
+        dadi.Integration.use_richardson_in_time = richardson
+        start = time.time()
+        fs = model()
+        results.extend([abs(fs - ref).max() / abs(ref).max(),
+                        time.time() - start])
+    dadi.Integration.use_richardson_in_time = False
+    print '%8.0e %10.2e %8.3f %10.2e %8.3f' % tuple([factor] + results)
@@ -0,0 +1,106 @@
+/* Microbenchmark of tridiag_interleaved against tridiag_premalloc.
+ *
+ * Solves nsys independent tridiagonal systems of size n, each stored
+ * contiguously as in the y sweeps of 2D integration, one at a time with
+ * tridiag_premalloc and in interleaved groups of several widths with
+ * tridiag_interleaved. Reported are the time per sweep over all systems and
+ * the largest difference from the tridiag_premalloc results.
+ *
+ * Build and run from this directory with, e.g.
+ *   gcc -O2 -I../../dadi tridiag_interleaved.c ../../dadi/tridiag.c \
+ *       ../../dadi/integration_shared.c -lm -o tridiag_interleaved
+ *   ./tridiag_interleaved
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <math.h>
+#include <time.h>
+
+#include "tridiag.h"
+#include "integration_shared.h"
+
+static double now(void){
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + 1e-9*ts.tv_nsec;
+}
+
+int main(void){
+    int sizes[] = {40, 100, 200, 400};
+    int widths[] = {2, 4, 8, 16};
+    int nsizes = 4, nwidths = 4;
+    int ss, ww, n, nsys, reps, rep, kk, ii, width, K;
+    double *a, *b, *c, *bshift, *r, *phi0, *phi, *ref, *work;
+    double dt = 1e-3, start, t_scalar, t, maxdiff;
+
+    printf("%6s %8s %12s", "n", "systems", "premalloc");
+    for(ww=0; ww < nwidths; ww++)
+        printf("        width %2i", widths[ww]);
+    printf("\n");
+
+    for(ss=0; ss < nsizes; ss++){
+        n = sizes[ss];
+        nsys = n;
+        reps = 1 + 20000000/(n*nsys);
+        a = malloc(n*nsys * sizeof(*a));
+        b = malloc(n*nsys * sizeof(*b));
+        c = malloc(n*nsys * sizeof(*c));
+        phi0 = malloc(n*nsys * sizeof(*phi0));
+        phi = malloc(n*nsys * sizeof(*phi));
+        ref = malloc(n*nsys * sizeof(*ref));
+        bshift = malloc(n * sizeof(*bshift));
+        r = malloc(n * sizeof(*r));
+        work = malloc((5*n + 1)*16 * sizeof(*work));
+        srand(1);
+        for(ii=0; ii < n*nsys; ii++){
+            a[ii] = -rand()/(double)RAND_MAX;
+            c[ii] = -rand()/(double)RAND_MAX;
+            b[ii] = -a[ii] - c[ii] + 0.1;
+            phi0[ii] = rand()/(double)RAND_MAX;
+        }
+
+        /* Each system as solved by implicit_precalc_2Dy before. */
+        tridiag_malloc(n);
+        for(ii=0; ii < n*nsys; ii++)
+            ref[ii] = phi0[ii];
+        start = now();
+        for(rep=0; rep < reps; rep++){
+            for(kk=0; kk < nsys; kk++){
+                for(ii=0; ii < n; ii++){
+                    bshift[ii] = b[kk*n + ii] + 1/dt;
+                    r[ii] = 1/dt * ref[kk*n + ii];
+                }
+                tridiag_premalloc(&a[kk*n], bshift, &c[kk*n], r, &ref[kk*n],
+                        n);
+            }
+        }
+        t_scalar = (now() - start)/reps;
+        tridiag_free();
+        printf("%6i %8i %10.1fus", n, nsys, 1e6*t_scalar);
+
+        for(ww=0; ww < nwidths; ww++){
+            width = widths[ww];
+            for(ii=0; ii < n*nsys; ii++)
+                phi[ii] = phi0[ii];
+            start = now();
+            for(rep=0; rep < reps; rep++){
+                for(kk=0; kk < nsys; kk += width){
+                    K = (nsys - kk < width) ? nsys - kk : width;
+                    tridiag_interleaved(&phi[kk*n], &a[kk*n], &b[kk*n],
+                            &c[kk*n], n, 1/dt, 1/dt, n, K, work);
+                }
+            }
+            t = (now() - start)/reps;
+            maxdiff = 0;
+            for(ii=0; ii < n*nsys; ii++)
+                if(fabs(phi[ii] - ref[ii]) > maxdiff)
+                    maxdiff = fabs(phi[ii] - ref[ii]);
+            printf(" %5.2fx (%6.0e)", t_scalar/t, maxdiff);
+        }
+        printf("\n");
+
+        free(a); free(b); free(c); free(phi0); free(phi); free(ref);
+        free(bshift); free(r); free(work);
+    }
+    return 0;
+}
@@ -29,6 +29,17 @@ if compiler in ['unix','mingw32','cygwin']:
 else:
     extra_compile_args = []
 
+# OpenMP is used for the optional multithreaded sweeps in the integration
+# routines (see dadi.Integration.set_num_threads). Apple's compiler does not
+# support it out of the box, and it can be disabled elsewhere by setting
+# DADI_NO_OPENMP in the environment.
+if compiler in ['unix','mingw32','cygwin'] and sys.platform != 'darwin'\
+   and not os.environ.get('DADI_NO_OPENMP'):
+    openmp_compile_args, openmp_link_args = ['-fopenmp'], ['-fopenmp']
+elif compiler == 'msvc' and not os.environ.get('DADI_NO_OPENMP'):
+    openmp_compile_args, openmp_link_args = ['/openmp'], []
+else:
+    openmp_compile_args, openmp_link_args = [], []
 
 # Configure our C modules that are built with f2py.
 tridiag = core.Extension(name = 'dadi.tridiag',
@@ -41,7 +52,9 @@ int_c = core.Extension(name = 'dadi.integration_c',
                                   'dadi/integration3D.c',
                                   'dadi/integration_shared.c',
                                   'dadi/tridiag.c'],
-                         extra_compile_args=extra_compile_args)
+                         extra_compile_args=(extra_compile_args
+                                             + openmp_compile_args),
+                         extra_link_args=openmp_link_args)
 
 # If we're building a distribution, try to update svnversion. Note that this
 # fails silently.